@@ -1,12 +1,18 @@
-from fastapi import APIRouter
-from app.api import music, graph, producer, recommendations
+from fastapi import APIRouter, Depends
+from app.api import music, graph, producer, recommendations, metrics, jam, profiles
+from app.core.admission import admission
 
 router = APIRouter()
 
-router.include_router(music.router, prefix="/music", tags=["music"])
-router.include_router(graph.router, prefix="/graph", tags=["graph"])
-router.include_router(producer.router, prefix="/producer", tags=["producer"])
-router.include_router(recommendations.router, prefix="/recommendations", tags=["recommendations"])
+router.include_router(music.router, prefix="/music", tags=["music"], dependencies=[Depends(admission("music"))])
+router.include_router(graph.router, prefix="/graph", tags=["graph"], dependencies=[Depends(admission("graph"))])
+router.include_router(graph.history_router, prefix="/graph", tags=["graph"])
+router.include_router(producer.router, prefix="/producer", tags=["producer"], dependencies=[Depends(admission("producer"))])
+router.include_router(recommendations.router, prefix="/recommendations", tags=["recommendations"], dependencies=[Depends(admission("recommendations"))])
+# /jam rate-limits itself, before its stream starts
+router.include_router(jam.router, prefix="/jam", tags=["jam"])
+router.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
+router.include_router(profiles.router, prefix="/profiles", tags=["profiles"])
 
 @router.get("/")
 async def api_root():
@@ -1,25 +1,134 @@
-from fastapi import APIRouter, HTTPException
+import logging
+import sqlite3
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from app.core.fastjson import FastJSONRoute
+from app.core.admission import session_key
+from app.core.cancellation import ClientDisconnected, run_while_connected
+from app.core.metrics import metrics
 from app.schemas.graph import GraphUpdateRequest, GraphCommandsResponse
-from app.services.graph_llm_service import get_graph_commands_async
+from app.services.graph_commands import apply_instruction
+from app.services.graph_history import GRAPH_VERSION_HEADER, graph_history
+from app.services.music_prefetch import music_prefetch
+
+logger = logging.getLogger(__name__)
+router = APIRouter(route_class=FastJSONRoute)
+# Version history only reads and moves the shared store, so it is not rate-limited with updates
+history_router = APIRouter(route_class=FastJSONRoute)
+
+
+def _require_session(http_request: Request) -> str:
+    session_id = session_key(http_request)
+    if session_id is None:
+        raise HTTPException(status_code=400, detail="X-Session-ID header is required for graph history")
+    return session_id
 
-router = APIRouter()
 
 @router.post("/update", response_model=GraphCommandsResponse)
-async def update_graph(request: GraphUpdateRequest):
+async def update_graph(request: GraphUpdateRequest, http_request: Request, response: Response):
     """
     Generate graph update commands based on natural language input.
     
     Takes the current graph state and a natural language instruction,
     and returns structured commands to update the graph incrementally.
+    Only the subgraph the instruction concerns is sent to the LLM.
+    The LLM output is applied server-side and reduced to the minimal,
+    already-validated command list, so the client never sees redundant or
+    dangling commands. New nodes are positioned by the server-side layout
+    engine rather than by the LLM. The LLM call is cancelled if the client
+    disconnects.
+
+    With an X-Session-ID header, the result is recorded in the session's
+    version history; its number is returned in the x-graph-version header.
+    Sending it back as base_version with the next update lets the server
+    skip re-reading the whole graph. If the history cannot be written, the
+    commands are still returned, without the header.
     """
     try:
-        commands = await get_graph_commands_async(
-            request.current_graph,
-            request.instruction
+        optimized, updated_graph = await run_while_connected(
+            http_request,
+            apply_instruction(request.current_graph, request.instruction, request.mode),
+            route="graph.update"
         )
-        return commands
+
+        session_id = session_key(http_request)
+        if session_id is not None:
+            music_prefetch.schedule(session_id, updated_graph.nodes, updated_graph.edges)
+            try:
+                version = await graph_history.commit(
+                    session_id,
+                    request.current_graph,
+                    optimized,
+                    request.instruction,
+                    request.base_version
+                )
+                response.headers[GRAPH_VERSION_HEADER] = str(version.number)
+            except sqlite3.Error as e:
+                # The update stands; the client just sends no base_version next time
+                metrics.incr("graph_history_commit_failed", route="graph.update")
+                logger.warning("Graph history commit failed: %s", e)
+        return optimized
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+
+@history_router.get("/history")
+async def list_versions(http_request: Request):
+    """
+    This session's graph versions, oldest first, and the current head.
+
+    Each entry has the version number, its parent, the instruction that
+    produced it (None for versions recording edits made on the client),
+    the number of node/edge changes and the graph size.
+    """
+    return await graph_history.log(_require_session(http_request))
+
+
+@history_router.get("/history/diff", response_model=GraphCommandsResponse)
+async def diff_versions(
+    http_request: Request,
+    from_version: int = Query(..., alias="from"),
+    to_version: int = Query(..., alias="to")
+):
+    """Commands turning version `from` into version `to`"""
+    try:
+        return await graph_history.diff(_require_session(http_request), from_version, to_version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+
+
+@history_router.get("/history/{version}")
+async def get_version(version: int, http_request: Request):
+    """One version's summary and full graph"""
+    try:
+        graph_version = await graph_history.get(_require_session(http_request), version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    return {**graph_version.summary(), "graph": graph_version.graph()}
+
+
+@history_router.post("/history/{version}/checkout")
+async def checkout_version(version: int, http_request: Request, response: Response):
+    """
+    Move the session's head to `version` (undo, redo or jump).
+
+    Returns the commands turning the previous head into this version, and
+    the version's full graph for clients whose edge ids differ from the
+    server's. The next update branches from here; later versions stay
+    available.
+    """
+    session_id = _require_session(http_request)
+    try:
+        commands, graph_version = await graph_history.checkout(session_id, version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+
+    graph = graph_version.graph()
+    music_prefetch.schedule(session_id, graph.nodes, graph.edges)
+    response.headers[GRAPH_VERSION_HEADER] = str(graph_version.number)
+    return {"version": graph_version.number, "commands": commands.commands, "graph": graph}
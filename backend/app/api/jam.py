@@ -0,0 +1,174 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Tuple
+from app.core import fastjson
+from app.core.admission import admission_controller, client_key, session_key
+from app.core.audio_formats import AudioFormat, negotiate_audio_format
+from app.core.fastjson import FastJSONRoute
+from app.core.metrics import metrics
+from app.schemas.graph import CurrentGraph, GraphCommandsResponse
+from app.schemas.jam import JamRequest
+from app.services.ai_producer_service import ai_producer_service
+from app.services.graph_commands import apply_instruction
+from app.services.graph_history import graph_history
+from app.services.music_prefetch import music_prefetch
+from app.services.recommendation_service import recommendation_service
+import asyncio
+import base64
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+router = APIRouter(route_class=FastJSONRoute)
+
+
+def change_context(
+    original: CurrentGraph,
+    commands: GraphCommandsResponse,
+    instruction: str
+) -> str:
+    """Producer context in the same shape the graph page builds it"""
+    added = [c.params.get("label", c.params["id"]) for c in commands.commands if c.action == "createNode"]
+    labels = {node.id: node.data.label for node in original.nodes}
+    removed = [labels[c.params["id"]] for c in commands.commands if c.action == "deleteById" and c.params["id"] in labels]
+
+    if added and not original.nodes:
+        return f'Initial setup: {", ".join(added)}. User said: "{instruction}"'
+    if added:
+        return f'Just added: {", ".join(added)}. User said: "{instruction}"'
+    if removed:
+        return f'Just removed: {", ".join(removed)}. User said: "{instruction}"'
+    if any(c.action == "connectNodes" for c in commands.commands):
+        return f'Just connected elements. User said: "{instruction}"'
+    return instruction
+
+
+def _line(event: Dict[str, Any]) -> bytes:
+    return fastjson.dumps_bytes(event) + b"\n"
+
+
+async def _timed(part: str, work: Awaitable[Dict[str, Any]]) -> Tuple[str, float, Dict[str, Any]]:
+    started = time.monotonic()
+    try:
+        event = await work
+    except Exception as e:
+        logger.error("Jam %s failed: %s", part, e)
+        event = {"type": "error", "part": part, "detail": str(e)}
+    return part, time.monotonic() - started, event
+
+
+async def _recommendations(graph: CurrentGraph) -> Dict[str, Any]:
+    recommendations = await recommendation_service.generate_recommendations_async(graph.nodes, graph.edges)
+    return {"type": "recommendations", "recommendations": recommendations}
+
+
+async def _feedback(graph: CurrentGraph, context: str, audio_format: Optional[AudioFormat]) -> Dict[str, Any]:
+    if audio_format is None:
+        feedback_text, source = await ai_producer_service.analyze_graph_async(graph.nodes, graph.edges, context)
+        return {"type": "feedback", "feedback_text": feedback_text, "source": source}
+
+    feedback_text, audio_bytes = await ai_producer_service.get_producer_feedback(
+        graph.nodes, graph.edges, context, audio_format=audio_format
+    )
+    return {
+        "type": "feedback",
+        "feedback_text": feedback_text,
+        "audio": base64.b64encode(audio_bytes).decode("ascii"),
+        "audio_format": audio_format.name,
+        "media_type": audio_format.media_type,
+    }
+
+
+async def _jam_events(
+    request: JamRequest,
+    session_id: Optional[str],
+    audio_format: Optional[AudioFormat]
+) -> AsyncIterator[bytes]:
+    started = time.monotonic()
+    timings: Dict[str, float] = {}
+
+    try:
+        commands, updated_graph = await apply_instruction(request.current_graph, request.instruction, request.mode)
+    except Exception as e:
+        logger.error("Jam graph update failed: %s", e)
+        yield _line({"type": "error", "part": "commands", "detail": str(e)})
+        return
+    timings["commands"] = time.monotonic() - started
+    version_number = None
+    if session_id is not None:
+        music_prefetch.schedule(session_id, updated_graph.nodes, updated_graph.edges)
+        try:
+            version = await graph_history.commit(
+                session_id,
+                request.current_graph,
+                commands,
+                request.instruction,
+                request.base_version
+            )
+            version_number = version.number
+        except sqlite3.Error as e:
+            # The commands and the other parts still go out, with no version
+            metrics.incr("graph_history_commit_failed", route="jam")
+            logger.warning("Jam graph history commit failed: %s", e)
+    yield _line({"type": "commands", "commands": commands.commands, "version": version_number})
+
+    branches: List[asyncio.Task] = []
+    if request.recommendations:
+        branches.append(asyncio.create_task(_timed("recommendations", _recommendations(updated_graph))))
+    if request.feedback:
+        context = change_context(request.current_graph, commands, request.instruction)
+        branches.append(asyncio.create_task(_timed("feedback", _feedback(updated_graph, context, audio_format))))
+
+    try:
+        for next_done in asyncio.as_completed(branches):
+            part, elapsed, event = await next_done
+            timings[part] = elapsed
+            metrics.observe("jam_branch_seconds", elapsed, part=part)
+            yield _line(event)
+    finally:
+        # Reached early when the client disconnects; abandon whatever is still running
+        for task in branches:
+            task.cancel()
+
+    total = time.monotonic() - started
+    metrics.observe("jam_seconds", total)
+    yield _line({"type": "done", "timings": {**timings, "total": total}})
+
+
+@router.post("")
+async def jam(
+    request: JamRequest,
+    http_request: Request,
+    format: Optional[str] = Query(None, description="mp3, mp3-low, opus or opus-low")
+):
+    """
+    One round trip per voice command.
+
+    Applies the instruction to the graph, then runs recommendations and
+    producer feedback concurrently on the updated graph. The response is
+    NDJSON, one event per line, in completion order:
+
+    - {"type": "commands", "commands": [...], "version": n}: graph commands for the client
+      and the history version they produce (send it back as base_version;
+      null without an X-Session-ID header or if the history could not be written)
+    - {"type": "recommendations", "recommendations": [...]}
+    - {"type": "feedback", "feedback_text": ..., "audio": <base64>, "audio_format": ...}
+    - {"type": "error", "part": ..., "detail": ...}: a branch failed, the others continue
+    - {"type": "done", "timings": {...}}: per-branch and total seconds
+
+    Latency is the graph update plus the slower of the two branches.
+    Each upstream call takes its own slot as it runs, so a slow branch
+    holds nothing the other needs.
+    """
+    try:
+        audio_format = negotiate_audio_format(http_request, format) if request.feedback_audio else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    await admission_controller.check_rate(client_key(http_request), "jam")
+
+    return StreamingResponse(
+        _jam_events(request, session_key(http_request), audio_format),
+        media_type="application/x-ndjson",
+    )
@@ -0,0 +1,25 @@
+import asyncio
+from fastapi import APIRouter
+from app.core.fastjson import FastJSONRoute
+from app.core.admission import KEY_POOLS, admission_controller
+from app.core.metrics import metrics
+from app.core.store import shared_store
+
+router = APIRouter(route_class=FastJSONRoute)
+
+
+@router.get("/")
+async def get_metrics():
+    """
+    Snapshot of in-process metrics for this worker.
+
+    Includes admission queue depth, in-flight upstream calls and rejection
+    counts, per-key load and cooldowns, plus entry counts of the store
+    shared by all workers.
+    """
+    return {
+        "admission": admission_controller.snapshot(),
+        "api_keys": {provider: pool.snapshot() for provider, pool in KEY_POOLS.items()},
+        "shared_store": await asyncio.to_thread(shared_store.stats),
+        **metrics.snapshot(),
+    }
@@ -1,42 +1,81 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+import logging
+import time
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response
+from app.core.admission import session_key
+from app.core.audio_formats import audio_response, negotiate_audio_format
+from app.core.fastjson import FastJSONRoute
+from app.core.cancellation import ClientDisconnected, run_while_connected
 from app.schemas.music import MusicGenerationRequest
+from app.services.music_prefetch import music_prefetch
 from app.services.music_service import music_service
 from app.services.graph_llm_service import graph_to_music_prompt
-import io
 
-router = APIRouter()
+logger = logging.getLogger(__name__)
+router = APIRouter(route_class=FastJSONRoute)
 
 @router.post("/generate")
-async def generate_music(request: MusicGenerationRequest):
+async def generate_music(
+    request: MusicGenerationRequest,
+    http_request: Request,
+    format: Optional[str] = Query(None, description="mp3, mp3-low, opus or opus-low")
+):
     """
     Generate music based on graph data or text prompt
 
     Accepts either:
     - graph_data: Knowledge graph structure (preferred)
     - prompt: Direct text prompt (fallback)
+
+    The audio format comes from ?format=, else from the Accept and
+    Save-Data headers (MP3 by default). With an X-Session-ID header, the
+    format is remembered so the session's speculative prefetch composes
+    the same one.
+
+    Composition is abandoned if the client disconnects before it finishes.
     """
+    started = time.monotonic()
     try:
+        audio_format = negotiate_audio_format(http_request, format)
+
         # Convert graph to prompt if graph_data is provided
         if request.graph_data:
             prompt = graph_to_music_prompt(request.graph_data)
-            print(f"[Music API] Generated prompt from graph: {prompt}")
+            logger.debug("Generated prompt from graph", extra={"prompt": prompt})
         elif request.prompt:
             prompt = request.prompt
         else:
             raise ValueError("Either graph_data or prompt must be provided")
 
-        audio_bytes = await music_service.generate_music(
-            prompt=prompt,
-            duration_ms=request.duration_ms
+        session_id = session_key(http_request)
+        if session_id is not None:
+            key = music_service.cache_key(prompt, request.duration_ms, audio_format)
+            await music_prefetch.record_request(session_id, key, audio_format)
+
+        audio_bytes = await run_while_connected(
+            http_request,
+            music_service.generate_music(
+                prompt=prompt,
+                duration_ms=request.duration_ms,
+                audio_format=audio_format
+            ),
+            route="music.generate"
         )
 
-        return StreamingResponse(
-            io.BytesIO(audio_bytes),
-            media_type="audio/mpeg",
-            headers={
-                "Content-Disposition": "attachment; filename=generated_music.mp3"
-            }
+        return audio_response(
+            audio_bytes,
+            audio_format,
+            route="music.generate",
+            started=started,
+            filename="generated_music"
         )
+    except ClientDisconnected:
+        # Nobody is listening; 499 is only recorded in access logs
+        return Response(status_code=499)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,67 +1,252 @@
-from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from functools import partial
+from typing import Awaitable, Literal, Optional, Tuple
+from app.core.admission import session_key
+from app.core.audio_formats import AudioFormat, audio_response, negotiate_audio_format
+from app.core.config import settings
+from app.core.cancellation import ClientDisconnected, run_while_connected
+from app.core.fastjson import FastJSONRoute
+from app.core.metrics import metrics
+from app.core.store import shared_store
 from app.schemas.producer import ProducerAnalysisRequest, ProducerAnalysisResponse
 from app.services.ai_producer_service import ai_producer_service
-import io
+from app.services.music_prefetch import music_prefetch
+from app.services.producer_openers import producer_openers
+from app.services.producer_sessions import producer_sessions, FeedbackSuperseded
+import asyncio
 import logging
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
+router = APIRouter(route_class=FastJSONRoute)
+
+# Feedback text of opener responses, which cannot carry it as a header;
+# fetched by the X-Feedback-Id of the response once its audio has streamed
+OPENER_FEEDBACK_NAMESPACE = "opener_feedback"
+OPENER_FEEDBACK_TTL_S = 300
+
+
+def _stream_with_opener(
+    pipeline: Awaitable[Tuple[str, bytes]],
+    opener_text: str,
+    opener_clip: bytes,
+    audio_format: AudioFormat,
+    started: float
+) -> StreamingResponse:
+    """
+    Send the opener clip at once and append the feedback audio when it is ready.
+
+    MP3 is a sequence of independent frames, so the two clips play back to
+    back as one stream. If the request is superseded or the pipeline fails,
+    the stream simply ends after the opener.
+
+    The headers go out before the feedback text exists, so X-Feedback-Id
+    names it instead: the text is stored under that id just before the
+    feedback audio is sent, and /feedback/{id} returns it.
+    """
+    task = asyncio.ensure_future(pipeline)
+    feedback_id = uuid.uuid4().hex
+
+    async def body():
+        try:
+            yield opener_clip
+            metrics.observe(
+                "audio_time_to_play_seconds",
+                time.monotonic() - started,
+                route="producer.analyze.opener",
+                format=audio_format.name,
+            )
+            try:
+                feedback_text, audio_bytes = await task
+            except FeedbackSuperseded:
+                logger.info("Producer request superseded after its opener")
+                return
+            except Exception as e:
+                logger.error("Producer pipeline failed after opener: %s", e)
+                return
+            logger.info("Generated feedback (%d chars)", len(feedback_text))
+            await shared_store.set_json_async(
+                OPENER_FEEDBACK_NAMESPACE, feedback_id, {"feedback_text": feedback_text}, ttl=OPENER_FEEDBACK_TTL_S
+            )
+            metrics.observe(
+                "audio_bytes",
+                len(opener_clip) + len(audio_bytes),
+                route="producer.analyze.opener",
+                format=audio_format.name,
+            )
+            yield audio_bytes
+        finally:
+            # Also reached when the client disconnects mid-stream
+            task.cancel()
+
+    return StreamingResponse(
+        body(),
+        media_type=audio_format.media_type,
+        headers={
+            "X-Opener-Text": opener_text,
+            "X-Feedback-Id": feedback_id,
+            "X-Audio-Format": audio_format.name,
+            "Content-Disposition": f"inline; filename=producer_feedback.{audio_format.extension}",
+        }
+    )
 
 
 @router.post("/analyze")
-async def analyze_composition(request: ProducerAnalysisRequest):
+async def analyze_composition(
+    request: ProducerAnalysisRequest,
+    http_request: Request,
+    format: Optional[str] = Query(None, description="mp3, mp3-low, opus or opus-low"),
+    opener: bool = Query(False, description="Stream a pre-synthesized opener while feedback is produced")
+):
     """
     Analyze the current musical composition and get AI producer feedback.
 
     Returns streaming audio response with producer's voice feedback.
+
+    Requests are coalesced per session (X-Session-ID header): edits arriving
+    within PRODUCER_DEBOUNCE_S are merged into one analysis. A request that
+    is overtaken by a newer one from the same session gets 204 No Content.
+    Requests without the header are analyzed on their own, immediately.
+    The pipeline is cancelled if the client disconnects.
+
+    The audio format comes from ?format=, else from the Accept and
+    Save-Data headers (MP3 by default).
+
+    With opener=true and an MP3 format, a short pre-synthesized clip
+    acknowledging the change is streamed immediately and the feedback audio,
+    written not to acknowledge the change a second time, follows in the
+    same response. The feedback text cannot be sent as a header then;
+    X-Opener-Text carries the opener, and X-Feedback-Id the id to fetch the
+    text from /feedback/{id} once the stream has ended.
     """
+    started = time.monotonic()
     try:
-        logger.info(f"Producer analyze request: {len(request.nodes)} nodes, {len(request.edges)} edges")
+        audio_format = negotiate_audio_format(http_request, format)
+        logger.info("Producer analyze request: %d nodes, %d edges", len(request.nodes), len(request.edges))
+
+        picked = None
+        if opener and settings.PRODUCER_OPENERS_ENABLED and audio_format.media_type == "audio/mpeg":
+            picked = producer_openers.pick(request.nodes, request.context, audio_format)
 
-        # Get feedback text and audio
-        feedback_text, audio_bytes = await ai_producer_service.get_producer_feedback(
-            nodes=request.nodes,
-            edges=request.edges,
-            context=request.context
+        session_id = session_key(http_request)
+        run = partial(
+            ai_producer_service.get_producer_feedback,
+            audio_format=audio_format,
+            opened=picked is not None
         )
+        if session_id is not None:
+            music_prefetch.schedule(session_id, request.nodes, request.edges)
+            pipeline = producer_sessions.submit(
+                session_id,
+                nodes=request.nodes,
+                edges=request.edges,
+                context=request.context,
+                run=run
+            )
+        else:
+            pipeline = run(request.nodes, request.edges, request.context)
+
+        if picked is not None:
+            opener_text, opener_clip = picked
+            return _stream_with_opener(
+                pipeline,
+                opener_text,
+                opener_clip,
+                audio_format,
+                started
+            )
 
-        logger.info(f"Generated feedback: {feedback_text[:100]}...")
+        # Get feedback text and audio, debounced per session
+        feedback_text, audio_bytes = await run_while_connected(http_request, pipeline, route="producer.analyze")
+
+        logger.info("Generated feedback (%d chars)", len(feedback_text))
 
         # Return audio as streaming response
-        return StreamingResponse(
-            io.BytesIO(audio_bytes),
-            media_type="audio/mpeg",
-            headers={
-                "X-Feedback-Text": feedback_text,  # Include text in header for debugging/display
-                "Content-Disposition": "inline; filename=producer_feedback.mp3"
-            }
+        return audio_response(
+            audio_bytes,
+            audio_format,
+            route="producer.analyze",
+            started=started,
+            filename="producer_feedback",
+            disposition="inline",
+            headers={"X-Feedback-Text": feedback_text}  # Include text in header for debugging/display
         )
+    except ClientDisconnected:
+        logger.info("Client disconnected, producer pipeline cancelled")
+        return Response(status_code=499)
+    except FeedbackSuperseded:
+        logger.info("Producer request superseded by a newer edit in the same session")
+        return Response(status_code=204, headers={"X-Superseded": "true"})
+    except HTTPException:
+        raise
     except ValueError as e:
-        logger.error(f"Validation error: {str(e)}")
+        logger.error("Validation error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Internal error: {str(e)}", exc_info=True)
+        logger.error("Internal error: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+@router.get("/feedback/{feedback_id}")
+async def get_opener_feedback(feedback_id: str):
+    """
+    Feedback text of an opener response, by its X-Feedback-Id header.
+
+    Stored just before the feedback audio is streamed, so it is there once
+    the response body has ended. 404 if that request was superseded or its
+    pipeline failed, or the text has expired.
+    """
+    entry = await shared_store.get_json_async(OPENER_FEEDBACK_NAMESPACE, feedback_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="No feedback text for this id")
+    return entry
+
+
 @router.post("/analyze-text", response_model=ProducerAnalysisResponse)
-async def analyze_composition_text(request: ProducerAnalysisRequest):
+async def analyze_composition_text(
+    request: ProducerAnalysisRequest,
+    engine: Literal["auto", "local", "llm"] = "auto"
+):
     """
     Get text-only producer feedback without voice generation.
     Useful for testing or when audio is not needed.
+
+    engine:
+    - auto: Gemini, falling back to the local rule engine if it is slow or down
+    - local: instant rule-based feedback, no LLM call
+    - llm: Gemini only, errors are returned to the caller
     """
     try:
-        feedback_text = ai_producer_service.analyze_graph(
-            nodes=request.nodes,
-            edges=request.edges,
-            context=request.context
-        )
+        if engine == "local":
+            feedback_text = ai_producer_service.analyze_graph_local(
+                nodes=request.nodes,
+                edges=request.edges,
+                context=request.context
+            )
+            source = "local"
+        elif engine == "llm":
+            feedback_text = await ai_producer_service.analyze_graph(
+                nodes=request.nodes,
+                edges=request.edges,
+                context=request.context
+            )
+            source = "llm"
+        else:
+            feedback_text, source = await ai_producer_service.analyze_graph_async(
+                nodes=request.nodes,
+                edges=request.edges,
+                context=request.context
+            )
 
         return ProducerAnalysisResponse(
             feedback_text=feedback_text,
-            audio_available=False
+            audio_available=False,
+            source=source
         )
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
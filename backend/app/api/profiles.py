@@ -0,0 +1,44 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse
+from app.core.config import settings
+from app.core.fastjson import FastJSONRoute
+from app.core.profiling import PROFILE_TOKEN_HEADER, profile_store, token_matches
+
+router = APIRouter(route_class=FastJSONRoute)
+
+
+def _check_token(request: Request) -> None:
+    """Profiles expose stacks and request paths, so they are off unless PROFILE_TOKEN is set"""
+    if not settings.PROFILE_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling endpoints are disabled")
+    if not token_matches(request.headers.get(PROFILE_TOKEN_HEADER)):
+        raise HTTPException(status_code=403, detail="Invalid or missing profile token")
+
+
+@router.get("/")
+async def list_profiles(request: Request):
+    """
+    Recent request profiles, newest first.
+
+    Each entry has the route, status, duration and per-span totals; fetch
+    /profiles/{id} for the full spans and folded stack samples. Profiles are
+    read from disk in a worker thread so the event loop keeps serving.
+    """
+    _check_token(request)
+    return {"profiles": await asyncio.to_thread(profile_store.list)}
+
+
+@router.get("/{profile_id}")
+async def download_profile(profile_id: str, request: Request):
+    """
+    Download one profile as JSON.
+
+    `samples` maps folded stacks ("outer;...;inner") to sample counts and can
+    be loaded into speedscope or flamegraph.pl after writing one line per stack.
+    """
+    _check_token(request)
+    path = await asyncio.to_thread(profile_store.path_for, profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return FileResponse(path, media_type="application/json", filename=f"profile-{profile_id}.json")
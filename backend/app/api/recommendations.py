@@ -1,27 +1,32 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+from app.core.cancellation import ClientDisconnected, run_while_connected
+from app.core.fastjson import FastJSONRoute
 from app.schemas.recommendations import RecommendationRequest, RecommendationsResponse, InstrumentRecommendation
 from app.services.recommendation_service import recommendation_service
 import logging
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
+router = APIRouter(route_class=FastJSONRoute)
 
 
 @router.post("/generate", response_model=RecommendationsResponse)
-async def generate_recommendations(request: RecommendationRequest):
+async def generate_recommendations(request: RecommendationRequest, http_request: Request):
     """
     Generate LLM-powered instrument recommendations based on the current graph.
 
     Uses Gemini to analyze the composition and suggest culturally-appropriate
     instruments with explanations for why each instrument would enhance the music.
+    The LLM call is cancelled if the client disconnects.
     """
     try:
-        logger.info(f"Generating recommendations for graph with {len(request.nodes)} nodes, {len(request.edges)} edges")
+        logger.info("Generating recommendations for graph with %d nodes, %d edges", len(request.nodes), len(request.edges))
 
         # Generate recommendations using LLM
-        recommendations_data = recommendation_service.generate_recommendations(
-            nodes=request.nodes,
-            edges=request.edges
+        recommendations_data = await run_while_connected(
+            http_request,
+            recommendation_service.generate_recommendations_async(nodes=request.nodes, edges=request.edges),
+            route="recommendations.generate"
         )
 
         # Convert to Pydantic models
@@ -29,13 +34,18 @@ async def generate_recommendations(request: RecommendationRequest):
             InstrumentRecommendation(**rec) for rec in recommendations_data
         ]
 
-        logger.info(f"Generated {len(recommendations)} recommendations")
+        logger.info("Generated %d recommendations", len(recommendations))
 
         return RecommendationsResponse(recommendations=recommendations)
 
+    except ClientDisconnected:
+        logger.info("Client disconnected, recommendation request cancelled")
+        return Response(status_code=499)
+    except HTTPException:
+        raise
     except ValueError as e:
-        logger.error(f"Validation error: {str(e)}")
+        logger.error("Validation error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Internal error: {str(e)}", exc_info=True)
+        logger.error("Internal error: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
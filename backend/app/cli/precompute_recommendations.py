@@ -0,0 +1,102 @@
+"""
+Offline batch job that precomputes recommendations for common catalog combinations.
+
+Run from backend/ with GOOGLE_API_KEY set:
+    python -m app.cli.precompute_recommendations --size 500 --out data/recommendation_table.bin
+
+The resulting table is memory-mapped by RecommendationService at startup.
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Dict, Any, Iterator, List, Tuple
+from app.core.config import settings
+from app.core.log import setup_logging
+from app.schemas.graph import GraphNode
+from app.services.recommendation_service import (
+    AVAILABLE_GENRES,
+    AVAILABLE_INSTRUMENTS,
+    recommendation_service,
+)
+from app.services.recommendation_table import combination_key, parse_catalog, write_table
+
+
+def common_combinations(size: int) -> Iterator[List[Tuple[str, str]]]:
+    """
+    Yield up to `size` compositions, most common shapes first.
+
+    Order: empty graph, single genre, single instrument, then genre + instrument
+    pairs. Each composition is a list of (label, node_type) pairs.
+    """
+    genres = [name for _, name in parse_catalog(AVAILABLE_GENRES)]
+    instruments = [name for _, name in parse_catalog(AVAILABLE_INSTRUMENTS)]
+
+    def combos():
+        yield []
+        for genre in genres:
+            yield [(genre, "genre")]
+        for instrument in instruments:
+            yield [(instrument, "")]
+        for genre in genres:
+            for instrument in instruments:
+                yield [(genre, "genre"), (instrument, "")]
+
+    for count, combo in enumerate(combos()):
+        if count >= size:
+            return
+        yield combo
+
+
+def _nodes(combo: List[Tuple[str, str]]) -> List[GraphNode]:
+    return [
+        GraphNode(id=f"node-{i}", data={"label": label, "type": node_type})
+        for i, (label, node_type) in enumerate(combo)
+    ]
+
+
+async def precompute(size: int, concurrency: int) -> Dict[str, List[Dict[str, Any]]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    entries: Dict[str, List[Dict[str, Any]]] = {}
+    failures = 0
+
+    async def run(combo: List[Tuple[str, str]]) -> None:
+        nonlocal failures
+        async with semaphore:
+            try:
+                entries[combination_key(label for label, _ in combo)] = (
+                    await recommendation_service.generate_recommendations_async(_nodes(combo), [])
+                )
+            except ValueError as e:
+                failures += 1
+                print(f"[Precompute] Skipping {[label for label, _ in combo]}: {e}")
+
+    await asyncio.gather(*(run(combo) for combo in common_combinations(size)))
+    if failures:
+        print(f"[Precompute] {failures} combinations failed")
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute recommendations for common catalog combinations")
+    parser.add_argument("--size", type=int, default=settings.RECOMMENDATION_TABLE_SIZE, help="Number of combinations to precompute")
+    parser.add_argument("--out", default=settings.RECOMMENDATION_TABLE_PATH, help="Output table path")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent LLM calls")
+    args = parser.parse_args()
+    setup_logging()
+
+    # Never answer the build from a previous table
+    recommendation_service.table = None
+
+    started = time.monotonic()
+    entries = asyncio.run(precompute(args.size, args.concurrency))
+    elapsed = time.monotonic() - started
+
+    if os.path.dirname(args.out):
+        os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    write_table(args.out, entries)
+    print(f"[Precompute] Wrote {len(entries)} combinations to {args.out} in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
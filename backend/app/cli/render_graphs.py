@@ -0,0 +1,335 @@
+"""
+Offline batch renderer for saved graph documents.
+
+Each document is a graph ({"nodes": [...], "edges": [...]}, optionally with
+an "id"), either one per *.json file in a directory or one per line of a
+JSONL file. For every document the job writes the composed music and,
+unless --no-voice, the producer's spoken feedback.
+
+Prompts and feedback text are built across a process pool; compositions
+and TTS run with bounded async concurrency. A document that cannot be read
+or prepared is recorded as failed without stopping the run. When documents
+share an id, later ones (in source order) are renamed to <id>@<file name or
+line>, so no output overwrites another. Finished documents are appended
+to <out>/manifest.jsonl, so an interrupted run resumes where it stopped,
+and <out>/index.json lists every result.
+
+Run from backend/ with ELEVENLABS_API_KEY set:
+    python -m app.cli.render_graphs saved_graphs/ --out renders/
+    python -m app.cli.render_graphs graphs.jsonl --out renders/ --concurrency 4 --format opus
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Dict, Iterator, List, Optional, Set, Tuple
+from pydantic import ValidationError
+from app.core import fastjson
+from app.core.admission import UpstreamLimiter, admission_controller
+from app.core.audio_formats import AUDIO_FORMATS, AudioFormat
+from app.core.log import setup_logging
+from app.schemas.graph import CurrentGraph
+from app.services.ai_producer_service import ai_producer_service
+from app.services.graph_llm_service import graph_to_music_prompt
+from app.services.music_service import music_service
+from app.services.producer_rules import extract_features, render_feedback
+
+MANIFEST_NAME = "manifest.jsonl"
+INDEX_NAME = "index.json"
+
+
+def read_documents(source: str) -> Iterator[Tuple[str, str]]:
+    """
+    Yield (document id, raw JSON) from a directory of *.json files or a JSONL file.
+
+    Ids come from the document's "id" field when present, otherwise the file
+    name (directory) or line number (JSONL).
+    """
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if name.endswith(".json"):
+                with open(os.path.join(source, name), "rb") as f:
+                    yield os.path.splitext(name)[0], f.read().decode("utf-8")
+        return
+
+    with open(source, "rb") as f:
+        for number, line in enumerate(f, start=1):
+            if line.strip():
+                yield f"line-{number}", line.decode("utf-8")
+
+
+def prepare(default_id: str, raw: str) -> Dict[str, Any]:
+    """
+    Parse one document and build its music prompt and feedback text.
+
+    Pure CPU work with no upstream calls, so it runs in the process pool.
+    Never raises: a document that fails comes back with an "error" instead.
+    """
+    try:
+        document = fastjson.loads(raw)
+        graph = CurrentGraph(**document)
+    except ValidationError as e:
+        problems = "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+        return {"id": default_id, "error": f"Invalid graph document: {problems}"}
+    except Exception as e:
+        # Bad JSON, a list instead of an object, ...
+        return {"id": default_id, "error": f"Invalid graph document: {e}"}
+
+    doc_id = str(document.get("id") or default_id)
+    try:
+        return {
+            "id": doc_id,
+            "prompt": graph_to_music_prompt(graph),
+            "feedback_text": render_feedback(extract_features(graph.nodes, graph.edges), None),
+        }
+    except Exception as e:
+        return {"id": doc_id, "error": f"Preparing document failed: {e}"}
+
+
+def _safe_name(doc_id: str) -> str:
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in doc_id)
+
+
+def _unique_id(doc_id: str, default_id: str, taken: Set[str]) -> str:
+    """`doc_id`, qualified by the document's place in the source if an earlier document has its output names"""
+    candidate = doc_id
+    attempt = 1
+    while _safe_name(candidate) in taken:
+        candidate = f"{doc_id}@{default_id}" if attempt == 1 else f"{doc_id}@{default_id}-{attempt}"
+        attempt += 1
+    taken.add(_safe_name(candidate))
+    return candidate
+
+
+def load_manifest(out_dir: str) -> Dict[str, Dict[str, Any]]:
+    """Latest manifest entry per document id"""
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    entries: Dict[str, Dict[str, Any]] = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                entry = fastjson.loads(line)
+            except fastjson.JSONDecodeError:
+                continue  # A line cut short by an interrupted run
+            entries[entry["id"]] = entry
+    return entries
+
+
+class BatchRenderer:
+    def __init__(
+        self,
+        out_dir: str,
+        audio_format: AudioFormat,
+        duration_ms: int,
+        concurrency: int,
+        tts_concurrency: int,
+        voice: bool
+    ):
+        self.out_dir = out_dir
+        self.audio_format = audio_format
+        self.duration_ms = duration_ms
+        self.voice = voice
+        self._compose_slots = asyncio.Semaphore(concurrency)
+        self._tts_slots = asyncio.Semaphore(tts_concurrency)
+        self._manifest = open(os.path.join(out_dir, MANIFEST_NAME), "ab")
+        self.rendered = 0
+        self.failed = 0
+        self.audio_bytes = 0
+
+    def _record(self, entry: Dict[str, Any]) -> None:
+        # One line per finished document, flushed so a crash loses at most the ones in flight
+        self._manifest.write(fastjson.dumps_bytes(entry) + b"\n")
+        self._manifest.flush()
+
+    def _write(self, relative_path: str, audio: bytes) -> None:
+        with open(os.path.join(self.out_dir, relative_path), "wb") as f:
+            f.write(audio)
+        self.audio_bytes += len(audio)
+
+    async def _music(self, prepared: Dict[str, Any]) -> str:
+        async with self._compose_slots:
+            audio = await music_service.generate_music(prepared["prompt"], self.duration_ms, self.audio_format)
+        path = os.path.join("music", f"{_safe_name(prepared['id'])}.{self.audio_format.extension}")
+        self._write(path, audio)
+        return path
+
+    async def _voice(self, prepared: Dict[str, Any]) -> str:
+        async with self._tts_slots:
+            audio = await ai_producer_service.generate_voice_feedback(prepared["feedback_text"], self.audio_format)
+        path = os.path.join("voice", f"{_safe_name(prepared['id'])}.{self.audio_format.extension}")
+        self._write(path, audio)
+        return path
+
+    def _discard(self, relative_path: str) -> None:
+        full_path = os.path.join(self.out_dir, relative_path)
+        self.audio_bytes -= os.path.getsize(full_path)
+        os.remove(full_path)
+
+    async def _all_or_nothing(self, parts: List[Awaitable[str]]) -> List[str]:
+        """
+        Run a document's parts concurrently; if one fails, cancel the rest
+        and delete whatever they wrote, so a failed entry leaves no files.
+        """
+        tasks = [asyncio.ensure_future(part) for part in parts]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            for result in results:
+                if isinstance(result, str):
+                    self._discard(result)
+            raise
+
+    async def render(self, prepared: Dict[str, Any]) -> None:
+        started = time.monotonic()
+        entry: Dict[str, Any] = {"id": prepared["id"], "format": self.audio_format.name}
+        try:
+            if "error" in prepared:
+                raise ValueError(prepared["error"])
+            entry["prompt"] = prepared["prompt"]
+            parts = [self._music(prepared)]
+            if self.voice:
+                entry["feedback_text"] = prepared["feedback_text"]
+                parts.append(self._voice(prepared))
+            paths = await self._all_or_nothing(parts)
+            entry["music"] = paths[0]
+            if self.voice:
+                entry["voice"] = paths[1]
+            entry["status"] = "ok"
+            self.rendered += 1
+        except Exception as e:
+            entry["status"] = "failed"
+            entry["error"] = str(e)
+            self.failed += 1
+            print(f"[Render] {prepared['id']} failed: {e}")
+        entry["seconds"] = round(time.monotonic() - started, 3)
+        self._record(entry)
+
+    def close(self) -> None:
+        self._manifest.close()
+
+
+async def render_all(
+    documents: List[Tuple[str, str]],
+    renderer: BatchRenderer,
+    done: Dict[str, Dict[str, Any]],
+    workers: Optional[int]
+) -> Tuple[int, float]:
+    """
+    Prepare documents in a process pool and render each as soon as it is ready.
+
+    Prepared documents are taken in source order, so which of two documents
+    sharing an id keeps it is the same on every run (and resumes match).
+    Renders already scheduled are awaited even if preparing stops early.
+
+    Returns:
+        Tuple of (documents skipped as already rendered, seconds spent preparing)
+    """
+    loop = asyncio.get_running_loop()
+    renders: List[asyncio.Task] = []
+    skipped = 0
+    prep_started = time.monotonic()
+
+    taken: Set[str] = set()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = [(doc_id, asyncio.wrap_future(pool.submit(prepare, doc_id, raw))) for doc_id, raw in documents]
+            for default_id, future in pending:
+                try:
+                    prepared = await future
+                except Exception as e:
+                    # A crashed worker or an unpicklable result; the other documents go on
+                    prepared = {"id": default_id, "error": f"Preparing document failed: {e}"}
+                prepared["id"] = _unique_id(prepared["id"], default_id, taken)
+                if done.get(prepared["id"], {}).get("status") == "ok":
+                    skipped += 1
+                    continue
+                renders.append(loop.create_task(renderer.render(prepared)))
+        prep_seconds = time.monotonic() - prep_started
+    finally:
+        # Let scheduled renders finish and reach the manifest whatever happened above
+        await asyncio.gather(*renders, return_exceptions=True)
+
+    return skipped, prep_seconds
+
+
+def write_index(out_dir: str, summary: Dict[str, Any]) -> str:
+    entries = load_manifest(out_dir)
+    path = os.path.join(out_dir, INDEX_NAME)
+    with open(path, "wb") as f:
+        f.write(fastjson.dumps_bytes({"summary": summary, "results": sorted(entries.values(), key=lambda e: e["id"])}))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render music (and producer voice) for saved graph documents")
+    parser.add_argument("source", help="Directory of *.json graph documents, or a JSONL file")
+    parser.add_argument("--out", required=True, help="Output directory for audio, manifest and index")
+    parser.add_argument("--format", default="mp3", choices=sorted(AUDIO_FORMATS), help="Audio format")
+    parser.add_argument("--duration-ms", type=int, default=10000, help="Music length per document")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent music compositions")
+    parser.add_argument("--tts-concurrency", type=int, default=4, help="Concurrent TTS calls")
+    parser.add_argument("--workers", type=int, default=None, help="Prompt-building processes (default: CPU count)")
+    parser.add_argument("--no-voice", action="store_true", help="Skip producer voice feedback")
+    parser.add_argument("--fresh", action="store_true", help="Ignore the manifest and render everything again")
+    args = parser.parse_args()
+    setup_logging()
+
+    for sub in ("music", "voice"):
+        os.makedirs(os.path.join(args.out, sub), exist_ok=True)
+    if args.fresh and os.path.exists(os.path.join(args.out, MANIFEST_NAME)):
+        os.remove(os.path.join(args.out, MANIFEST_NAME))
+    done = load_manifest(args.out)
+
+    # Compositions and TTS are bounded by the flags above, not by the server's per-worker cap
+    admission_controller.upstreams["elevenlabs"] = UpstreamLimiter(
+        "elevenlabs",
+        max_concurrent=args.concurrency + args.tts_concurrency,
+        max_queue=0,
+    )
+
+    documents = list(read_documents(args.source))
+    renderer = BatchRenderer(
+        args.out,
+        AUDIO_FORMATS[args.format],
+        args.duration_ms,
+        args.concurrency,
+        args.tts_concurrency,
+        voice=not args.no_voice,
+    )
+
+    started = time.monotonic()
+    try:
+        skipped, prep_seconds = asyncio.run(render_all(documents, renderer, done, args.workers))
+    finally:
+        renderer.close()
+    elapsed = time.monotonic() - started
+
+    summary = {
+        "documents": len(documents),
+        "rendered": renderer.rendered,
+        "failed": renderer.failed,
+        "skipped": skipped,
+        "seconds": round(elapsed, 3),
+        "prepare_seconds": round(prep_seconds, 3),
+        "documents_per_minute": round(renderer.rendered / elapsed * 60, 2) if elapsed else 0.0,
+        "audio_seconds_per_second": round(renderer.rendered * args.duration_ms / 1000 / elapsed, 2) if elapsed else 0.0,
+        "audio_megabytes": round(renderer.audio_bytes / 1e6, 2),
+    }
+    index_path = write_index(args.out, summary)
+    print(
+        f"[Render] {renderer.rendered} rendered, {renderer.failed} failed, {skipped} already done "
+        f"in {elapsed:.1f}s ({summary['documents_per_minute']} docs/min, "
+        f"{summary['audio_seconds_per_second']}s of music per second, prompts built in {prep_seconds:.2f}s)"
+    )
+    print(f"[Render] Index written to {index_path}")
+
+
+if __name__ == "__main__":
+    main()
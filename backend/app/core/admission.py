@@ -0,0 +1,235 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException, Request
+from app.core.config import settings
+from app.core.key_pool import elevenlabs_keys, gemini_keys
+from app.core.metrics import metrics
+from app.core.store import shared_store
+
+
+# Upstream providers with a concurrency cap, scaled by their key pool size
+KEY_POOLS = {"elevenlabs": elevenlabs_keys, "gemini": gemini_keys}
+
+# Token buckets live in the shared store so every worker draws on the same
+# budget; one idle this long is full again and its row expires
+RATE_LIMIT_NAMESPACE = "rate_limits"
+BUCKET_IDLE_SECONDS = 600
+
+
+def client_key(request: Request) -> str:
+    """
+    Identify the caller for rate limiting.
+
+    Without trusted proxies this is the socket peer address. Behind
+    TRUSTED_PROXY_HOPS reverse proxies (Render's load balancer is one), it
+    is the X-Forwarded-For entry the outermost of them appended: each proxy
+    appends the address it received the request from, so entries further
+    left were supplied by the client and cannot be trusted.
+    """
+    peer = request.client.host if request.client else "unknown"
+    hops = settings.TRUSTED_PROXY_HOPS
+    if hops <= 0:
+        return peer
+    forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    if len(forwarded) < hops:
+        # Reached us without passing through every proxy
+        return peer
+    return forwarded[-hops]
+
+
+def session_key(request: Request) -> Optional[str]:
+    """
+    Identify the composition session from the X-Session-ID header (one per browser tab).
+
+    Returns None when the header is absent: callers behind one NAT share a
+    client address, so it cannot stand in for a session. Per-session
+    features (producer debouncing, music prefetch, graph history) are
+    skipped for such requests.
+    """
+    return request.headers.get("x-session-id") or None
+
+
+def _retry_after(seconds: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+class UpstreamBusy(HTTPException):
+    """
+    503 for a call that found its upstream's slots and wait queue full.
+
+    Raised from inside services; they let it through their own error
+    wrapping so the route answers with it unchanged.
+    """
+
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(status_code=503, detail=detail, headers=_retry_after(retry_after))
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `burst`."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: int, tokens: Optional[float] = None, updated: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst) if tokens is None else tokens
+        self.updated = time.time() if updated is None else updated
+
+    def try_acquire(self, now: float) -> float:
+        """
+        Take one token if available.
+
+        Returns:
+            0.0 when a token was taken, otherwise seconds until one is available
+        """
+        # Workers share buckets, so `now` may trail the last update slightly
+        self.tokens = min(self.burst, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(self.updated, now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        if self.rate <= 0:
+            return float(BUCKET_IDLE_SECONDS)
+        return (1 - self.tokens) / self.rate
+
+
+class UpstreamLimiter:
+    """Global concurrency cap with a bounded wait queue for one upstream provider."""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiting = 0
+        # Smoothed slot hold time, used to give callers a sensible Retry-After
+        self.avg_hold_seconds = 5.0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    def estimated_wait(self) -> float:
+        return self.avg_hold_seconds * (self.waiting + 1) / max(1, self.max_concurrent)
+
+    async def acquire(self, timeout: float) -> None:
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            raise UpstreamBusy(f"{self.name} is at capacity, try again shortly", self.estimated_wait())
+
+        self.waiting += 1
+        self._publish()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise UpstreamBusy(f"Timed out waiting for {self.name} capacity", self.estimated_wait())
+        finally:
+            self.waiting -= 1
+            self._publish()
+
+        self.in_flight += 1
+        self._publish()
+
+    def release(self, held_seconds: Optional[float] = None) -> None:
+        self.in_flight -= 1
+        if held_seconds is not None:
+            self.avg_hold_seconds = 0.8 * self.avg_hold_seconds + 0.2 * held_seconds
+        self._semaphore.release()
+        self._publish()
+
+    def _publish(self) -> None:
+        metrics.set_gauge("admission_queue_depth", self.waiting, upstream=self.name)
+        metrics.set_gauge("admission_in_flight", self.in_flight, upstream=self.name)
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "avg_hold_seconds": round(self.avg_hold_seconds, 3),
+        }
+
+
+class AdmissionController:
+    def __init__(self):
+        # Caps scale with the number of keys in each provider's pool and are
+        # global, so each worker process takes its share of them
+        workers = max(1, settings.WEB_CONCURRENCY)
+        self.upstreams: Dict[str, UpstreamLimiter] = {}
+        for name, pool in KEY_POOLS.items():
+            keys = max(1, len(pool))
+            self.upstreams[name] = UpstreamLimiter(
+                name,
+                max_concurrent=math.ceil(settings.UPSTREAM_CONCURRENCY.get(name, 4) * keys / workers),
+                max_queue=math.ceil(settings.UPSTREAM_MAX_QUEUE.get(name, 8) * keys / workers),
+            )
+
+    async def check_rate(self, client_id: str, route_class: str) -> None:
+        """Raise a 429 if this client has exhausted its budget for the route class, on any worker"""
+        rate = settings.RATE_LIMITS.get(route_class, 1.0)
+        burst = settings.RATE_LIMIT_BURST.get(route_class, 5)
+
+        def take(state: Optional[List[float]]) -> Tuple[List[float], float]:
+            bucket = TokenBucket(rate, burst, *(state or ()))
+            wait = bucket.try_acquire(time.time())
+            return [bucket.tokens, bucket.updated], wait
+
+        wait = await shared_store.update_json_async(
+            RATE_LIMIT_NAMESPACE, f"{route_class}:{client_id}", take, ttl=BUCKET_IDLE_SECONDS
+        )
+        if wait > 0:
+            metrics.incr("admission_rejected", route=route_class, reason="rate_limited")
+            raise HTTPException(
+                status_code=429,
+                detail=f"Too many {route_class} requests, slow down",
+                headers=_retry_after(wait),
+            )
+        metrics.incr("admission_admitted", route=route_class)
+
+    @asynccontextmanager
+    async def upstream_slot(self, upstream: str):
+        """
+        Hold one of `upstream`'s slots for a single call to it.
+
+        Slots are taken per upstream call rather than per request, so a
+        request holds nothing while it debounces, answers locally, waits on
+        another upstream or streams its response, and never holds two
+        slots at once.
+
+        Raises:
+            UpstreamBusy: If the wait queue is full or the wait times out
+        """
+        limiter = self.upstreams[upstream]
+        try:
+            await limiter.acquire(settings.ADMISSION_QUEUE_TIMEOUT_S)
+        except UpstreamBusy:
+            metrics.incr("admission_rejected", upstream=upstream, reason="overloaded")
+            raise
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            limiter.release(time.monotonic() - started)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        return {name: limiter.snapshot() for name, limiter in self.upstreams.items()}
+
+
+# Singleton instance
+admission_controller = AdmissionController()
+
+
+def admission(route_class: str):
+    """
+    FastAPI dependency factory that rate-limits callers of a route class.
+
+    Upstream slots are not taken here; services take them around each
+    upstream call (AdmissionController.upstream_slot).
+    """
+
+    async def dependency(request: Request):
+        await admission_controller.check_rate(client_key(request), route_class)
+
+    return dependency
@@ -0,0 +1,127 @@
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Optional
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from app.core.metrics import metrics
+
+
+@dataclass(frozen=True)
+class AudioFormat:
+    """A client-facing audio format and the ElevenLabs output_format that produces it"""
+    name: str
+    output_format: str
+    media_type: str
+    extension: str
+
+
+AUDIO_FORMATS: Dict[str, AudioFormat] = {
+    # ElevenLabs' default; plays everywhere
+    "mp3": AudioFormat("mp3", "mp3_44100_128", "audio/mpeg", "mp3"),
+    # A quarter of the bytes, fine for speech and previews on slow links
+    "mp3-low": AudioFormat("mp3-low", "mp3_22050_32", "audio/mpeg", "mp3"),
+    "opus": AudioFormat("opus", "opus_48000_64", "audio/ogg", "ogg"),
+    "opus-low": AudioFormat("opus-low", "opus_48000_32", "audio/ogg", "ogg"),
+}
+DEFAULT_AUDIO_FORMAT = AUDIO_FORMATS["mp3"]
+
+# Accept media types that select Opus; anything else (including */*) keeps MP3,
+# since not every browser plays Ogg
+_OPUS_MEDIA_TYPES = {"audio/ogg", "audio/opus", "audio/ogg;codecs=opus"}
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def _accepts_opus(accept: str) -> bool:
+    for part in accept.split(","):
+        media_type, *params = [piece.strip().lower() for piece in part.split(";")]
+        quality = next((p[2:] for p in params if p.startswith("q=")), "1")
+        codecs = next((p for p in params if p.startswith("codecs=")), None)
+        full_type = f"{media_type};{codecs}" if codecs else media_type
+        try:
+            accepted = float(quality) > 0
+        except ValueError:
+            accepted = False
+        if accepted and (media_type in _OPUS_MEDIA_TYPES or full_type in _OPUS_MEDIA_TYPES):
+            return True
+    return False
+
+
+def negotiate_audio_format(request: Request, requested: Optional[str] = None) -> AudioFormat:
+    """
+    Pick the output format for an audio response.
+
+    An explicit ?format= wins. Otherwise Opus is used when the Accept header
+    lists audio/ogg or audio/opus, and a Save-Data: on header (sent by
+    browsers in data-saver mode) selects the low-bitrate variant.
+
+    Args:
+        request: Incoming request
+        requested: Value of the format query parameter, if any
+
+    Returns:
+        The negotiated AudioFormat
+
+    Raises:
+        ValueError: If `requested` is not a known format
+    """
+    if requested:
+        audio_format = AUDIO_FORMATS.get(requested.lower())
+        if audio_format is None:
+            raise ValueError(f"Unsupported audio format '{requested}'; choose one of {', '.join(AUDIO_FORMATS)}")
+        return audio_format
+
+    name = "opus" if _accepts_opus(request.headers.get("accept", "")) else "mp3"
+    if request.headers.get("save-data", "").lower() == "on":
+        name += "-low"
+    return AUDIO_FORMATS[name]
+
+
+def audio_response(
+    audio_bytes: bytes,
+    audio_format: AudioFormat,
+    route: str,
+    started: float,
+    filename: str,
+    disposition: str = "attachment",
+    headers: Optional[Dict[str, str]] = None
+) -> StreamingResponse:
+    """
+    Stream audio in chunks and record per-format size and time-to-play.
+
+    The frontend buffers the whole clip before playing, so time-to-play is
+    measured from `started` until the last chunk has been handed to the
+    connection, which includes any time spent waiting on a slow client.
+
+    Args:
+        audio_bytes: Encoded audio
+        audio_format: Format the audio is encoded in
+        route: Metric label for the endpoint
+        started: time.monotonic() when the request arrived
+        filename: Download name without extension
+        disposition: Content-Disposition type
+        headers: Extra response headers
+    """
+    metrics.observe("audio_bytes", len(audio_bytes), route=route, format=audio_format.name)
+
+    async def body() -> AsyncIterator[bytes]:
+        for offset in range(0, len(audio_bytes), STREAM_CHUNK_BYTES):
+            yield audio_bytes[offset:offset + STREAM_CHUNK_BYTES]
+        metrics.observe(
+            "audio_time_to_play_seconds",
+            time.monotonic() - started,
+            route=route,
+            format=audio_format.name,
+        )
+
+    return StreamingResponse(
+        body(),
+        media_type=audio_format.media_type,
+        headers={
+            **(headers or {}),
+            "Content-Disposition": f"{disposition}; filename={filename}.{audio_format.extension}",
+            "Content-Length": str(len(audio_bytes)),
+            "X-Audio-Format": audio_format.name,
+            "Vary": "Accept, Save-Data",
+        },
+    )
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Generic, Hashable, List, Optional, Tuple, TypeVar, Union
+from app.core.metrics import metrics
+
+Item = TypeVar("Item")
+Result = TypeVar("Result")
+
+
+class MicroBatcher(Generic[Item, Result]):
+    """
+    Groups concurrent calls into batches for one upstream call each.
+
+    While fewer than `concurrency` batches are running, an item is sent
+    straight away, so a lightly loaded service adds no latency. Beyond that,
+    items queue for at most `window_s` from the first one queued, or until
+    `max_size` distinct items are waiting, and then go out together (earlier
+    if running batches finish first). Items submitted with the same key as a queued or running
+    item share its slot and its result.
+
+    `run` receives the items of a batch and returns one result per item, in
+    order; an exception in that list fails only its own callers, an
+    exception raised by `run` fails the whole batch. A caller cancelled while
+    queued is left out of the batch; a running batch is cancelled only once
+    every one of its callers has gone.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable[[List[Item]], Awaitable[List[Union[Result, Exception]]]],
+        window_s: float,
+        max_size: int,
+        concurrency: int = 1
+    ):
+        self.name = name
+        self._run = run
+        self.window_s = window_s
+        self.max_size = max_size
+        self.concurrency = concurrency
+        self._pending: Dict[Hashable, Tuple[Item, List[asyncio.Future]]] = {}
+        # Items of running batches: their waiters and the batch's abandon check
+        self._in_flight: Dict[Hashable, Tuple[List[asyncio.Future], Callable[[asyncio.Future], None]]] = {}
+        self._opened_at = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running = 0
+
+    async def submit(self, key: Hashable, item: Item) -> Result:
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+
+        running = self._in_flight.get(key)
+        if running is not None:
+            waiters, abandon = running
+            waiters.append(waiter)
+            waiter.add_done_callback(abandon)
+            metrics.incr("batch_coalesced", batcher=self.name)
+            return await waiter
+
+        entry = self._pending.get(key)
+        if entry is not None:
+            entry[1].append(waiter)
+            metrics.incr("batch_coalesced", batcher=self.name)
+        else:
+            if not self._pending:
+                self._opened_at = time.monotonic()
+            self._pending[key] = (item, [waiter])
+
+        if self._running < self.concurrency or len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_s, self._flush)
+        return await waiter
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch = [
+            (key, item, waiters) for key, (item, waiters) in self._pending.items()
+            if not all(waiter.done() for waiter in waiters)
+        ]
+        self._pending = {}
+        if not batch:
+            return
+
+        metrics.observe("batch_size", len(batch), batcher=self.name)
+        metrics.observe("batch_wait_seconds", time.monotonic() - self._opened_at, batcher=self.name)
+        self._running += 1
+        task = asyncio.get_running_loop().create_task(self._dispatch(batch))
+
+        def _abandon(_: asyncio.Future) -> None:
+            # Waiters lists may grow while the batch runs, so check them all each time
+            if not task.done() and all(waiter.cancelled() for _, _, waiters in batch for waiter in waiters):
+                task.cancel()
+
+        for key, _, waiters in batch:
+            self._in_flight[key] = (waiters, _abandon)
+            for waiter in waiters:
+                waiter.add_done_callback(_abandon)
+
+    async def _dispatch(self, batch: List[Tuple[Hashable, Item, List[asyncio.Future]]]) -> None:
+        try:
+            try:
+                results: List[Union[Result, Exception]] = await self._run([item for _, item, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+        finally:
+            self._running -= 1
+            for key, _, waiters in batch:
+                if self._in_flight.get(key, (None,))[0] is waiters:
+                    del self._in_flight[key]
+
+        for (_, _, waiters), result in zip(batch, results):
+            for waiter in waiters:
+                if waiter.done():
+                    continue
+                if isinstance(result, Exception):
+                    waiter.set_exception(result)
+                else:
+                    waiter.set_result(result)
+
+        if self._running < self.concurrency and self._pending:
+            # Whatever queued behind this batch need not wait out the window
+            self._flush()
@@ -0,0 +1,76 @@
+import asyncio
+import io
+import threading
+import time
+from typing import Any, Awaitable, Callable, Iterable
+from fastapi import Request
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.profiling import span
+
+
+class ClientDisconnected(Exception):
+    """The HTTP client went away before the response was ready"""
+
+
+async def run_while_connected(request: Request, awaitable: Awaitable[Any], route: str) -> Any:
+    """
+    Await `awaitable`, cancelling it as soon as the client disconnects.
+
+    Args:
+        request: The incoming request to watch
+        awaitable: The upstream work backing the response
+        route: Route name used to label aborted-work metrics
+
+    Raises:
+        ClientDisconnected: if the client left before the work finished
+    """
+    task = asyncio.ensure_future(awaitable)
+    started = time.monotonic()
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=settings.DISCONNECT_POLL_S)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                metrics.incr("aborted_requests", route=route)
+                metrics.observe("aborted_after_seconds", time.monotonic() - started, route=route)
+                raise ClientDisconnected()
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+
+async def drain_in_thread(produce: Callable[[], Iterable[bytes]], upstream: str) -> bytes:
+    """
+    Consume a blocking chunk iterator (e.g. an ElevenLabs stream) in a worker thread.
+
+    If the awaiting task is cancelled, the thread stops pulling chunks at the
+    next boundary and closes the iterator, which tears down the upstream
+    connection instead of downloading the rest of the audio.
+    """
+    cancelled = threading.Event()
+
+    def _drain() -> bytes:
+        chunks = produce()
+        buffer = io.BytesIO()
+        try:
+            for chunk in chunks:
+                if cancelled.is_set():
+                    metrics.incr("aborted_upstream_calls", upstream=upstream)
+                    metrics.incr("aborted_upstream_bytes_received", buffer.tell(), upstream=upstream)
+                    break
+                buffer.write(chunk)
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+        return buffer.getvalue()
+
+    try:
+        with span(f"{upstream}.stream"):
+            return await asyncio.to_thread(_drain)
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
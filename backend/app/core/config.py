@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import Any, List, Dict
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = "HackHarvard 2025 API"
@@ -11,6 +11,153 @@ class Settings(BaseSettings):
     ELEVENLABS_API_KEY: str = ""
     ELEVENLABS_VOICE_ID: str = "pNInz6obpgDQGcFmaJgB"  # Adam voice (default, calm professional)
     GOOGLE_API_KEY: str = ""
+    # Extra keys per provider (JSON lists in the environment). Calls go to the
+    # least-loaded key; a key that gets a 429 sits out KEY_COOLDOWN_S, doubling
+    # per consecutive 429 up to KEY_MAX_COOLDOWN_S
+    GOOGLE_API_KEYS: List[str] = []
+    ELEVENLABS_API_KEYS: List[str] = []
+    KEY_COOLDOWN_S: float = 30.0
+    KEY_MAX_COOLDOWN_S: float = 300.0
+
+    # Number of uvicorn worker processes; per-upstream caps are split across them
+    WEB_CONCURRENCY: int = 1
+
+    # SQLite (WAL) store shared by all workers for cached LLM results, audio,
+    # rate limit buckets and producer sessions
+    SHARED_STORE_PATH: str = ".cache/shared_store.db"
+    LLM_CACHE_TTL_S: int = 3600
+    MUSIC_CACHE_TTL_S: int = 86400
+    SESSION_TTL_S: int = 86400
+    FEEDBACK_MEMO_TTL_S: int = 86400
+    # Expired entries (cached audio included) are deleted this often by every worker
+    SHARED_STORE_PURGE_INTERVAL_S: float = 300.0
+
+    # Per-session graph version history, stored as deltas in the shared store and
+    # cached per worker with structural sharing; each session keeps its newest
+    # GRAPH_HISTORY_MAX_VERSIONS versions, each worker caches GRAPH_HISTORY_MAX_SESSIONS
+    GRAPH_HISTORY_MAX_VERSIONS: int = 2000
+    GRAPH_HISTORY_MAX_SESSIONS: int = 1000
+
+    # Precomputed recommendations for common catalog combinations (built by app.cli.precompute_recommendations)
+    RECOMMENDATION_TABLE_PATH: str = "data/recommendation_table.bin"
+    RECOMMENDATION_TABLE_SIZE: int = 500
+
+    # Recommendation cache misses go straight to the LLM while fewer than
+    # RECOMMENDATION_BATCH_CONCURRENCY calls are running (capped at the worker's Gemini
+    # upstream slots, see UPSTREAM_CONCURRENCY); beyond that they wait up to
+    # RECOMMENDATION_BATCH_WINDOW_S and go out as one multi-composition prompt of at most
+    # RECOMMENDATION_BATCH_MAX graphs (1 disables batching). Each extra composition adds
+    # its output decode time to the batch's latency, so keep the maximum small
+    RECOMMENDATION_BATCH_CONCURRENCY: int = 8
+    RECOMMENDATION_BATCH_WINDOW_S: float = 0.25
+    RECOMMENDATION_BATCH_MAX: int = 3
+    RECOMMENDATION_BATCH_MAX_OUTPUT_TOKENS: int = 8192
+
+    # Admission control: per-client token buckets per route class (tokens/second, burst)
+    RATE_LIMITS: Dict[str, float] = {
+        "music": 0.1,
+        "producer": 0.5,
+        "graph": 1.0,
+        "recommendations": 0.5,
+        "jam": 0.5,
+    }
+    RATE_LIMIT_BURST: Dict[str, int] = {
+        "music": 3,
+        "producer": 5,
+        "graph": 10,
+        "recommendations": 5,
+        "jam": 5,
+    }
+    # Concurrency caps and wait-queue bounds per upstream provider, per API key.
+    # A slot is held for one upstream call, not for the whole request
+    UPSTREAM_CONCURRENCY: Dict[str, int] = {"elevenlabs": 4, "gemini": 16}
+    UPSTREAM_MAX_QUEUE: Dict[str, int] = {"elevenlabs": 8, "gemini": 32}
+    ADMISSION_QUEUE_TIMEOUT_S: float = 15.0
+    # Reverse proxies in front of the app that append to X-Forwarded-For (Render: 1).
+    # Rate limits key on the address the outermost one saw; 0 uses the socket peer
+    TRUSTED_PROXY_HOPS: int = 0
+
+    # Producer feedback falls back to the local rule engine past this Gemini latency
+    PRODUCER_LLM_TIMEOUT_S: float = 6.0
+    # Producer requests from one session within this window are merged into one analysis
+    PRODUCER_DEBOUNCE_S: float = 0.75
+    # Pre-synthesized opener clips streamed by /producer/analyze?opener=true while
+    # the real feedback is produced; these formats are synthesized at startup
+    PRODUCER_OPENERS_ENABLED: bool = True
+    PRODUCER_OPENER_FORMATS: List[str] = ["mp3"]
+
+    # Graph prompts include at most this many nodes: the ones the instruction
+    # names, their neighbours within GRAPH_CONTEXT_HOPS, and the section backbone
+    GRAPH_CONTEXT_MAX_NODES: int = 60
+    GRAPH_CONTEXT_HOPS: int = 1
+
+    # How the graph LLM writes commands: "compact" (one "N|id|label|type" style line
+    # per command, far fewer output tokens) or "json" (the verbose action/params form).
+    # Clients always receive the same GraphCommandsResponse.
+    GRAPH_COMMAND_FORMAT: str = "compact"
+
+    # LLM model routing. A request is "light" if its instruction length, referenced
+    # entities and graph size are all within LLM_ROUTE_LIMITS["light"], "standard" if
+    # within LLM_ROUTE_LIMITS["standard"], else "heavy". LLM_ROUTES gives each
+    # service's model and output budget per tier (a missing tier falls back to the
+    # next heavier one the service has, else the next lighter).
+    LLM_ROUTE_LIMITS: Dict[str, Dict[str, int]] = {
+        "light": {"instruction_chars": 60, "entities": 2, "graph_nodes": 12},
+        "standard": {"instruction_chars": 240, "entities": 6, "graph_nodes": 40},
+    }
+    LLM_ROUTES: Dict[str, Dict[str, Dict[str, Any]]] = {
+        "graph": {
+            "light": {"model": "gemini-2.0-flash-lite", "max_output_tokens": 512},
+            "standard": {"model": "gemini-2.0-flash-exp", "max_output_tokens": 2048},
+            "heavy": {"model": "gemini-2.0-flash-exp", "max_output_tokens": 4096},
+        },
+        "producer": {
+            "light": {"model": "gemini-2.0-flash-lite", "max_output_tokens": 120},
+            "standard": {"model": "gemini-2.0-flash-exp", "max_output_tokens": 200},
+        },
+        "recommendations": {
+            "light": {"model": "gemini-2.0-flash-lite", "max_output_tokens": 1024},
+            "standard": {"model": "gemini-2.0-flash-exp", "max_output_tokens": 2048},
+        },
+    }
+
+    # How often long-running routes check whether the client is still connected
+    DISCONNECT_POLL_S: float = 0.25
+
+    # Speculative music prefetch (opt-in): once a session's graph has been stable for
+    # MUSIC_PREFETCH_IDLE_S, compose it into the music cache in the background at the
+    # frontend's default duration. Runs only while more than MUSIC_PREFETCH_RESERVED_SLOTS
+    # ElevenLabs slots are free; each session may start MUSIC_PREFETCH_SESSION_BUDGET
+    # compositions per MUSIC_PREFETCH_BUDGET_WINDOW_S. The format is the one the session's
+    # music requests negotiate; MUSIC_PREFETCH_FORMATS is used until its first request
+    # (Opus: what the frontend's Accept header asks for on Chrome and Firefox).
+    MUSIC_PREFETCH_ENABLED: bool = False
+    MUSIC_PREFETCH_IDLE_S: float = 4.0
+    MUSIC_PREFETCH_DURATION_MS: int = 10000
+    MUSIC_PREFETCH_FORMATS: List[str] = ["opus"]
+    MUSIC_PREFETCH_RESERVED_SLOTS: int = 2
+    MUSIC_PREFETCH_SESSION_BUDGET: int = 5
+    MUSIC_PREFETCH_BUDGET_WINDOW_S: int = 3600
+
+    # Request profiling: on for requests sending X-Profile: 1 with a matching
+    # X-Profile-Token, plus a random PROFILE_SAMPLE_RATE share of requests.
+    # Without PROFILE_TOKEN the header trigger and the /profiles endpoints are off.
+    # At most PROFILE_MAX_CONCURRENT requests per worker are profiled at once.
+    # The newest PROFILE_RING_SIZE profiles are kept in PROFILE_DIR.
+    PROFILE_SAMPLE_RATE: float = 0.0
+    PROFILE_TOKEN: str = ""
+    PROFILE_MAX_CONCURRENT: int = 2
+    PROFILE_INTERVAL_S: float = 0.005
+    PROFILE_DIR: str = ".cache/profiles"
+    PROFILE_RING_SIZE: int = 50
+
+    # Structured logging for the app.* loggers: JSON lines written by a background
+    # thread. Records beyond LOG_QUEUE_SIZE are dropped rather than blocking a request.
+    # LOG_SAMPLE_RATES keeps a share of sub-warning records per logger prefix,
+    # e.g. {"app.services.recommendation_service": 0.1}
+    LOG_LEVEL: str = "INFO"
+    LOG_QUEUE_SIZE: int = 10000
+    LOG_SAMPLE_RATES: Dict[str, float] = {}
 
     class Config:
         env_file = ".env"
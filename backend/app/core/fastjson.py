@@ -0,0 +1,50 @@
+from typing import Any, Callable
+import orjson
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+
+
+# orjson's decode error subclasses json.JSONDecodeError, so existing handlers keep working
+JSONDecodeError = orjson.JSONDecodeError
+
+
+def _default(obj: Any) -> Any:
+    # Pydantic models (e.g. GraphNode) serialize through their own Rust-backed dump
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(exclude_none=True)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> str:
+    """Compact JSON string, several times faster than json.dumps"""
+    return dumps_bytes(obj, sort_keys).decode("utf-8")
+
+
+def dumps_bytes(obj: Any, sort_keys: bool = False) -> bytes:
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return orjson.dumps(obj, default=_default, option=option)
+
+
+def loads(data: Any) -> Any:
+    return orjson.loads(data)
+
+
+class FastJSONRequest(Request):
+    """Request whose JSON body is decoded with orjson"""
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = orjson.loads(await self.body())
+        return self._json
+
+
+class FastJSONRoute(APIRoute):
+    """APIRoute that parses request bodies with orjson before Pydantic validation"""
+
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+
+        async def custom_route_handler(request: Request) -> Response:
+            return await original_route_handler(FastJSONRequest(request.scope, request.receive))
+
+        return custom_route_handler
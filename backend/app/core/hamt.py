@@ -0,0 +1,251 @@
+from typing import Any, Hashable, Iterable, Iterator, Optional, Tuple, Union
+
+# 32-way branching on 5-bit slices of a 64-bit hash: at most 13 levels
+BITS = 5
+MASK = (1 << BITS) - 1
+HASH_MASK = (1 << 64) - 1
+
+# Marks a key absent on one side of a diff
+MISSING: Any = object()
+
+
+class _Leaf:
+    __slots__ = ("hash", "key", "value")
+
+    def __init__(self, key_hash: int, key: Hashable, value: Any):
+        self.hash = key_hash
+        self.key = key
+        self.value = value
+
+
+class _Collision:
+    """Keys whose full 64-bit hashes are equal"""
+    __slots__ = ("hash", "leaves")
+
+    def __init__(self, key_hash: int, leaves: Tuple[_Leaf, ...]):
+        self.hash = key_hash
+        self.leaves = leaves
+
+
+class _Branch:
+    """Up to 32 children, stored densely; bit i of `bitmap` set when slot i is used"""
+    __slots__ = ("bitmap", "children")
+
+    def __init__(self, bitmap: int, children: Tuple["_Child", ...]):
+        self.bitmap = bitmap
+        self.children = children
+
+    def child(self, index: int) -> Optional["_Child"]:
+        bit = 1 << index
+        if not self.bitmap & bit:
+            return None
+        return self.children[bin(self.bitmap & (bit - 1)).count("1")]
+
+
+_Child = Union[_Leaf, _Collision, _Branch]
+_EMPTY = _Branch(0, ())
+
+
+def _hash(key: Hashable) -> int:
+    return hash(key) & HASH_MASK
+
+
+def _same(a: Any, b: Any) -> bool:
+    return a is b or a == b
+
+
+def _pair(a: Union[_Leaf, _Collision], b: _Leaf, shift: int) -> _Branch:
+    """Smallest branch holding two entries with different hashes"""
+    index_a = (a.hash >> shift) & MASK
+    index_b = (b.hash >> shift) & MASK
+    if index_a == index_b:
+        return _Branch(1 << index_a, (_pair(a, b, shift + BITS),))
+    children = (a, b) if index_a < index_b else (b, a)
+    return _Branch((1 << index_a) | (1 << index_b), children)
+
+
+def _assoc(node: _Child, shift: int, leaf: _Leaf) -> Tuple[_Child, bool]:
+    """(node with `leaf` set, whether the key is new); `node` itself when nothing changed"""
+    if isinstance(node, _Branch):
+        bit = 1 << ((leaf.hash >> shift) & MASK)
+        position = bin(node.bitmap & (bit - 1)).count("1")
+        if not node.bitmap & bit:
+            children = node.children[:position] + (leaf,) + node.children[position:]
+            return _Branch(node.bitmap | bit, children), True
+        child = node.children[position]
+        new_child, added = _assoc(child, shift + BITS, leaf)
+        if new_child is child:
+            return node, False
+        return _Branch(node.bitmap, node.children[:position] + (new_child,) + node.children[position + 1:]), added
+
+    if isinstance(node, _Leaf):
+        if node.key == leaf.key:
+            return (node if _same(node.value, leaf.value) else leaf), False
+        if node.hash == leaf.hash:
+            return _Collision(leaf.hash, (node, leaf)), True
+        return _pair(node, leaf, shift), True
+
+    if node.hash != leaf.hash:
+        return _pair(node, leaf, shift), True
+    for i, existing in enumerate(node.leaves):
+        if existing.key == leaf.key:
+            if _same(existing.value, leaf.value):
+                return node, False
+            return _Collision(node.hash, node.leaves[:i] + (leaf,) + node.leaves[i + 1:]), False
+    return _Collision(node.hash, node.leaves + (leaf,)), True
+
+
+def _dissoc(node: _Child, shift: int, key_hash: int, key: Hashable) -> Optional[_Child]:
+    """`node` without `key`: itself when absent, None when nothing is left"""
+    if isinstance(node, _Branch):
+        bit = 1 << ((key_hash >> shift) & MASK)
+        if not node.bitmap & bit:
+            return node
+        position = bin(node.bitmap & (bit - 1)).count("1")
+        child = node.children[position]
+        new_child = _dissoc(child, shift + BITS, key_hash, key)
+        if new_child is child:
+            return node
+        if new_child is not None:
+            return _Branch(node.bitmap, node.children[:position] + (new_child,) + node.children[position + 1:])
+        children = node.children[:position] + node.children[position + 1:]
+        if not children:
+            return None
+        if shift and len(children) == 1 and not isinstance(children[0], _Branch):
+            # Pull a lone entry up so equal maps keep the same shape
+            return children[0]
+        return _Branch(node.bitmap & ~bit, children)
+
+    if isinstance(node, _Leaf):
+        return None if node.key == key else node
+
+    remaining = tuple(leaf for leaf in node.leaves if leaf.key != key)
+    if len(remaining) == len(node.leaves):
+        return node
+    return remaining[0] if len(remaining) == 1 else _Collision(node.hash, remaining)
+
+
+def _leaves(node: Optional[_Child]) -> Iterator[_Leaf]:
+    if node is None:
+        return
+    if isinstance(node, _Leaf):
+        yield node
+    elif isinstance(node, _Collision):
+        yield from node.leaves
+    else:
+        for child in node.children:
+            yield from _leaves(child)
+
+
+def _diff(a: Optional[_Child], b: Optional[_Child], shift: int) -> Iterator[Tuple[Hashable, Any, Any]]:
+    if a is b:
+        return
+    if isinstance(a, _Branch) and isinstance(b, _Branch):
+        if a.bitmap == b.bitmap:
+            pairs = zip(a.children, b.children)
+        else:
+            used = a.bitmap | b.bitmap
+            indexes = [i for i in range(MASK + 1) if used >> i & 1]
+            pairs = ((a.child(i), b.child(i)) for i in indexes)
+        for child_a, child_b in pairs:
+            if child_a is not child_b:
+                yield from _diff(child_a, child_b, shift + BITS)
+        return
+
+    # Mixed shapes only occur a level or two above a few keys; compare them directly
+    before = {leaf.key: leaf.value for leaf in _leaves(a)}
+    for leaf in _leaves(b):
+        old = before.pop(leaf.key, MISSING)
+        if old is MISSING or not _same(old, leaf.value):
+            yield leaf.key, old, leaf.value
+    for key, old in before.items():
+        yield key, old, MISSING
+
+
+class PersistentMap:
+    """
+    Immutable hash map with structural sharing (a hash array mapped trie).
+
+    set() and delete() return a new map in O(log32 n), copying only the path
+    to the changed key; every other subtree is shared with the original.
+    Setting a key to a value equal to its current one returns the map
+    itself, so unchanged entries never cost memory. diff() skips subtrees
+    two maps share, so comparing a map with one derived from it costs time
+    proportional to the changes, not the size.
+    """
+
+    __slots__ = ("_root", "_count")
+
+    def __init__(self, items: Iterable[Tuple[Hashable, Any]] = ()):
+        root: _Child = _EMPTY
+        count = 0
+        for key, value in items:
+            root, added = _assoc(root, 0, _Leaf(_hash(key), key, value))
+            count += added
+        self._root = root
+        self._count = count
+
+    @classmethod
+    def _make(cls, root: _Child, count: int) -> "PersistentMap":
+        new = cls.__new__(cls)
+        new._root = root
+        new._count = count
+        return new
+
+    def set(self, key: Hashable, value: Any) -> "PersistentMap":
+        root, added = _assoc(self._root, 0, _Leaf(_hash(key), key, value))
+        if root is self._root:
+            return self
+        return self._make(root, self._count + added)
+
+    def delete(self, key: Hashable) -> "PersistentMap":
+        """Map without `key`; the map itself when the key is absent"""
+        root = _dissoc(self._root, 0, _hash(key), key)
+        if root is self._root:
+            return self
+        return self._make(root if root is not None else _EMPTY, self._count - 1)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        key_hash = _hash(key)
+        node: Optional[_Child] = self._root
+        shift = 0
+        while isinstance(node, _Branch):
+            node = node.child((key_hash >> shift) & MASK)
+            shift += BITS
+        if isinstance(node, _Leaf):
+            return node.value if node.key == key else default
+        if isinstance(node, _Collision):
+            for leaf in node.leaves:
+                if leaf.key == key:
+                    return leaf.value
+        return default
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, MISSING) is not MISSING
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return (leaf.key for leaf in _leaves(self._root))
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        return ((leaf.key, leaf.value) for leaf in _leaves(self._root))
+
+    def values(self) -> Iterator[Any]:
+        return (leaf.value for leaf in _leaves(self._root))
+
+    def diff(self, other: "PersistentMap") -> Iterator[Tuple[Hashable, Any, Any]]:
+        """
+        Entries that differ from this map to `other`.
+
+        Yields:
+            (key, value here, value in other), with MISSING for an absent side
+        """
+        return _diff(self._root, other._root, 0)
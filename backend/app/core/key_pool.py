@@ -0,0 +1,166 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional
+from elevenlabs.client import ElevenLabs
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+from app.core.config import settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+_process_key_configured = False
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """True for upstream 429s (ElevenLabs ApiError.status_code, google.api_core ResourceExhausted.code)"""
+    return 429 in (getattr(error, "status_code", None), getattr(error, "code", None))
+
+
+class PooledKey:
+    """One API key with its load and rate-limit state. `name` is safe to log; the secret is not."""
+
+    def __init__(self, name: str, secret: str, make_client: Callable[[str], Any]):
+        self.name = name
+        self.secret = secret
+        self.in_flight = 0
+        self.last_used = 0.0
+        self.cooldown_until = 0.0
+        self.consecutive_rate_limits = 0
+        self._make_client = make_client
+        self._client: Optional[Any] = None
+
+    @property
+    def client(self) -> Any:
+        """Provider client bound to this key, created on first use"""
+        if self._client is None:
+            self._client = self._make_client(self.secret)
+        return self._client
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+
+class KeyPool:
+    """
+    API keys for one provider, handed out least-loaded first.
+
+    Each lease picks the healthy key with the fewest calls in flight (least
+    recently used on ties). A key that gets a 429 cools down for
+    KEY_COOLDOWN_S, doubling on each consecutive 429 up to
+    KEY_MAX_COOLDOWN_S; a successful call resets it. When every key is
+    cooling down, the one that recovers first is used rather than failing
+    outright.
+    """
+
+    def __init__(self, provider: str, secrets: List[str], make_client: Callable[[str], Any]):
+        self.provider = provider
+        self.keys = [
+            PooledKey(f"{provider}-{index}", secret, make_client)
+            for index, secret in enumerate(dict.fromkeys(s for s in secrets if s))
+        ]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _pick(self) -> PooledKey:
+        if not self.keys:
+            raise ValueError(f"No {self.provider} API keys configured")
+        now = time.monotonic()
+        healthy = [key for key in self.keys if key.healthy(now)]
+        if not healthy:
+            metrics.incr("key_pool_exhausted", provider=self.provider)
+            return min(self.keys, key=lambda key: key.cooldown_until)
+        return min(healthy, key=lambda key: (key.in_flight, key.last_used))
+
+    def _publish(self, key: PooledKey) -> None:
+        metrics.set_gauge("key_in_flight", key.in_flight, provider=self.provider, key=key.name)
+        metrics.set_gauge(
+            "key_cooldown_seconds",
+            round(max(0.0, key.cooldown_until - time.monotonic()), 3),
+            provider=self.provider,
+            key=key.name,
+        )
+
+    def _cool_down(self, key: PooledKey) -> None:
+        key.consecutive_rate_limits += 1
+        cooldown = min(
+            settings.KEY_COOLDOWN_S * 2 ** (key.consecutive_rate_limits - 1),
+            settings.KEY_MAX_COOLDOWN_S,
+        )
+        key.cooldown_until = time.monotonic() + cooldown
+        metrics.incr("key_rate_limited", provider=self.provider, key=key.name)
+
+    @contextmanager
+    def lease(self) -> Iterator[PooledKey]:
+        """
+        Hold a key for one upstream call.
+
+        Exceptions raised in the block pass through unchanged; a 429 also
+        puts the key into cooldown.
+
+        Raises:
+            ValueError: If the pool has no keys
+        """
+        key = self._pick()
+        key.in_flight += 1
+        key.last_used = time.monotonic()
+        self._publish(key)
+        outcome = "error"
+        try:
+            yield key
+            outcome = "ok"
+            key.consecutive_rate_limits = 0
+        except BaseException as e:
+            if is_rate_limited(e):
+                outcome = "rate_limited"
+                self._cool_down(key)
+            raise
+        finally:
+            key.in_flight -= 1
+            metrics.incr("key_requests", provider=self.provider, key=key.name, outcome=outcome)
+            self._publish(key)
+
+    def snapshot(self) -> List[dict]:
+        now = time.monotonic()
+        return [
+            {
+                "key": key.name,
+                "in_flight": key.in_flight,
+                "healthy": key.healthy(now),
+                "cooldown_remaining_s": round(max(0.0, key.cooldown_until - now), 3),
+            }
+            for key in self.keys
+        ]
+
+
+def configure_process_key(api_key: str, reason: str) -> None:
+    """
+    Fall back to the SDK's process-wide key when per-key clients cannot be bound.
+
+    Only the first key is configured, so every Gemini call goes out on it and
+    the pool no longer spreads load across keys; the warning says why, once.
+    """
+    global _process_key_configured
+    if _process_key_configured:
+        return
+    logger.warning("Gemini key pool disabled (%s); all calls use one key via genai.configure()", reason)
+    genai.configure(api_key=api_key)
+    _process_key_configured = True
+
+
+def _gemini_client(api_key: str) -> Optional[Any]:
+    # genai.configure() only holds one global key; a manager per key keeps them apart.
+    # _ClientManager is private, hence the exact google-generativeai pin in requirements.txt
+    manager_class = getattr(genai_client, "_ClientManager", None)
+    if manager_class is None:
+        configure_process_key(api_key, "google.generativeai.client._ClientManager is missing")
+        return None
+    manager = manager_class()
+    manager.configure(api_key=api_key)
+    return manager
+
+
+# Singleton instances; the single-key settings are folded into the pools
+gemini_keys = KeyPool("gemini", [settings.GOOGLE_API_KEY, *settings.GOOGLE_API_KEYS], _gemini_client)
+elevenlabs_keys = KeyPool("elevenlabs", [settings.ELEVENLABS_API_KEY, *settings.ELEVENLABS_API_KEYS], lambda api_key: ElevenLabs(api_key=api_key))
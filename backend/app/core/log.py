@@ -0,0 +1,164 @@
+import atexit
+import contextvars
+import copy
+import logging
+import queue
+import random
+import sys
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+from app.core import fastjson
+from app.core.config import settings
+from app.core.metrics import metrics
+
+REQUEST_ID_HEADER = "x-request-id"
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "request_id"}
+
+_listener: Optional[QueueListener] = None
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line; runs on the listener thread, never on the event loop"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return fastjson.dumps(entry)
+
+
+class _ContextFilter(logging.Filter):
+    """
+    Per-logger sampling plus request-ID tagging, applied in the caller's
+    context before the record is queued.
+
+    Warnings and errors are never sampled out. Sampling rates come from
+    LOG_SAMPLE_RATES and match on the longest logger-name prefix.
+    """
+
+    def __init__(self, sample_rates: Dict[str, float]):
+        super().__init__()
+        self._prefixes = sorted(sample_rates.items(), key=lambda item: -len(item[0]))
+        self._rates: Dict[str, float] = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._rates.get(name)
+        if rate is None:
+            rate = next(
+                (value for prefix, value in self._prefixes if name == prefix or name.startswith(f"{prefix}.")),
+                1.0,
+            )
+            self._rates[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            rate = self._rate(record.name)
+            if rate < 1.0 and random.random() >= rate:
+                return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when the queue is full"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only resolve what must be captured now (message args, traceback);
+        # JSON formatting happens on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.incr("log_records_dropped")
+
+
+def setup_logging() -> None:
+    """
+    Route the `app` logger hierarchy through a bounded queue to a background
+    thread that formats JSON lines onto stdout.
+
+    Calling code only pays for a filter check and a queue put; formatting
+    and the blocking stdout write happen on the listener thread. Safe to
+    call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    handler = _NonBlockingQueueHandler(log_queue)
+    handler.addFilter(_ContextFilter(settings.LOG_SAMPLE_RATES))
+
+    app_logger = logging.getLogger("app")
+    app_logger.handlers = [handler]
+    app_logger.setLevel(settings.LOG_LEVEL)
+    app_logger.propagate = False
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JSONFormatter())
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestIDMiddleware:
+    """
+    ASGI middleware that tags every log record of a request with its ID.
+
+    Uses the caller's X-Request-ID when present, otherwise generates one,
+    and echoes it in the response so client and server logs can be joined.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(REQUEST_ID_HEADER.encode())
+        request_id = incoming.decode("latin-1")[:64] if incoming else uuid.uuid4().hex[:16]
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (REQUEST_ID_HEADER.encode(), request_id.encode())]
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
@@ -0,0 +1,72 @@
+import threading
+from typing import Dict, Any, Tuple
+
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_name(name: str, labels: LabelKey) -> str:
+    if not labels:
+        return name
+    inner = ",".join(f"{k}={v}" for k, v in labels)
+    return f"{name}{{{inner}}}"
+
+
+class MetricsRegistry:
+    """
+    Minimal in-process metrics registry.
+
+    Counters only go up, gauges hold the latest value, and observations
+    keep count/sum/max so averages can be derived without storing samples.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._gauges: Dict[Tuple[str, LabelKey], float] = {}
+        self._observations: Dict[Tuple[str, LabelKey], Dict[str, float]] = {}
+
+    def incr(self, name: str, amount: float = 1, **labels: Any) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels: Any) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            stats = self._observations.get(key)
+            if stats is None:
+                self._observations[key] = {"count": 1, "sum": value, "max": value}
+            else:
+                stats["count"] += 1
+                stats["sum"] += value
+                if value > stats["max"]:
+                    stats["max"] = value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a JSON-serializable copy of all metrics"""
+        with self._lock:
+            observations = {}
+            for (name, labels), stats in self._observations.items():
+                observations[_format_name(name, labels)] = {
+                    **stats,
+                    "avg": stats["sum"] / stats["count"] if stats["count"] else 0.0,
+                }
+            return {
+                "counters": {_format_name(n, l): v for (n, l), v in self._counters.items()},
+                "gauges": {_format_name(n, l): v for (n, l), v in self._gauges.items()},
+                "observations": observations,
+            }
+
+
+# Singleton instance
+metrics = MetricsRegistry()
@@ -0,0 +1,254 @@
+import asyncio
+import contextvars
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from types import FrameType
+from typing import Any, Dict, Iterator, List, Optional
+from app.core import fastjson
+from app.core.config import settings
+from app.core.metrics import metrics
+
+PROFILE_HEADER = "x-profile"
+PROFILE_TOKEN_HEADER = "x-profile-token"
+
+# Frames deeper than this are cut off the bottom of folded stacks
+MAX_STACK_DEPTH = 64
+
+_current_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+
+
+def token_matches(token: Optional[str]) -> bool:
+    """True if `token` is the configured PROFILE_TOKEN; always False when none is configured"""
+    expected = settings.PROFILE_TOKEN
+    return bool(expected) and token is not None and hmac.compare_digest(token.encode(), expected.encode())
+
+
+def _fold(frame: Optional[FrameType]) -> str:
+    """Collapse a stack to 'outer;...;inner' (flamegraph.pl / speedscope folded format)"""
+    names: List[str] = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler(threading.Thread):
+    """
+    Statistical profiler: snapshots every thread's stack at a fixed interval.
+
+    Samples cover the whole process while the request is in flight (the
+    event loop is shared), so concurrent requests show up too; the span
+    breakdown is the per-request part.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != self.ident:
+                    self.samples[_fold(frame)] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+class RequestProfile:
+    """Spans and stack samples for one request"""
+
+    def __init__(self, method: str, path: str, trigger: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.created_at = time.time()
+        self.started = time.monotonic()
+        self.status: Optional[int] = None
+        self.spans: List[Dict[str, Any]] = []
+        self.sampler = StackSampler(settings.PROFILE_INTERVAL_S)
+
+    def add_span(self, name: str, start: float, end: float, error: Optional[str]) -> None:
+        self.spans.append({
+            "name": name,
+            "start_s": round(start - self.started, 6),
+            "duration_s": round(end - start, 6),
+            **({"error": error} if error else {}),
+        })
+
+    def to_dict(self, duration: float) -> Dict[str, Any]:
+        breakdown: Dict[str, Dict[str, float]] = {}
+        for entry in self.spans:
+            stats = breakdown.setdefault(entry["name"], {"count": 0, "total_s": 0.0})
+            stats["count"] += 1
+            stats["total_s"] = round(stats["total_s"] + entry["duration_s"], 6)
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "trigger": self.trigger,
+            "created_at": self.created_at,
+            "duration_s": round(duration, 6),
+            "span_breakdown": breakdown,
+            "spans": self.spans,
+            "sample_interval_s": self.sampler.interval,
+            "samples": dict(self.sampler.samples.most_common()),
+        }
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """
+    Time a block (typically an upstream await) within the current profile.
+
+    A no-op when the request is not being profiled. Context variables are
+    copied into tasks and to_thread calls, so spans opened there still land
+    in the right request's profile.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+
+    start = time.monotonic()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        profile.add_span(name, start, time.monotonic(), error)
+
+
+class ProfileStore:
+    """
+    Bounded ring buffer of profiles on disk, one JSON file per profile.
+
+    Files are named by creation time, so the oldest are dropped first once
+    more than `capacity` exist. Every worker writes into the same directory.
+    """
+
+    def __init__(self, directory: str, capacity: int):
+        self.directory = directory
+        self.capacity = capacity
+
+    def _files(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(".json"))
+
+    def write(self, profile: Dict[str, Any]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{time.time_ns()}-{profile['id']}.json"
+        tmp_path = os.path.join(self.directory, f".{name}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(fastjson.dumps_bytes(profile))
+        os.replace(tmp_path, os.path.join(self.directory, name))
+
+        files = self._files()
+        for old in files[:max(0, len(files) - self.capacity)]:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except FileNotFoundError:
+                pass  # Another worker got there first
+
+    def path_for(self, profile_id: str) -> Optional[str]:
+        for name in self._files():
+            if name.endswith(f"-{profile_id}.json"):
+                return os.path.join(self.directory, name)
+        return None
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Summaries of stored profiles, newest first"""
+        summaries = []
+        for name in reversed(self._files()):
+            try:
+                with open(os.path.join(self.directory, name), "rb") as f:
+                    profile = fastjson.loads(f.read())
+            except (FileNotFoundError, fastjson.JSONDecodeError):
+                continue
+            summaries.append({
+                key: profile.get(key)
+                for key in ("id", "method", "path", "status", "trigger", "created_at", "duration_s", "span_breakdown")
+            })
+        return summaries
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles a request when asked to or when sampled.
+
+    A request is profiled if it sends `X-Profile: 1` with an `X-Profile-Token`
+    matching PROFILE_TOKEN (the header is ignored when none is configured)
+    or wins the PROFILE_SAMPLE_RATE draw. Each profile runs a sampler thread
+    walking every stack, so at most PROFILE_MAX_CONCURRENT run at once and
+    further requests go unprofiled. The profile id is returned in the
+    `X-Profile-ID` response header and the profile is written once the
+    response, including any stream, is done.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.active = 0
+
+    def _trigger(self, headers: Dict[bytes, bytes]) -> Optional[str]:
+        if headers.get(PROFILE_HEADER.encode()) in (b"1", b"true"):
+            if token_matches(headers.get(PROFILE_TOKEN_HEADER.encode(), b"").decode()):
+                return "header"
+        if settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trigger = self._trigger(dict(scope["headers"]))
+        if trigger is not None and self.active >= settings.PROFILE_MAX_CONCURRENT:
+            metrics.incr("profiles_skipped", trigger=trigger, reason="busy")
+            trigger = None
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], trigger)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]
+            await send(message)
+
+        self.active += 1
+        token = _current_profile.set(profile)
+        profile.sampler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _current_profile.reset(token)
+            profile.sampler.stop()
+            self.active -= 1
+            duration = time.monotonic() - profile.started
+            metrics.incr("profiles_captured", trigger=trigger)
+            await asyncio.to_thread(profile_store.write, profile.to_dict(duration))
+
+
+# Singleton instance
+profile_store = ProfileStore(settings.PROFILE_DIR, settings.PROFILE_RING_SIZE)
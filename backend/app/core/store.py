@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from app.core import fastjson
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# A rowid table: values run to megabytes (audio, graph snapshots), and in a
+# WITHOUT ROWID table every lookup landing on a page next to one of them
+# reads its overflow chain, slowing even tiny rate-limit rows ~25x
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (namespace, key)
+)
+"""
+
+
+def cache_key(*parts: Any) -> str:
+    """Stable hash of JSON-serializable parts (Pydantic models included), usable as a store key"""
+    return hashlib.sha256(fastjson.dumps_bytes(parts, sort_keys=True)).hexdigest()
+
+
+class SharedStore:
+    """
+    Key-value store shared by every worker process on the host.
+
+    Backed by a single SQLite database in WAL mode, so readers never block
+    the writer and concurrent workers see each other's entries immediately.
+    Each thread lazily opens its own connection, which also makes the store
+    safe to use after uvicorn spawns worker processes.
+
+    The *_async methods run the same calls in a worker thread; use them on
+    the event loop, where a busy database (busy_timeout is 5 s) or a
+    multi-MB audio row would otherwise stall every request.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, namespace: str, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, value, expires_at),
+        )
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._conn().execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def get_json(self, namespace: str, key: str) -> Optional[Any]:
+        value = self.get(namespace, key)
+        return fastjson.loads(value) if value is not None else None
+
+    def set_json(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.set(namespace, key, fastjson.dumps_bytes(value), ttl)
+
+    def update_json(
+        self,
+        namespace: str,
+        key: str,
+        update: Callable[[Optional[Any]], Tuple[Any, Any]],
+        ttl: Optional[float] = None
+    ) -> Any:
+        """
+        Read-modify-write one JSON entry atomically across workers.
+
+        Args:
+            update: Receives the current value (None if absent or expired) and
+                returns (value to store, result to return)
+
+        Returns:
+            The result `update` returned
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, key, now),
+            ).fetchone()
+            value, result = update(fastjson.loads(row[0]) if row else None)
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, fastjson.dumps_bytes(value), now + ttl if ttl else None),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    async def get_async(self, namespace: str, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self.get, namespace, key)
+
+    async def set_async(self, namespace: str, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        await asyncio.to_thread(self.set, namespace, key, value, ttl)
+
+    async def delete_async(self, namespace: str, key: str) -> None:
+        await asyncio.to_thread(self.delete, namespace, key)
+
+    async def get_json_async(self, namespace: str, key: str) -> Optional[Any]:
+        return await asyncio.to_thread(self.get_json, namespace, key)
+
+    async def set_json_async(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await asyncio.to_thread(self.set_json, namespace, key, value, ttl)
+
+    async def update_json_async(
+        self,
+        namespace: str,
+        key: str,
+        update: Callable[[Optional[Any]], Tuple[Any, Any]],
+        ttl: Optional[float] = None
+    ) -> Any:
+        return await asyncio.to_thread(self.update_json, namespace, key, update, ttl)
+
+    def purge_expired(self) -> int:
+        cursor = self._conn().execute(
+            "DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+        )
+        return cursor.rowcount
+
+    async def purge_periodically(self, interval_s: float) -> None:
+        """Delete expired rows every `interval_s` until cancelled; SQLite reuses the freed pages"""
+        while True:
+            await asyncio.sleep(interval_s)
+            try:
+                purged = await asyncio.to_thread(self.purge_expired)
+            except sqlite3.Error as e:
+                logger.warning("Shared store purge failed: %s", e)
+                continue
+            if purged:
+                logger.info("Purged %d expired shared store entries", purged)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        rows = self._conn().execute(
+            "SELECT namespace, COUNT(*), SUM(LENGTH(value)) FROM kv GROUP BY namespace"
+        ).fetchall()
+        return {ns: {"entries": count, "bytes": size or 0} for ns, count, size in rows}
+
+
+# Singleton instance
+shared_store = SharedStore(settings.SHARED_STORE_PATH)
@@ -1,11 +1,37 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api import router as api_router
+from fastapi.responses import ORJSONResponse
 from app.core.config import settings
+from app.core.log import RequestIDMiddleware, setup_logging
+from app.core.store import shared_store
+
+# JSON log lines for app.* loggers, written off the request path. Set up
+# before the routers are imported, since services log while initializing.
+setup_logging()
+
+from app.api import router as api_router  # noqa: E402
+from app.core.profiling import ProfilingMiddleware  # noqa: E402
+from app.services.producer_openers import producer_openers  # noqa: E402
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Opener clips load in the background so startup is not held up by TTS
+    warm_task = asyncio.create_task(producer_openers.warm()) if settings.PRODUCER_OPENERS_ENABLED else None
+    purge_task = asyncio.create_task(shared_store.purge_periodically(settings.SHARED_STORE_PURGE_INTERVAL_S))
+    yield
+    purge_task.cancel()
+    if warm_task:
+        warm_task.cancel()
+
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 # Set up CORS - Allow all origins for demo (you can restrict this later)
@@ -15,8 +41,16 @@ app.add_middleware(
     allow_credentials=False,  # Must be False when allow_origins is "*"
     allow_methods=["*"],
     allow_headers=["*"],
+    # Response headers the frontend reads cross-origin
+    expose_headers=["X-Feedback-Text", "X-Opener-Text", "X-Feedback-Id", "X-Audio-Format", "X-Superseded", "X-Graph-Version", "Retry-After"],
 )
 
+# Opt-in per-request profiling (X-Profile header or PROFILE_SAMPLE_RATE)
+app.add_middleware(ProfilingMiddleware)
+
+# Outermost, so every log record of a request (profiling included) carries its ID
+app.add_middleware(RequestIDMiddleware)
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
 @app.get("/")
@@ -1,6 +1,9 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Literal, Optional, Dict, Any
 
+# Node types the frontend renders (see CustomNode.tsx); the LLM is asked to use only these
+NODE_TYPES = ("section", "drum", "bassline", "melody", "chord", "synth", "vocal", "fx", "genre")
+
 class Position(BaseModel):
     x: float
     y: float
@@ -23,18 +26,49 @@ class ConnectNodesParams(BaseModel):
 class DeleteByIdParams(BaseModel):
     id: str
 
+class UpdateNodeParams(BaseModel):
+    id: str
+    label: Optional[str] = None
+    type: Optional[str] = None
+    key: Optional[str] = None
+    bpm: Optional[int] = None
+    section: Optional[str] = None
+
+class UpdateEdgeParams(BaseModel):
+    id: str
+    relation: str
+
+# Frontend view modes: directed section layout, or force-directed cluster
+LayoutMode = Literal["structure", "discovery"]
+
 class GraphCommand(BaseModel):
-    action: Literal["createNode", "connectNodes", "deleteById"]
+    action: Literal["createNode", "connectNodes", "deleteById", "updateNode", "updateEdge"]
     params: Dict[str, Any]
 
 class GraphCommandsResponse(BaseModel):
     commands: List[GraphCommand]
 
+class NodeData(BaseModel):
+    """Musical payload of a node; unknown frontend fields are kept as extras"""
+    model_config = ConfigDict(extra="allow")
+
+    label: str = ""
+    type: str = ""
+    key: Optional[str] = None
+    bpm: Optional[int] = None
+    section: Optional[str] = None
+    details: Optional[str] = None
+
 class GraphNode(BaseModel):
     id: str
     type: str = "custom"
-    data: Dict[str, Any]
-    position: Position
+    data: NodeData = Field(default_factory=NodeData)
+    position: Position = Field(default_factory=lambda: Position(x=0, y=0))
+
+class EdgeData(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    relation: Optional[str] = None
 
 class GraphEdge(BaseModel):
     id: str
@@ -44,6 +78,12 @@ class GraphEdge(BaseModel):
     label: Optional[str] = None
     animated: Optional[bool] = None
     style: Optional[Dict[str, Any]] = None
+    data: Optional[EdgeData] = None
+
+    @property
+    def relation(self) -> str:
+        """Edge relation; the frontend sends it as the label, LLM-built graphs in data"""
+        return (self.data.relation if self.data else None) or self.label or ""
 
 class CurrentGraph(BaseModel):
     nodes: List[GraphNode]
@@ -52,4 +92,6 @@ class CurrentGraph(BaseModel):
 class GraphUpdateRequest(BaseModel):
     current_graph: CurrentGraph
     instruction: str
+    base_version: Optional[int] = None  # History version current_graph is at, from the last x-graph-version
+    mode: Optional[LayoutMode] = None  # The client's view mode, used to lay out new nodes
 
@@ -0,0 +1,14 @@
+from typing import Optional
+from pydantic import BaseModel
+from app.schemas.graph import CurrentGraph, LayoutMode
+
+
+class JamRequest(BaseModel):
+    """One voice command: graph update, then recommendations and producer feedback on the result"""
+    current_graph: CurrentGraph
+    instruction: str
+    recommendations: bool = True
+    feedback: bool = True
+    feedback_audio: bool = True  # False returns feedback text only, skipping TTS
+    base_version: Optional[int] = None  # History version current_graph is at, from the last "commands" event
+    mode: Optional[LayoutMode] = None  # The client's view mode, used to lay out new nodes
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any
+from typing import Optional
+from app.schemas.graph import CurrentGraph
 
 class MusicGenerationRequest(BaseModel):
     prompt: Optional[str] = Field(
@@ -7,7 +8,7 @@ class MusicGenerationRequest(BaseModel):
         description="Description of the music to generate (deprecated - use graph_data)",
         example="hiphop style, quick tempo, drums, guitar"
     )
-    graph_data: Optional[Dict[str, Any]] = Field(
+    graph_data: Optional[CurrentGraph] = Field(
         None,
         description="Graph structure with nodes and edges to convert to music"
     )
@@ -1,11 +1,12 @@
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Optional
+from app.schemas.graph import GraphNode, GraphEdge
 
 
 class ProducerAnalysisRequest(BaseModel):
     """Request for AI producer analysis"""
-    nodes: List[Dict[str, Any]]
-    edges: List[Dict[str, Any]]
+    nodes: List[GraphNode]
+    edges: List[GraphEdge]
     context: Optional[str] = None  # Optional context like "just added drums"
 
 
@@ -13,3 +14,4 @@ class ProducerAnalysisResponse(BaseModel):
     """Response containing producer feedback"""
     feedback_text: str
     audio_available: bool = True
+    source: str = "llm"  # "llm", "memo" (reused earlier LLM feedback) or "local" (rule-based engine)
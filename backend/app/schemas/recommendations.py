@@ -1,11 +1,12 @@
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List
+from app.schemas.graph import GraphNode, GraphEdge
 
 
 class RecommendationRequest(BaseModel):
     """Request for LLM-powered instrument recommendations"""
-    nodes: List[Dict[str, Any]]
-    edges: List[Dict[str, Any]]
+    nodes: List[GraphNode]
+    edges: List[GraphEdge]
 
 
 class InstrumentRecommendation(BaseModel):
@@ -1,10 +1,26 @@
-import json
-from typing import Dict, Any, List, Optional
-import google.generativeai as genai
-from elevenlabs.client import ElevenLabs
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+from app.core import fastjson
+from app.core.admission import UpstreamBusy, admission_controller
+from app.core.audio_formats import AudioFormat, DEFAULT_AUDIO_FORMAT
+from app.core.cancellation import drain_in_thread
 from app.core.config import settings
-import io
-
+from app.core.key_pool import elevenlabs_keys, gemini_keys
+from app.core.profiling import span
+from app.schemas.graph import CurrentGraph, GraphNode, GraphEdge
+from app.services.graph_context import referenced_entities
+from app.services.graph_fingerprint import structural_fingerprint, feedback_memo
+from app.services.model_router import Complexity, ModelRoute, model_router
+from app.services.producer_rules import CompositionFeatures, extract_features, render_feedback
+
+logger = logging.getLogger(__name__)
+
+# Feedback sampling; model_router picks the model and max_output_tokens per request
+PRODUCER_GENERATION_CONFIG = {
+    'temperature': 0.7,  # More creative than graph generation
+    'top_p': 0.9,
+}
 
 PRODUCER_SYSTEM_PROMPT = """You are an expert music producer giving real-time feedback on a musical composition.
 
@@ -52,6 +68,9 @@ Examples with context:
 
 CRITICAL: Always start by acknowledging what the user DID before making suggestions.
 
+EXCEPTION - Opener already played:
+If the prompt says a spoken opener has already been played, the user has just heard a short acknowledgement of their change. Do NOT acknowledge the change again and do not open with an exclamation like "Nice!" or "Great!". Start directly with how the change affects the composition (step 2), then give the suggestion (step 3).
+
 CULTURAL AWARENESS - Cross-Cultural Suggestions:
 When appropriate, offer culturally-informed production suggestions that blend global music traditions. Draw from your knowledge of:
 
@@ -92,48 +111,34 @@ Keep it conversational and encouraging: "This Hip-Hop beat would sound amazing w
 """
 
 
-class AIProducerService:
-    def __init__(self):
-        self.gemini_configured = False
-        self.elevenlabs_client = None
-
-        if settings.GOOGLE_API_KEY:
-            genai.configure(api_key=settings.GOOGLE_API_KEY)
-            self.gemini_configured = True
-
-        if settings.ELEVENLABS_API_KEY:
-            self.elevenlabs_client = ElevenLabs(api_key=settings.ELEVENLABS_API_KEY)
+def _memo_key(nodes: List[GraphNode], edges: List[GraphEdge], context: Optional[str], opened: bool) -> str:
+    """Feedback memo key; feedback written to follow an opener is kept apart"""
+    fingerprint = structural_fingerprint(nodes, edges, context)
+    return f"{fingerprint}:opened" if opened else fingerprint
 
-    def analyze_graph(self, nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]], context: Optional[str] = None) -> str:
-        """
-        Analyze the musical graph and generate producer feedback.
 
-        Args:
-            nodes: List of node dictionaries
-            edges: List of edge dictionaries
-            context: Optional context about recent changes
-
-        Returns:
-            Feedback text from the AI producer
-        """
-        if not self.gemini_configured:
-            raise ValueError("GOOGLE_API_KEY not configured")
+class AIProducerService:
+    def __init__(self):
+        self.gemini_configured = bool(gemini_keys)
+        self.elevenlabs_configured = bool(elevenlabs_keys)
 
-        # Create graph summary for the LLM
+    def _build_prompt(
+        self,
+        nodes: List[GraphNode],
+        edges: List[GraphEdge],
+        context: Optional[str],
+        features: CompositionFeatures,
+        opened: bool = False
+    ) -> str:
+        """Build the full Gemini prompt, including the rule engine's findings as stats"""
         graph_summary = {
             "nodes": nodes,
             "edges": edges,
-            "stats": {
-                "total_nodes": len(nodes),
-                "total_edges": len(edges),
-                "node_types": self._count_node_types(nodes),
-                "has_key_info": any(node.get("data", {}).get("key") for node in nodes),
-                "has_bpm_info": any(node.get("data", {}).get("bpm") for node in nodes),
-            }
+            "stats": features.stats(),
         }
 
         # Build the prompt
-        graph_json = json.dumps(graph_summary, indent=2)
+        graph_json = fastjson.dumps(graph_summary)
 
         # Make context VERY prominent in the prompt
         if context:
@@ -146,52 +151,134 @@ The user just made this change. You MUST acknowledge what they just did in your
         else:
             context_section = ""
 
-        full_prompt = f"""{PRODUCER_SYSTEM_PROMPT}
+        if opened:
+            context_section += """
+OPENER ALREADY PLAYED: the user has just heard a short spoken acknowledgement of this change.
+Skip the acknowledgement and start directly with its effect on the composition.
+"""
+
+        return f"""{PRODUCER_SYSTEM_PROMPT}
 
 Current musical graph:
 {graph_json}
 {context_section}
 Provide your producer feedback now (2-3 sentences max):"""
 
-        print(f"[AI Producer] Context: {context}")
-        print(f"[AI Producer] Graph has {len(nodes)} nodes")
+    def _route(self, nodes: List[GraphNode], edges: List[GraphEdge], context: Optional[str]) -> ModelRoute:
+        return model_router.route("producer", Complexity(
+            instruction_chars=len(context or ""),
+            entities=referenced_entities(CurrentGraph(nodes=nodes, edges=edges), context),
+            graph_nodes=len(nodes),
+        ))
+
+    async def analyze_graph(
+        self,
+        nodes: List[GraphNode],
+        edges: List[GraphEdge],
+        context: Optional[str] = None,
+        features: Optional[CompositionFeatures] = None,
+        opened: bool = False
+    ) -> str:
+        """
+        Analyze the musical graph and generate producer feedback with Gemini.
+
+        Args:
+            nodes: Graph nodes
+            edges: Graph edges
+            context: Optional context about recent changes
+            features: Rule engine findings, if already extracted
+
+        Returns:
+            Feedback text from the AI producer
+        """
+        if not self.gemini_configured:
+            raise ValueError("GOOGLE_API_KEY not configured")
+
+        full_prompt = self._build_prompt(nodes, edges, context, features or extract_features(nodes, edges), opened)
 
-        # Use Gemini to generate feedback
-        model = genai.GenerativeModel(
-            model_name='gemini-2.0-flash-exp',
-            generation_config={
-                'temperature': 0.7,  # More creative than graph generation
-                'top_p': 0.9,
-                'max_output_tokens': 200,  # Short responses
-            }
-        )
+        logger.debug("Producer analysis", extra={"context": context, "node_count": len(nodes)})
 
         try:
-            response = model.generate_content(full_prompt)
-            feedback_text = response.text.strip()
-            return feedback_text
+            route = self._route(nodes, edges, context)
+            async with admission_controller.upstream_slot("gemini"):
+                with gemini_keys.lease() as api_key, model_router.timed(route), span("gemini.producer"):
+                    response = await model_router.model(route, PRODUCER_GENERATION_CONFIG, api_key).generate_content_async(full_prompt)
+            return response.text.strip()
+        except UpstreamBusy:
+            raise
         except Exception as e:
             raise ValueError(f"Error generating producer feedback: {e}")
 
-    def _count_node_types(self, nodes: List[Dict[str, Any]]) -> Dict[str, int]:
-        """Count nodes by type"""
-        type_counts = {}
-        for node in nodes:
-            node_type = node.get("data", {}).get("type", "unknown")
-            type_counts[node_type] = type_counts.get(node_type, 0) + 1
-        return type_counts
+    def analyze_graph_local(self, nodes: List[GraphNode], edges: List[GraphEdge], context: Optional[str] = None) -> str:
+        """
+        Rule-based producer feedback from the local analysis engine.
+
+        Needs no API key and answers in milliseconds; used as the instant
+        answer for /analyze-text and as the fallback when Gemini fails.
+        """
+        return render_feedback(extract_features(nodes, edges), context)
+
+    async def analyze_graph_async(
+        self,
+        nodes: List[GraphNode],
+        edges: List[GraphEdge],
+        context: Optional[str] = None,
+        opened: bool = False
+    ) -> Tuple[str, str]:
+        """
+        Ask Gemini for feedback, falling back to the local engine when it is
+        unconfigured, errors out or takes longer than PRODUCER_LLM_TIMEOUT_S.
+
+        Structurally identical compositions (same elements and relations, any
+        ids or positions) with the same context reuse earlier LLM feedback.
+        With `opened`, an opener clip has already acknowledged the change, so
+        the feedback leaves the acknowledgement out (and is memoized apart).
+
+        Returns:
+            Tuple of (feedback_text, source) where source is "llm", "memo" or "local"
+        """
+        fingerprint = _memo_key(nodes, edges, context, opened)
+        memoized = await feedback_memo.get_text(fingerprint)
+        if memoized is not None:
+            return memoized, "memo"
+
+        features = extract_features(nodes, edges)
+
+        if not self.gemini_configured:
+            return render_feedback(features, context, opened), "local"
+
+        try:
+            # The timeout covers waiting for a Gemini slot as well as the call
+            feedback_text = await asyncio.wait_for(
+                self.analyze_graph(nodes, edges, context, features, opened),
+                timeout=settings.PRODUCER_LLM_TIMEOUT_S
+            )
+            # Only LLM answers are memoized; local feedback is cheap to recompute
+            await feedback_memo.put_text(fingerprint, feedback_text)
+            return feedback_text, "llm"
+        except asyncio.TimeoutError:
+            logger.warning("Gemini timed out after %ss, using local feedback", settings.PRODUCER_LLM_TIMEOUT_S)
+        except Exception as e:
+            logger.warning("Gemini error, using local feedback: %s", e)
+
+        return render_feedback(features, context, opened), "local"
 
-    async def generate_voice_feedback(self, feedback_text: str) -> bytes:
+    async def generate_voice_feedback(
+        self,
+        feedback_text: str,
+        audio_format: AudioFormat = DEFAULT_AUDIO_FORMAT
+    ) -> bytes:
         """
         Convert feedback text to speech using ElevenLabs.
 
         Args:
             feedback_text: The producer feedback text
+            audio_format: Encoding to request (default: 128 kbps MP3)
 
         Returns:
-            Audio bytes in MP3 format
+            Audio bytes in the requested format
         """
-        if not self.elevenlabs_client:
+        if not self.elevenlabs_configured:
             raise ValueError("ELEVENLABS_API_KEY not configured")
 
         try:
@@ -199,56 +286,70 @@ Provide your producer feedback now (2-3 sentences max):"""
             # You can customize the voice_id in settings
             voice_id = getattr(settings, 'ELEVENLABS_VOICE_ID', 'pNInz6obpgDQGcFmaJgB')  # Adam voice (default)
 
-            print(f"[AI Producer] Generating voice with voice_id: {voice_id}")
-            print(f"[AI Producer] Text to convert: {feedback_text[:100]}...")
-
-            # Generate speech
-            audio_generator = self.elevenlabs_client.text_to_speech.convert(
-                voice_id=voice_id,
-                text=feedback_text,
-                model_id="eleven_turbo_v2_5",  # Fast, high-quality model
-            )
-
-            # Convert generator to bytes
-            audio_bytes = io.BytesIO()
-            chunk_count = 0
-            for chunk in audio_generator:
-                audio_bytes.write(chunk)
-                chunk_count += 1
-
-            audio_data = audio_bytes.getvalue()
-            print(f"[AI Producer] Generated {len(audio_data)} bytes of audio in {chunk_count} chunks")
+            logger.debug("Generating voice", extra={"voice_id": voice_id, "text_chars": len(feedback_text)})
+
+            # Generate speech, drained off the event loop so it can be abandoned mid-stream
+            async with admission_controller.upstream_slot("elevenlabs"):
+                with elevenlabs_keys.lease() as api_key:
+                    audio_data = await drain_in_thread(
+                        lambda: api_key.client.text_to_speech.convert(
+                            voice_id=voice_id,
+                            text=feedback_text,
+                            model_id="eleven_turbo_v2_5",  # Fast, high-quality model
+                            output_format=audio_format.output_format,
+                        ),
+                        upstream="elevenlabs",
+                    )
+            logger.debug("Generated %d bytes of audio", len(audio_data), extra={"format": audio_format.name})
 
             if len(audio_data) == 0:
                 raise Exception("ElevenLabs returned empty audio")
 
-            # Validate that we got actual MP3 data
+            # Validate that we got actual audio data
             if len(audio_data) < 100:
                 raise Exception(f"Audio data too small ({len(audio_data)} bytes), likely invalid")
 
             return audio_data
 
+        except UpstreamBusy:
+            raise
         except Exception as e:
-            print(f"[AI Producer] Voice generation error: {str(e)}")
+            logger.error("Voice generation error: %s", e)
             raise Exception(f"Voice generation failed: {str(e)}")
 
     async def get_producer_feedback(
         self,
-        nodes: List[Dict[str, Any]],
-        edges: List[Dict[str, Any]],
-        context: Optional[str] = None
+        nodes: List[GraphNode],
+        edges: List[GraphEdge],
+        context: Optional[str] = None,
+        audio_format: AudioFormat = DEFAULT_AUDIO_FORMAT,
+        opened: bool = False
     ) -> tuple:
         """
         Complete producer feedback pipeline: analyze + generate voice.
 
+        A structurally identical composition seen before returns its memoized
+        text and audio without touching Gemini or ElevenLabs. Pass `opened`
+        when an opener clip plays ahead of this feedback.
+
         Returns:
             Tuple of (feedback_text, audio_bytes)
         """
-        # Generate text feedback
-        feedback_text = self.analyze_graph(nodes, edges, context)
+        fingerprint = _memo_key(nodes, edges, context, opened)
+
+        # Generate text feedback (local engine steps in if Gemini is slow or down)
+        feedback_text, source = await self.analyze_graph_async(nodes, edges, context, opened)
+
+        if source == "memo":
+            audio_bytes = await feedback_memo.get_audio(fingerprint, audio_format.output_format)
+            if audio_bytes is not None:
+                return feedback_text, audio_bytes
 
         # Convert to speech
-        audio_bytes = await self.generate_voice_feedback(feedback_text)
+        audio_bytes = await self.generate_voice_feedback(feedback_text, audio_format)
+
+        if source != "local":
+            await feedback_memo.put_audio(fingerprint, audio_format.output_format, audio_bytes)
 
         return feedback_text, audio_bytes
 
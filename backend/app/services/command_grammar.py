@@ -0,0 +1,103 @@
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from app.core.metrics import metrics
+
+# Compact line format for graph commands: a one-letter tag, then positional
+# fields separated by "|". About a quarter of the output tokens of the
+# equivalent {"action": ..., "params": {...}} JSON, and cheap to parse.
+#
+#   N|id|label|type|key|bpm|section    createNode
+#   E|source|target|relation           connectNodes
+#   D|id                               deleteById
+#   U|id|label|type|key|bpm|section    updateNode
+#
+# Trailing fields may be dropped, and an empty field means "not set" (for
+# U: "unchanged").
+
+# tag -> (action, positional fields); required fields are enforced by graph_repair's params models
+GRAMMAR: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+    "N": ("createNode", ("id", "label", "type", "key", "bpm", "section")),
+    "E": ("connectNodes", ("source", "target", "relation")),
+    "D": ("deleteById", ("id",)),
+    "U": ("updateNode", ("id", "label", "type", "key", "bpm", "section")),
+}
+TAGS = {action: tag for tag, (action, _) in GRAMMAR.items()}
+
+SEPARATOR = "|"
+
+COMPACT_RETURN_FORMAT = """One command per line, fields separated by "|". No JSON, no code fences, no other text.
+N|id|label|type|key|bpm|section   createNode (key, bpm and section are optional; omit trailing empty fields)
+E|source|target|relation          connectNodes
+D|id                              deleteById
+U|id|label|type|key|bpm|section   updateNode (leave a field empty to keep its current value)
+Never put "|" or a line break inside a field.
+
+Example:
+N|intro|Intro|section
+N|pads-1|Warm Pads|synth|Am
+E|intro|pads-1|has"""
+
+
+def _field(name: str, value: str) -> Any:
+    # Plain integers are the format's own encoding; anything else ("120bpm")
+    # is left for graph_repair to coerce and count
+    if name == "bpm" and value.isdigit():
+        return int(value)
+    return value
+
+
+def parse_commands(text: str, issues: Optional[Counter] = None) -> List[Dict[str, Any]]:
+    """
+    Expand compact command lines into {"action", "params"} dicts.
+
+    Only the line structure is checked here: params are the raw fields, and
+    lines missing fields still come through, so graph_repair can coerce,
+    fill in or drop them the same way as JSON commands. Blank lines are
+    ignored. Code fences, lines with no "|" (prose around the commands)
+    and lines with an unknown tag are counted in `issues` as "wrapped",
+    "prose_line" and "line_dropped", and the dropped ones in
+    graph_compact_lines_dropped, so one bad line does not lose the rest.
+
+    Args:
+        text: Raw LLM output in the compact format
+        issues: Optional counter the problems are added to
+
+    Returns:
+        List of command dicts, in output order
+    """
+    issues = issues if issues is not None else Counter()
+    commands = []
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if line.startswith("```"):
+            issues["wrapped"] += 1
+            continue
+
+        tag, separator, rest = line.partition(SEPARATOR)
+        spec = GRAMMAR.get(tag.strip().upper())
+        if spec is None:
+            reason = "prose_line" if not separator else "line_dropped"
+            issues[reason] += 1
+            metrics.incr("graph_compact_lines_dropped", reason=reason)
+            continue
+        action, names = spec
+
+        values = [value.strip() for value in rest.split(SEPARATOR)] if rest else []
+        params = {name: _field(name, value) for name, value in zip(names, values) if value}
+        commands.append({"action": action, "params": params})
+    return commands
+
+
+def format_commands(commands: Iterable[Dict[str, Any]]) -> str:
+    """Inverse of parse_commands, for prompts, logs and benchmarks"""
+    lines = []
+    for command in commands:
+        tag = TAGS[command["action"]]
+        _, names = GRAMMAR[tag]
+        values = ["" if command["params"].get(name) is None else str(command["params"][name]) for name in names]
+        while values and not values[-1]:
+            values.pop()
+        lines.append(SEPARATOR.join([tag, *values]))
+    return "\n".join(lines)
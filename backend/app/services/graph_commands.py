@@ -0,0 +1,312 @@
+from typing import Any, Dict, List, Optional, Set, Tuple
+from pydantic import ValidationError
+from app.core.metrics import metrics
+from app.schemas.graph import (
+    ConnectNodesParams,
+    CreateNodeParams,
+    CurrentGraph,
+    DeleteByIdParams,
+    EdgeData,
+    GraphCommand,
+    GraphCommandsResponse,
+    GraphEdge,
+    GraphNode,
+    LayoutMode,
+    NodeData,
+    UpdateEdgeParams,
+    UpdateNodeParams,
+)
+from app.services.graph_context import select_context
+from app.services.graph_layout import assign_positions
+from app.services.graph_llm_service import get_graph_commands_async
+
+
+# Node data fields a command can set; anything else on the node (details, extras) is preserved
+NODE_FIELDS = ("label", "type", "key", "bpm", "section")
+
+# Params that refer to node or edge ids
+REFERENCE_FIELDS = ("id", "source", "target")
+
+Pair = Tuple[str, str]
+
+
+def make_edge(source: str, target: str, relation: str) -> GraphEdge:
+    """The edge a connectNodes command creates, with the id the frontend gives it"""
+    return GraphEdge(
+        id=f"edge-{source}-{target}",
+        source=source,
+        target=target,
+        label=relation,
+        data=EdgeData(relation=relation),
+    )
+
+
+class GraphCommandEngine:
+    """
+    Applies LLM graph commands to a graph and reduces them to a minimal diff.
+
+    Nodes and edges are indexed by id and edges additionally by (source,
+    target), so each command costs O(1). Commands are applied in order to a
+    working copy; the commands sent back are the net difference between the
+    original and the final graph. That folds the deleteById + createNode
+    rename pattern into a single updateNode and the deleteById +
+    connectNodes relation change into a single updateEdge, and drops re-creations of
+    existing nodes, duplicate connections, deletes of unknown ids and edges
+    whose endpoints do not exist.
+
+    `reserved_ids` are nodes the LLM was not shown (see graph_context).
+    Commands touching them are dropped, and a createNode that happens to
+    reuse one of their ids is renamed instead of overwriting the hidden node.
+    """
+
+    def __init__(self, graph: CurrentGraph, reserved_ids: Optional[Set[str]] = None):
+        self._original_nodes: Dict[str, GraphNode] = {node.id: node for node in graph.nodes}
+        self._original_pairs: Dict[Pair, GraphEdge] = {(edge.source, edge.target): edge for edge in graph.edges}
+
+        self.nodes: Dict[str, GraphNode] = dict(self._original_nodes)
+        self.edges: Dict[Pair, GraphEdge] = dict(self._original_pairs)
+        self._edge_ids: Dict[str, Pair] = {edge.id: (edge.source, edge.target) for edge in graph.edges}
+        self._explicit_positions: Set[str] = set()
+        self._reserved = reserved_ids or set()
+        self._aliases: Dict[str, str] = {}
+        self.dropped = 0
+
+    def apply(self, commands: List[GraphCommand]) -> None:
+        handlers = {
+            "createNode": self._create_node,
+            "connectNodes": self._connect_nodes,
+            "deleteById": self._delete_by_id,
+            "updateNode": self._update_node,
+            "updateEdge": self._update_edge,
+        }
+        for command in commands:
+            params = self._resolve(command)
+            try:
+                applied = params is not None and handlers[command.action](params)
+            except ValidationError:
+                applied = False
+            if not applied:
+                self.dropped += 1
+
+    def _resolve(self, command: GraphCommand) -> Optional[Dict[str, Any]]:
+        """Map renamed ids; None if the command refers to a node the LLM never saw"""
+        if not self._reserved:
+            return command.params
+
+        new_id = command.params.get("id")
+        if command.action == "createNode" and new_id in self._reserved and new_id not in self._aliases:
+            suffix = 2
+            while f"{new_id}-{suffix}" in self.nodes or f"{new_id}-{suffix}" in self._reserved:
+                suffix += 1
+            self._aliases[new_id] = f"{new_id}-{suffix}"
+
+        params = dict(command.params)
+        for name in REFERENCE_FIELDS:
+            value = params.get(name)
+            if isinstance(value, str):
+                params[name] = self._aliases.get(value, value)
+                if params[name] in self._reserved:
+                    return None
+        return params
+
+    def _create_node(self, raw: Dict[str, Any]) -> bool:
+        params = CreateNodeParams(**raw)
+        fields = {name: getattr(params, name) for name in NODE_FIELDS if getattr(params, name) is not None}
+
+        existing = self.nodes.get(params.id)
+        if existing is not None:
+            # Re-creating an existing id is either a no-op or an in-place update
+            return self._set_fields(existing, fields)
+
+        base = self._original_nodes.get(params.id)
+        if base is not None:
+            # Deleted earlier in this batch and re-created: keep position, key and extras
+            node = base.model_copy(update={"data": base.data.model_copy(update=fields)})
+        else:
+            node = GraphNode(id=params.id, data=NodeData(**fields))
+            if params.position is not None:
+                node.position = params.position
+                self._explicit_positions.add(params.id)
+        self.nodes[params.id] = node
+        return True
+
+    def _update_node(self, raw: Dict[str, Any]) -> bool:
+        params = UpdateNodeParams(**raw)
+        node = self.nodes.get(params.id)
+        if node is None:
+            return False
+        fields = {name: getattr(params, name) for name in NODE_FIELDS if getattr(params, name) is not None}
+        return self._set_fields(node, fields)
+
+    def _set_fields(self, node: GraphNode, fields: Dict[str, Any]) -> bool:
+        if all(getattr(node.data, name) == value for name, value in fields.items()):
+            return False
+        self.nodes[node.id] = node.model_copy(update={"data": node.data.model_copy(update=fields)})
+        return True
+
+    def _connect_nodes(self, raw: Dict[str, Any]) -> bool:
+        params = ConnectNodesParams(**raw)
+        pair = (params.source, params.target)
+        if params.source not in self.nodes or params.target not in self.nodes or pair in self.edges:
+            return False
+
+        edge = make_edge(params.source, params.target, params.relation or params.label or "next")
+        original = self._original_pairs.get(pair)
+        if original is not None:
+            # Reconnecting a pair deleted earlier in this batch: the client still has it under its old id
+            edge = edge.model_copy(update={"id": original.id})
+        self.edges[pair] = edge
+        self._edge_ids[edge.id] = pair
+        return True
+
+    def _update_edge(self, raw: Dict[str, Any]) -> bool:
+        params = UpdateEdgeParams(**raw)
+        pair = self._edge_ids.get(params.id)
+        edge = self.edges.get(pair) if pair is not None else None
+        if edge is None or edge.relation == params.relation:
+            return False
+        self.edges[pair] = edge.model_copy(update={"label": params.relation, "data": EdgeData(relation=params.relation)})
+        return True
+
+    def _delete_by_id(self, raw: Dict[str, Any]) -> bool:
+        params = DeleteByIdParams(**raw)
+        if params.id in self.nodes:
+            # Incident edges stay indexed so a delete + re-create keeps its connections;
+            # edges left dangling at the end are dropped in graph()
+            del self.nodes[params.id]
+            return True
+        pair = self._edge_ids.pop(params.id, None)
+        if pair is not None and pair in self.edges:
+            del self.edges[pair]
+            return True
+        return False
+
+    def _live_edges(self) -> Dict[Pair, GraphEdge]:
+        return {
+            pair: edge for pair, edge in self.edges.items()
+            if pair[0] in self.nodes and pair[1] in self.nodes
+        }
+
+    def graph(self) -> CurrentGraph:
+        """The graph after all commands, without dangling edges"""
+        return CurrentGraph(nodes=list(self.nodes.values()), edges=list(self._live_edges().values()))
+
+    def minimal_commands(self) -> List[GraphCommand]:
+        """
+        Net commands turning the original graph into the final one.
+
+        Ordered as edge deletes, node deletes, creates, updates, connects so
+        every connectNodes refers to nodes that already exist on the client
+        (the dispatcher applies them in this order too). A relation change on
+        a surviving edge is an updateEdge, never a delete + connect of the
+        same pair.
+        """
+        deleted_nodes = [node_id for node_id in self._original_nodes if node_id not in self.nodes]
+        deleted_set = set(deleted_nodes)
+        final_edges = self._live_edges()
+
+        commands: List[GraphCommand] = []
+
+        for pair, edge in self._original_pairs.items():
+            if pair[0] in deleted_set or pair[1] in deleted_set:
+                # The client drops incident edges together with the node
+                continue
+            if pair not in final_edges:
+                commands.append(GraphCommand(action="deleteById", params={"id": edge.id}))
+
+        for node_id in deleted_nodes:
+            commands.append(GraphCommand(action="deleteById", params={"id": node_id}))
+
+        updates = []
+        for node_id, node in self.nodes.items():
+            original = self._original_nodes.get(node_id)
+            if original is None:
+                commands.append(GraphCommand(action="createNode", params=self._create_params(node)))
+            elif original.data != node.data:
+                changed = {
+                    name: getattr(node.data, name) for name in NODE_FIELDS
+                    if getattr(node.data, name) != getattr(original.data, name)
+                }
+                updates.append(GraphCommand(action="updateNode", params={"id": node_id, **changed}))
+        commands.extend(updates)
+
+        connects = []
+        for pair, edge in final_edges.items():
+            original = self._original_pairs.get(pair)
+            if original is not None:
+                if original.relation != edge.relation:
+                    commands.append(GraphCommand(action="updateEdge", params={"id": original.id, "relation": edge.relation}))
+            else:
+                connects.append(GraphCommand(
+                    action="connectNodes",
+                    params={"source": edge.source, "target": edge.target, "relation": edge.relation},
+                ))
+        commands.extend(connects)
+
+        return commands
+
+    def _create_params(self, node: GraphNode) -> Dict[str, Any]:
+        params: Dict[str, Any] = {"id": node.id}
+        for name in NODE_FIELDS:
+            value = getattr(node.data, name)
+            if value is not None:
+                params[name] = value
+        if node.id in self._explicit_positions:
+            params["position"] = node.position.model_dump()
+        return params
+
+
+def optimize_commands(
+    graph: CurrentGraph,
+    response: GraphCommandsResponse,
+    engine: Optional[GraphCommandEngine] = None,
+    reserved_ids: Optional[Set[str]] = None
+) -> Tuple[GraphCommandsResponse, CurrentGraph]:
+    """
+    Apply LLM commands to the current graph and reduce them to a minimal list.
+
+    Args:
+        graph: Graph the commands were generated against
+        response: Raw commands from the LLM
+        engine: Optional pre-built engine (e.g. to inspect it afterwards)
+        reserved_ids: Ids of nodes left out of the LLM prompt
+
+    Returns:
+        Tuple of (minimal commands, resulting graph)
+    """
+    engine = engine or GraphCommandEngine(graph, reserved_ids)
+    engine.apply(response.commands)
+    minimal = engine.minimal_commands()
+
+    metrics.observe("graph_commands_in", len(response.commands))
+    metrics.observe("graph_commands_out", len(minimal))
+    metrics.incr("graph_commands_dropped", engine.dropped)
+
+    return GraphCommandsResponse(commands=minimal), engine.graph()
+
+
+async def apply_instruction(
+    current_graph: CurrentGraph,
+    instruction: str,
+    mode: Optional[LayoutMode] = None
+) -> Tuple[GraphCommandsResponse, CurrentGraph]:
+    """
+    Full graph-update pipeline: bounded LLM context, command generation,
+    optimization and layout.
+
+    Args:
+        current_graph: Graph as the client currently has it
+        instruction: Natural language instruction
+        mode: The client's view mode; new nodes are laid out for it
+
+    Returns:
+        Tuple of (commands for the client, graph after applying them)
+    """
+    context = select_context(current_graph, instruction)
+    commands = await get_graph_commands_async(current_graph, instruction, context=context)
+    optimized, updated_graph = optimize_commands(current_graph, commands, reserved_ids=context.hidden_ids)
+    if mode is not None and any(command.action == "connectNodes" for command in optimized.commands):
+        # The client switches to structure mode when a response connects nodes
+        mode = "structure"
+    assign_positions(optimized, updated_graph, mode)
+    return optimized, updated_graph
@@ -0,0 +1,164 @@
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+from app.core.config import settings
+from app.schemas.graph import CurrentGraph, GraphNode
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-_][a-z0-9]+)*")
+
+
+def _tokens(text: Optional[str]) -> List[str]:
+    # Crude plural folding so "drums" in an instruction matches a "Drum" node
+    return [
+        token[:-1] if len(token) > 3 and token.endswith("s") else token
+        for token in _TOKEN.findall((text or "").lower())
+    ]
+
+
+def _phrase(text: Optional[str]) -> str:
+    tokens = _tokens(text)
+    return f" {' '.join(tokens)} " if tokens else ""
+
+
+@dataclass
+class GraphContext:
+    """Bounded view of a graph that goes into the graph-update prompt"""
+    nodes: List[GraphNode]
+    edges: List[Dict[str, str]]
+    hidden_ids: Set[str] = field(default_factory=set)
+    omitted_by_type: Dict[str, int] = field(default_factory=dict)
+    omitted_edges: int = 0
+
+    def to_prompt(self) -> Dict[str, Any]:
+        """Compact JSON-ready form: musical fields only, plus counts for what was left out"""
+        prompt: Dict[str, Any] = {
+            "nodes": [
+                {"id": node.id, **node.data.model_dump(include={"label", "type", "key", "bpm", "section"}, exclude_none=True)}
+                for node in self.nodes
+            ],
+            "edges": self.edges,
+        }
+        if self.hidden_ids:
+            prompt["omitted"] = {
+                "nodes_by_type": self.omitted_by_type,
+                "edges": self.omitted_edges,
+                "note": "Other nodes exist but are not shown; only reference the ids above",
+            }
+        return prompt
+
+
+def match_nodes(graph: CurrentGraph, instruction: str) -> List[str]:
+    """
+    Ids of nodes the instruction refers to, by id or by label.
+
+    Matching is on whole tokens, so "pad" finds "Warm Pad" but "bass"
+    does not match "Bassline".
+    """
+    text = _phrase(instruction)
+    matched = []
+    for node in graph.nodes:
+        if any(phrase and phrase in text for phrase in (_phrase(node.data.label), _phrase(node.id))):
+            matched.append(node.id)
+    return matched
+
+
+_CLAUSE = re.compile(r",|;|\band\b|\bthen\b|\bplus\b|\bwith\b", re.IGNORECASE)
+
+
+def referenced_entities(graph: CurrentGraph, text: Optional[str]) -> int:
+    """
+    Rough count of the things a piece of text talks about.
+
+    The larger of the existing nodes it names and its comma/"and"-separated
+    clauses, so both "connect verse and chorus" and "add drums, bass and
+    a pad" count as several entities without any catalog lookup.
+    """
+    if not text or not text.strip():
+        return 0
+    clauses = sum(1 for part in _CLAUSE.split(text) if part.strip())
+    return max(len(match_nodes(graph, text)), clauses)
+
+
+def select_context(
+    graph: CurrentGraph,
+    instruction: str,
+    max_nodes: Optional[int] = None,
+    hops: Optional[int] = None
+) -> GraphContext:
+    """
+    Pick the part of the graph an instruction needs.
+
+    Priority: nodes named in the instruction, then every section (so
+    "add a bridge after the chorus" can see the song structure), then the
+    named nodes' neighbours up to `hops` away, truncated at `max_nodes`.
+    Everything else is summarised as counts, so prompt size stays flat
+    as the graph grows.
+
+    Args:
+        graph: Full current graph
+        instruction: Natural language instruction
+        max_nodes: Node budget (defaults to settings.GRAPH_CONTEXT_MAX_NODES)
+        hops: Neighbourhood radius (defaults to settings.GRAPH_CONTEXT_HOPS)
+
+    Returns:
+        GraphContext with the selected nodes and edges between them
+    """
+    max_nodes = settings.GRAPH_CONTEXT_MAX_NODES if max_nodes is None else max_nodes
+    hops = settings.GRAPH_CONTEXT_HOPS if hops is None else hops
+    by_id = {node.id: node for node in graph.nodes}
+
+    if len(graph.nodes) <= max_nodes:
+        selected = list(by_id)
+    else:
+        adjacency: Dict[str, List[str]] = {node_id: [] for node_id in by_id}
+        for edge in graph.edges:
+            if edge.source in by_id and edge.target in by_id:
+                adjacency[edge.source].append(edge.target)
+                adjacency[edge.target].append(edge.source)
+
+        seeds = match_nodes(graph, instruction)
+        chosen: Dict[str, None] = dict.fromkeys(seeds)
+        for node in graph.nodes:
+            if node.data.type == "section":
+                chosen.setdefault(node.id)
+
+        # Breadth-first from the named nodes so nearer neighbours win the budget
+        queue = deque((node_id, 0) for node_id in seeds)
+        seen = set(seeds)
+        while queue and len(chosen) < max_nodes:
+            node_id, depth = queue.popleft()
+            if depth == hops:
+                continue
+            for neighbour in adjacency[node_id]:
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    chosen.setdefault(neighbour)
+                    queue.append((neighbour, depth + 1))
+
+        selected = list(chosen)[:max_nodes]
+
+    keep = set(selected)
+    edges = []
+    omitted_edges = 0
+    for edge in graph.edges:
+        if edge.source in keep and edge.target in keep:
+            edges.append({"id": edge.id, "source": edge.source, "target": edge.target, "relation": edge.relation})
+        else:
+            omitted_edges += 1
+
+    omitted_by_type: Dict[str, int] = {}
+    hidden_ids = set()
+    for node in graph.nodes:
+        if node.id not in keep:
+            hidden_ids.add(node.id)
+            node_type = node.data.type or "unknown"
+            omitted_by_type[node_type] = omitted_by_type.get(node_type, 0) + 1
+
+    return GraphContext(
+        nodes=[by_id[node_id] for node_id in selected],
+        edges=edges,
+        hidden_ids=hidden_ids,
+        omitted_by_type=omitted_by_type,
+        omitted_edges=omitted_edges,
+    )
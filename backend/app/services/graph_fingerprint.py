@@ -0,0 +1,98 @@
+import hashlib
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.store import shared_store
+from app.schemas.graph import GraphNode, GraphEdge
+
+
+FEEDBACK_TEXT_NAMESPACE = "producer_feedback_text"
+FEEDBACK_AUDIO_NAMESPACE = "producer_feedback_audio"
+
+# Refinement rounds; three hops covers section -> instrument -> related element chains
+WL_ROUNDS = 3
+
+
+def _digest(value: object) -> str:
+    return hashlib.blake2b(repr(value).encode("utf-8"), digest_size=12).hexdigest()
+
+
+def _normalize(text: Optional[str]) -> str:
+    return " ".join(text.lower().split()) if text else ""
+
+
+def structural_fingerprint(
+    nodes: List[GraphNode],
+    edges: List[GraphEdge],
+    context: Optional[str] = None,
+    rounds: int = WL_ROUNDS
+) -> str:
+    """
+    Canonical hash of a composition's musical structure.
+
+    A Weisfeiler-Lehman style refinement: every node starts labelled by its
+    type, label, key and BPM, then repeatedly absorbs the sorted labels of
+    its neighbours along each edge relation. Node ids, positions and edge
+    styling never enter the hash, so dragging nodes around or re-creating
+    them under new React Flow ids leaves the fingerprint unchanged.
+
+    Args:
+        nodes: Graph nodes
+        edges: Graph edges
+        context: Change context; part of the fingerprint since feedback acknowledges it
+        rounds: Number of refinement rounds
+
+    Returns:
+        Hex digest identifying the structure plus context
+    """
+    labels: Dict[str, str] = {
+        node.id: _digest((node.data.type, _normalize(node.data.label), node.data.key, node.data.bpm))
+        for node in nodes
+    }
+
+    outgoing: Dict[str, List[Tuple[str, str]]] = {node_id: [] for node_id in labels}
+    incoming: Dict[str, List[Tuple[str, str]]] = {node_id: [] for node_id in labels}
+    for edge in edges:
+        # Dangling edges carry no musical meaning
+        if edge.source in labels and edge.target in labels:
+            relation = edge.relation
+            outgoing[edge.source].append((relation, edge.target))
+            incoming[edge.target].append((relation, edge.source))
+
+    for _ in range(rounds):
+        labels = {
+            node_id: _digest((
+                label,
+                sorted((rel, labels[other]) for rel, other in outgoing[node_id]),
+                sorted((rel, labels[other]) for rel, other in incoming[node_id]),
+            ))
+            for node_id, label in labels.items()
+        }
+
+    return _digest((sorted(labels.values()), _normalize(context)))
+
+
+class FeedbackMemo:
+    """Producer feedback text and audio keyed by structural fingerprint, shared by all workers"""
+
+    async def get_text(self, fingerprint: str) -> Optional[str]:
+        entry = await shared_store.get_json_async(FEEDBACK_TEXT_NAMESPACE, fingerprint)
+        metrics.incr("feedback_memo_lookups", kind="text", hit=entry is not None)
+        return entry["text"] if entry else None
+
+    async def put_text(self, fingerprint: str, text: str) -> None:
+        await shared_store.set_json_async(FEEDBACK_TEXT_NAMESPACE, fingerprint, {"text": text}, ttl=settings.FEEDBACK_MEMO_TTL_S)
+
+    async def get_audio(self, fingerprint: str, output_format: str) -> Optional[bytes]:
+        audio = await shared_store.get_async(FEEDBACK_AUDIO_NAMESPACE, f"{fingerprint}:{output_format}")
+        metrics.incr("feedback_memo_lookups", kind="audio", hit=audio is not None)
+        return audio
+
+    async def put_audio(self, fingerprint: str, output_format: str, audio: bytes) -> None:
+        await shared_store.set_async(
+            FEEDBACK_AUDIO_NAMESPACE, f"{fingerprint}:{output_format}", audio, ttl=settings.FEEDBACK_MEMO_TTL_S
+        )
+
+
+# Singleton instance
+feedback_memo = FeedbackMemo()
@@ -0,0 +1,612 @@
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.core.hamt import MISSING, PersistentMap
+from app.core.metrics import metrics
+from app.core.store import SharedStore, shared_store
+from app.schemas.graph import (
+    CurrentGraph,
+    EdgeData,
+    GraphCommand,
+    GraphCommandsResponse,
+    GraphEdge,
+    GraphNode,
+    NodeData,
+    Position,
+)
+from app.services.graph_commands import NODE_FIELDS, Pair, make_edge
+
+# Response header carrying the session's head version after a graph update
+GRAPH_VERSION_HEADER = "x-graph-version"
+
+# Shared store namespace: "<session>" holds the session's head and version
+# range, "<session>:<number>" one version's summary and delta
+GRAPH_HISTORY_NAMESPACE = "graph_history"
+
+# Versions pruned at once past GRAPH_HISTORY_MAX_VERSIONS, so the snapshot a
+# pruned version's child is rewritten to is paid once per batch of commits
+PRUNE_BATCH = 100
+
+_NO_PAIRS: frozenset = frozenset()
+
+
+@dataclass(frozen=True)
+class GraphVersion:
+    """
+    One state of a session's graph.
+
+    The maps are persistent: every node and edge this version did not
+    change is shared with the version it was derived from.
+    """
+    number: int
+    parent: Optional[int]
+    nodes: PersistentMap  # node id -> GraphNode
+    edges: PersistentMap  # (source, target) -> GraphEdge
+    edge_ids: PersistentMap  # edge id -> (source, target)
+    incident: PersistentMap  # node id -> frozenset of (source, target) touching it
+    instruction: Optional[str]
+    changes: int
+    created_at: float = field(default_factory=time.time)
+
+    def graph(self) -> CurrentGraph:
+        return CurrentGraph(nodes=list(self.nodes.values()), edges=list(self.edges.values()))
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "version": self.number,
+            "parent": self.parent,
+            "instruction": self.instruction,
+            "changes": self.changes,
+            "nodes": len(self.nodes),
+            "edges": len(self.edges),
+            "created_at": self.created_at,
+        }
+
+
+class _Draft:
+    """
+    The maps of a version being built; each write replaces a map, never mutates it.
+
+    Every write is also recorded in a delta (the final state of each node
+    and edge touched, None when removed), which is what gets persisted.
+    """
+
+    def __init__(self, base: Optional[GraphVersion]):
+        empty = PersistentMap()
+        self.nodes = base.nodes if base else empty
+        self.edges = base.edges if base else empty
+        self.edge_ids = base.edge_ids if base else empty
+        self.incident = base.incident if base else empty
+        self.changes = 0
+        self.node_delta: Dict[str, Optional[GraphNode]] = {}
+        self.edge_delta: Dict[Pair, Optional[GraphEdge]] = {}
+
+    def put_node(self, node: GraphNode) -> None:
+        nodes = self.nodes.set(node.id, node)
+        if nodes is not self.nodes:
+            self.nodes = nodes
+            self.changes += 1
+            self.node_delta[node.id] = node
+
+    def remove_node(self, node_id: str) -> None:
+        if node_id not in self.nodes:
+            return
+        for pair in self.incident.get(node_id, _NO_PAIRS):
+            self.remove_edge(pair)
+        self.nodes = self.nodes.delete(node_id)
+        self.changes += 1
+        self.node_delta[node_id] = None
+
+    def put_edge(self, edge: GraphEdge) -> None:
+        pair = (edge.source, edge.target)
+        old = self.edges.get(pair)
+        edges = self.edges.set(pair, edge)
+        if edges is self.edges:
+            return
+        self.edges = edges
+        self.changes += 1
+        self.edge_delta[pair] = edge
+        if old is not None and old.id != edge.id:
+            self.edge_ids = self.edge_ids.delete(old.id)
+        self.edge_ids = self.edge_ids.set(edge.id, pair)
+        for end in pair:
+            self.incident = self.incident.set(end, self.incident.get(end, _NO_PAIRS) | {pair})
+
+    def remove_edge(self, pair: Pair) -> None:
+        edge = self.edges.get(pair)
+        if edge is None:
+            return
+        self.edges = self.edges.delete(pair)
+        self.edge_ids = self.edge_ids.delete(edge.id)
+        self.changes += 1
+        self.edge_delta[pair] = None
+        for end in pair:
+            remaining = self.incident.get(end, _NO_PAIRS) - {pair}
+            self.incident = self.incident.set(end, remaining) if remaining else self.incident.delete(end)
+
+    def apply(self, command: GraphCommand) -> None:
+        """Apply one command the way the client does; commands it would ignore are ignored here too"""
+        params = command.params
+        fields = {name: params[name] for name in NODE_FIELDS if params.get(name) is not None}
+
+        if command.action == "createNode":
+            node = GraphNode(id=params["id"], data=NodeData(**fields))
+            if params.get("position") is not None:
+                node.position = Position(**params["position"])
+            self.put_node(node)
+        elif command.action == "updateNode":
+            node = self.nodes.get(params["id"])
+            if node is not None:
+                self.put_node(node.model_copy(update={"data": node.data.model_copy(update=fields)}))
+        elif command.action == "deleteById":
+            if params["id"] in self.nodes:
+                self.remove_node(params["id"])
+            else:
+                pair = self.edge_ids.get(params["id"])
+                if pair is not None:
+                    self.remove_edge(pair)
+        elif command.action == "updateEdge":
+            pair = self.edge_ids.get(params["id"])
+            if pair is not None:
+                edge = self.edges.get(pair)
+                relation = params["relation"]
+                self.put_edge(edge.model_copy(update={"label": relation, "data": EdgeData(relation=relation)}))
+        elif command.action == "connectNodes":
+            if params["source"] in self.nodes and params["target"] in self.nodes:
+                relation = params.get("relation") or params.get("label") or "next"
+                self.put_edge(make_edge(params["source"], params["target"], relation))
+
+    def reconcile(self, graph: CurrentGraph) -> None:
+        """Make the draft equal `graph`; only entries that differ are written"""
+        node_ids = {node.id for node in graph.nodes}
+        for node_id in [node_id for node_id in self.nodes if node_id not in node_ids]:
+            self.remove_node(node_id)
+        for node in graph.nodes:
+            self.put_node(node)
+
+        pairs = set()
+        for edge in graph.edges:
+            if edge.source in self.nodes and edge.target in self.nodes:
+                pairs.add((edge.source, edge.target))
+                self.put_edge(edge)
+        for pair in [pair for pair in self.edges if pair not in pairs]:
+            self.remove_edge(pair)
+
+    def delta(self) -> Dict[str, List[Any]]:
+        """What this draft wrote, as JSON: [id, node or None] and [source, target, edge or None] entries"""
+        return {
+            "nodes": [[node_id, node.model_dump() if node else None] for node_id, node in self.node_delta.items()],
+            "edges": [
+                [source, target, edge.model_dump() if edge else None]
+                for (source, target), edge in self.edge_delta.items()
+            ],
+        }
+
+    def load(self, delta: Dict[str, List[Any]]) -> None:
+        """Replay a delta written by `delta()` on top of the version it was taken from"""
+        # Removing a node drops its edges; any edge kept or re-added is in the delta
+        for node_id, data in delta["nodes"]:
+            if data is None:
+                self.remove_node(node_id)
+            else:
+                self.put_node(GraphNode.model_validate(data))
+        for source, target, data in delta["edges"]:
+            if data is None:
+                self.remove_edge((source, target))
+            else:
+                self.put_edge(GraphEdge.model_validate(data))
+
+    def version(
+        self,
+        number: int,
+        parent: Optional[int],
+        instruction: Optional[str],
+        changes: int,
+        created_at: Optional[float] = None
+    ) -> GraphVersion:
+        return GraphVersion(
+            number=number,
+            parent=parent,
+            nodes=self.nodes,
+            edges=self.edges,
+            edge_ids=self.edge_ids,
+            incident=self.incident,
+            instruction=instruction,
+            changes=changes,
+            created_at=time.time() if created_at is None else created_at,
+        )
+
+
+def _snapshot(version: GraphVersion) -> Dict[str, List[Any]]:
+    """A delta from the empty graph to `version`"""
+    draft = _Draft(None)
+    for node in version.nodes.values():
+        draft.node_delta[node.id] = node
+    for pair, edge in version.edges.items():
+        draft.edge_delta[pair] = edge
+    return draft.delta()
+
+
+def _create_params(node: GraphNode) -> Dict[str, Any]:
+    params: Dict[str, Any] = {"id": node.id}
+    for name in NODE_FIELDS:
+        value = getattr(node.data, name)
+        if value is not None:
+            params[name] = value
+    params["position"] = node.position.model_dump()
+    return params
+
+
+def diff_versions(source: GraphVersion, target: GraphVersion) -> List[GraphCommand]:
+    """
+    Commands turning `source` into `target`.
+
+    Ordered like GraphCommandEngine.minimal_commands: edge deletes, node
+    deletes, creates, updates, connects; a relation change on an edge
+    present in both is an updateEdge. Shared subtrees are skipped, so
+    versions close together in history diff in time proportional to what
+    changed between them.
+    """
+    node_changes = list(source.nodes.diff(target.nodes))
+    deleted = {node_id for node_id, _, new in node_changes if new is MISSING}
+
+    commands: List[GraphCommand] = []
+    edge_updates: List[GraphCommand] = []
+    connects: List[GraphCommand] = []
+    for (from_id, to_id), old, new in source.edges.diff(target.edges):
+        if old is MISSING:
+            connects.append(GraphCommand(
+                action="connectNodes",
+                params={"source": from_id, "target": to_id, "relation": new.relation},
+            ))
+        elif new is not MISSING:
+            if old.relation != new.relation:
+                # The client knows the edge by the id it had in `source`
+                edge_updates.append(GraphCommand(action="updateEdge", params={"id": old.id, "relation": new.relation}))
+        else:
+            if from_id not in deleted and to_id not in deleted:
+                # The client drops incident edges together with the node
+                commands.append(GraphCommand(action="deleteById", params={"id": old.id}))
+
+    commands.extend(GraphCommand(action="deleteById", params={"id": node_id}) for node_id in deleted)
+
+    updates = []
+    for node_id, old, new in node_changes:
+        if old is MISSING:
+            commands.append(GraphCommand(action="createNode", params=_create_params(new)))
+        elif new is not MISSING:
+            changed = {
+                name: getattr(new.data, name) for name in NODE_FIELDS
+                if getattr(new.data, name) != getattr(old.data, name)
+            }
+            if changed:
+                updates.append(GraphCommand(action="updateNode", params={"id": node_id, **changed}))
+    commands.extend(updates)
+    commands.extend(edge_updates)
+    commands.extend(connects)
+    return commands
+
+
+@dataclass
+class _SessionCache:
+    versions: "OrderedDict[int, GraphVersion]" = field(default_factory=OrderedDict)
+    last_seen: float = field(default_factory=time.monotonic)
+
+
+def _row_key(session_id: str, number: int) -> str:
+    return f"{session_id}:{number}"
+
+
+class GraphHistoryStore:
+    """
+    Versioned graph history per composition session, shared by all workers.
+
+    Each version is persisted in the shared store as its delta from the
+    version it was derived from (its base), so a commit writes what the
+    commands changed, not the graph: one row with the version's summary
+    and delta, plus the session row holding the head and version range.
+    Workers materialize versions as persistent maps sharing structure with
+    their base, replaying deltas from the nearest version they already
+    hold, and cache them in process; a long jam session with thousands of
+    edits holds one copy of each node version rather than one graph per
+    edit. Any two versions can be diffed, and checkout moves the head back
+    (or forward) without discarding anything: the next commit branches
+    from the checked-out version.
+
+    The newest GRAPH_HISTORY_MAX_VERSIONS versions of a session are kept
+    (plus its head), pruned PRUNE_BATCH at a time; a kept version whose
+    base is pruned is rewritten as a full snapshot. Rows expire
+    SESSION_TTL_S after they are written. Each worker caches at most
+    GRAPH_HISTORY_MAX_SESSIONS sessions, least recently used evicted first.
+    """
+
+    def __init__(self, store: SharedStore = shared_store):
+        self.store = store
+        self._sessions: "OrderedDict[str, _SessionCache]" = OrderedDict()
+
+    def _cache(self, session_id: str) -> "OrderedDict[int, GraphVersion]":
+        now = time.monotonic()
+        # Least recently used first, so idle sessions are always at the front
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            full = len(self._sessions) >= settings.GRAPH_HISTORY_MAX_SESSIONS and session_id not in self._sessions
+            if not full and now - oldest.last_seen <= settings.SESSION_TTL_S:
+                break
+            del self._sessions[oldest_id]
+
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = _SessionCache()
+        self._sessions.move_to_end(session_id)
+        session.last_seen = now
+        metrics.set_gauge("graph_history_sessions", len(self._sessions))
+        return session.versions
+
+    @staticmethod
+    def _remember(cache: "OrderedDict[int, GraphVersion]", version: GraphVersion) -> None:
+        cache[version.number] = version
+        while len(cache) > settings.GRAPH_HISTORY_MAX_VERSIONS:
+            cache.popitem(last=False)
+
+    async def _meta(self, session_id: str) -> Dict[str, Any]:
+        meta = await self.store.get_json_async(GRAPH_HISTORY_NAMESPACE, session_id)
+        if meta is None or meta["head"] is None:
+            raise KeyError(f"No graph history for session {session_id}")
+        return meta
+
+    def _read_chain(
+        self,
+        session_id: str,
+        number: int,
+        held: Dict[int, GraphVersion]
+    ) -> Tuple[Optional[int], List[Tuple[int, Dict[str, Any]]]]:
+        """
+        Rows from `number` back along base links to a version in `held` or a snapshot.
+
+        Runs in a worker thread, so walking a long chain costs one hop off
+        the event loop.
+
+        Returns:
+            Tuple of (held version the rows apply to, None for a snapshot; rows oldest first)
+
+        Raises:
+            KeyError: If a row on the way is missing (pruned or expired)
+        """
+        rows = []
+        while number not in held:
+            row = self.store.get_json(GRAPH_HISTORY_NAMESPACE, _row_key(session_id, number))
+            if row is None:
+                raise KeyError(f"Unknown graph version {number}")
+            rows.append((number, row))
+            if row["base"] is None:
+                rows.reverse()
+                return None, rows
+            number = row["base"]
+        rows.reverse()
+        return number, rows
+
+    async def _load(self, session_id: str, number: int) -> GraphVersion:
+        cache = self._cache(session_id)
+        version = cache.get(number)
+        if version is not None:
+            return version
+
+        held = dict(cache)
+        start, rows = await asyncio.to_thread(self._read_chain, session_id, number, held)
+        version = held[start] if start is not None else None
+        for row_number, row in rows:
+            draft = _Draft(version)
+            draft.load(row["delta"])
+            version = draft.version(row_number, row["parent"], row["instruction"], row["changes"], row["created_at"])
+            self._remember(cache, version)
+        metrics.incr("graph_history_loads")
+        metrics.observe("graph_history_replayed", len(rows))
+        return version
+
+    async def _append(
+        self,
+        session_id: str,
+        parent: Optional[GraphVersion],
+        draft: _Draft,
+        instruction: Optional[str]
+    ) -> GraphVersion:
+        ttl = settings.SESSION_TTL_S
+
+        def reserve(meta: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], int]:
+            meta = meta or {"head": None, "next": 1, "oldest": 1}
+            number = meta["next"]
+            meta["next"] = number + 1
+            return meta, number
+
+        number = await self.store.update_json_async(GRAPH_HISTORY_NAMESPACE, session_id, reserve, ttl)
+        base = parent.number if parent else None
+        version = draft.version(number, base, instruction, draft.changes)
+        row = {**version.summary(), "base": base, "delta": draft.delta()}
+        # The row goes in before the head points at it, so other workers never see a dangling head
+        await self.store.set_json_async(GRAPH_HISTORY_NAMESPACE, _row_key(session_id, number), row, ttl)
+
+        def advance(meta: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], int]:
+            meta = meta or {"head": None, "next": number + 1, "oldest": number}
+            meta["head"] = number
+            return meta, meta["next"] - meta["oldest"]
+
+        kept = await self.store.update_json_async(GRAPH_HISTORY_NAMESPACE, session_id, advance, ttl)
+        self._remember(self._cache(session_id), version)
+        metrics.incr("graph_history_versions")
+        metrics.observe("graph_history_changes", draft.changes)
+
+        if kept > settings.GRAPH_HISTORY_MAX_VERSIONS + PRUNE_BATCH:
+            await self._prune(session_id)
+        return version
+
+    def _rebase_candidates(self, session_id: str, start: int, stop: int, cut: int) -> List[int]:
+        """Versions in [start, stop) whose base is below `cut`; runs in a worker thread"""
+        numbers = []
+        for number in range(start, stop):
+            row = self.store.get_json(GRAPH_HISTORY_NAMESPACE, _row_key(session_id, number))
+            if row is not None and row["base"] is not None and row["base"] < cut:
+                numbers.append(number)
+        return numbers
+
+    def _delete_rows(self, session_id: str, start: int, stop: int) -> None:
+        for number in range(start, stop):
+            self.store.delete(GRAPH_HISTORY_NAMESPACE, _row_key(session_id, number))
+
+    async def _prune(self, session_id: str) -> None:
+        """Drop versions older than the newest GRAPH_HISTORY_MAX_VERSIONS, never the head"""
+
+        def cut(meta: Optional[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], Tuple[int, int, int]]:
+            if meta is None:
+                return None, (0, 0, 0)
+            oldest = meta["oldest"]
+            keep_from = meta["next"] - settings.GRAPH_HISTORY_MAX_VERSIONS
+            if meta["head"] is not None:
+                keep_from = min(keep_from, meta["head"])
+            meta["oldest"] = max(oldest, keep_from)
+            return meta, (oldest, meta["oldest"], meta["next"])
+
+        ttl = settings.SESSION_TTL_S
+        oldest, keep_from, next_number = await self.store.update_json_async(
+            GRAPH_HISTORY_NAMESPACE, session_id, cut, ttl
+        )
+        if keep_from <= oldest:
+            return
+
+        # Kept versions replaying from a pruned one become snapshots before its row goes
+        orphans = await asyncio.to_thread(self._rebase_candidates, session_id, keep_from, next_number, keep_from)
+        for number in orphans:
+            try:
+                version = await self._load(session_id, number)
+            except KeyError:
+                continue
+            row = {**version.summary(), "base": None, "delta": _snapshot(version)}
+            await self.store.set_json_async(GRAPH_HISTORY_NAMESPACE, _row_key(session_id, number), row, ttl)
+
+        await asyncio.to_thread(self._delete_rows, session_id, oldest, keep_from)
+        cache = self._cache(session_id)
+        for number in range(oldest, keep_from):
+            cache.pop(number, None)
+        metrics.incr("graph_history_pruned", keep_from - oldest)
+
+    async def commit(
+        self,
+        session_id: str,
+        base_graph: CurrentGraph,
+        response: GraphCommandsResponse,
+        instruction: Optional[str] = None,
+        base_version: Optional[int] = None
+    ) -> GraphVersion:
+        """
+        Record the graph after `response` as the session's new head.
+
+        When `base_version` is the head, `base_graph` is taken to be that
+        version and the commit costs O(len(commands)), including what it
+        writes to the store. Otherwise (first request, edits the client
+        made locally, a stale base) the head is first brought in line with
+        `base_graph` in a separate version with no instruction; that pass
+        reads the whole graph but only stores what differs. Commands that
+        change nothing do not create a version.
+
+        Args:
+            session_id: Composition session identifier
+            base_graph: Graph the commands were applied to
+            response: Commands as sent to the client (after optimization and layout)
+            instruction: What the user asked for, kept as the version's label
+            base_version: History version the client says base_graph is at
+
+        Returns:
+            The new head version
+        """
+        head = None
+        meta = await self.store.get_json_async(GRAPH_HISTORY_NAMESPACE, session_id)
+        if meta is not None and meta["head"] is not None:
+            try:
+                head = await self._load(session_id, meta["head"])
+            except KeyError:
+                # Its rows expired mid-session; start again from base_graph
+                head = None
+
+        if head is None or base_version != head.number:
+            draft = _Draft(head)
+            draft.reconcile(base_graph)
+            if head is None or draft.changes:
+                head = await self._append(session_id, head, draft, None)
+
+        draft = _Draft(head)
+        for command in response.commands:
+            draft.apply(command)
+        if not draft.changes:
+            return head
+        return await self._append(session_id, head, draft, instruction)
+
+    async def get(self, session_id: str, number: int) -> GraphVersion:
+        """
+        Raises:
+            KeyError: If the session or version is unknown (or pruned)
+        """
+        meta = await self._meta(session_id)
+        if not meta["oldest"] <= number < meta["next"]:
+            raise KeyError(f"Unknown graph version {number}")
+        return await self._load(session_id, number)
+
+    async def head(self, session_id: str) -> GraphVersion:
+        meta = await self._meta(session_id)
+        return await self._load(session_id, meta["head"])
+
+    def _read_summaries(self, session_id: str, start: int, stop: int) -> List[Dict[str, Any]]:
+        summaries = []
+        for number in range(start, stop):
+            row = self.store.get_json(GRAPH_HISTORY_NAMESPACE, _row_key(session_id, number))
+            if row is not None:
+                row.pop("base")
+                row.pop("delta")
+                summaries.append(row)
+        return summaries
+
+    async def log(self, session_id: str) -> Dict[str, Any]:
+        """Version summaries oldest first, and the head version number"""
+        meta = await self.store.get_json_async(GRAPH_HISTORY_NAMESPACE, session_id)
+        if meta is None:
+            return {"head": None, "versions": []}
+        versions = await asyncio.to_thread(self._read_summaries, session_id, meta["oldest"], meta["next"])
+        return {"head": meta["head"], "versions": versions}
+
+    async def diff(self, session_id: str, from_number: int, to_number: int) -> GraphCommandsResponse:
+        """
+        Raises:
+            KeyError: If the session or either version is unknown
+        """
+        return GraphCommandsResponse(commands=diff_versions(
+            await self.get(session_id, from_number),
+            await self.get(session_id, to_number),
+        ))
+
+    async def checkout(self, session_id: str, number: int) -> Tuple[GraphCommandsResponse, GraphVersion]:
+        """
+        Make `number` the session's head.
+
+        Returns:
+            Tuple of (commands turning the old head into it, the version)
+
+        Raises:
+            KeyError: If the session or version is unknown
+        """
+        target = await self.get(session_id, number)
+        current = await self.head(session_id)
+        commands = diff_versions(current, target)
+
+        def move(meta: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], None]:
+            meta = meta or {"head": None, "next": number + 1, "oldest": number}
+            meta["head"] = number
+            return meta, None
+
+        await self.store.update_json_async(GRAPH_HISTORY_NAMESPACE, session_id, move, settings.SESSION_TTL_S)
+        metrics.incr("graph_history_checkouts")
+        return GraphCommandsResponse(commands=commands), target
+
+
+# Singleton instance
+graph_history = GraphHistoryStore()
@@ -0,0 +1,386 @@
+import math
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.schemas.graph import CurrentGraph, GraphCommandsResponse, Position
+
+# Grid spacing, matched to the frontend's default placement so laid-out and
+# manually placed nodes line up
+SPACING_X = 250.0
+SPACING_Y = 200.0
+ORIGIN = np.array([100.0, 100.0])
+
+# Minimum distance between node centres before a node counts as overlapping
+MIN_DISTANCE = 160.0
+
+# Relations that order sections left to right; every other edge out of a
+# section attaches an element to that section's column
+SEQUENCE_RELATIONS = {"next", "after"}
+
+# Force-directed settings. Exact repulsion costs movable x all node pairs
+# per iteration; iterations are cut to stay within FORCE_WORK_BUDGET pairs
+# in total (about 7 ms). When that leaves fewer than MIN_FORCE_ITERATIONS,
+# repulsion is approximated on a grid instead (movable x ~6 sqrt(all) per
+# iteration) within the same budget. Bulk placements too large for even one
+# grid iteration keep their spiral starting positions, which are already
+# MIN_DISTANCE apart. FORCE_TIME_BUDGET_S caps the iterations on slow hosts.
+# Grid cells are at most GRID_MAX_CELL_IDEALS ideal edge lengths wide
+FORCE_ITERATIONS = 50
+MIN_FORCE_ITERATIONS = 5
+FORCE_WORK_BUDGET = 400_000
+FORCE_TIME_BUDGET_S = 0.008
+GRID_CELLS_PER_SQRT_NODE = 3
+GRID_MAX_CELL_IDEALS = 8
+GRAVITY = 1.0
+
+GOLDEN_ANGLE = math.pi * (3 - math.sqrt(5))
+
+
+def _sequence_layers(section_ids: List[str], sequence: List[Tuple[str, str]]) -> Dict[str, int]:
+    """Longest-path layering of sections along sequence edges (Kahn's algorithm)"""
+    indegree = {node_id: 0 for node_id in section_ids}
+    successors: Dict[str, List[str]] = {node_id: [] for node_id in section_ids}
+    for source, target in sequence:
+        successors[source].append(target)
+        indegree[target] += 1
+
+    layers = {node_id: 0 for node_id in section_ids}
+    queue = deque(node_id for node_id in section_ids if indegree[node_id] == 0)
+    visited = 0
+    while queue:
+        node_id = queue.popleft()
+        visited += 1
+        for successor in successors[node_id]:
+            layers[successor] = max(layers[successor], layers[node_id] + 1)
+            indegree[successor] -= 1
+            if indegree[successor] == 0:
+                queue.append(successor)
+
+    if visited < len(section_ids):
+        # Sections on a cycle (verse -> chorus -> verse) go after everything else
+        tail = max(layers.values(), default=-1) + 1
+        for node_id in section_ids:
+            if indegree[node_id] > 0:
+                layers[node_id] = tail
+    return layers
+
+
+def layered_layout(graph: CurrentGraph) -> np.ndarray:
+    """
+    Ideal left-to-right positions for structure mode.
+
+    Sections form columns ordered by the longest "next" chain leading to
+    them, each section's elements stack below it, and elements attached to
+    no section fill a grid underneath.
+
+    Returns:
+        (n, 2) array of positions in graph.nodes order
+    """
+    # Plain Python containers: per-element NumPy indexing costs more than it saves here
+    nodes = graph.nodes
+    node_ids = [node.id for node in nodes]
+    section_ids = [node.id for node in nodes if node.data.type == "section"]
+    sections = set(section_ids)
+    present = set(node_ids)
+
+    sequence = []
+    parent: Dict[str, str] = {}
+    for edge in graph.edges:
+        source, target = edge.source, edge.target
+        if source not in sections or target not in present:
+            continue
+        if target not in sections:
+            parent.setdefault(target, source)
+        elif edge.relation in SEQUENCE_RELATIONS:
+            sequence.append((source, target))
+
+    layers = _sequence_layers(section_ids, sequence)
+
+    # Sections sharing a layer (parallel branches) are spread over extra columns;
+    # sorted() is stable, so sections within a layer keep graph order
+    column_of = {node_id: column for column, node_id in enumerate(sorted(section_ids, key=layers.__getitem__))}
+    next_column = len(column_of)
+
+    columns = [0] * len(nodes)
+    rows = [0] * len(nodes)
+    stacked: Dict[str, int] = {}
+    orphans = []
+    for i, node_id in enumerate(node_ids):
+        column = column_of.get(node_id)
+        if column is not None:
+            columns[i] = column
+        elif node_id in parent:
+            owner = parent[node_id]
+            stacked[owner] = stacked.get(owner, 0) + 1
+            columns[i] = column_of[owner]
+            rows[i] = stacked[owner]
+        else:
+            orphans.append(i)
+    columns = np.array(columns, dtype=np.int64)
+    rows = np.array(rows, dtype=np.int64)
+
+    if orphans:
+        orphans_array = np.array(orphans)
+        width = max(next_column, math.ceil(math.sqrt(len(orphans))))
+        first_row = max(stacked.values(), default=0) + (1 if section_ids else 0)
+        ranks = np.arange(len(orphans))
+        columns[orphans_array] = ranks % width
+        rows[orphans_array] = first_row + ranks // width
+
+    return ORIGIN + np.stack([columns * SPACING_X, rows * SPACING_Y], axis=1)
+
+
+def _spiral(count: int, center: np.ndarray, start_radius: float) -> np.ndarray:
+    """Golden-angle (phyllotaxis) spiral; neighbouring points stay about MIN_DISTANCE apart"""
+    k = np.arange(count)
+    radius = start_radius + MIN_DISTANCE * np.sqrt(k + 0.5)
+    theta = k * GOLDEN_ANGLE
+    return center + np.stack([radius * np.cos(theta), radius * np.sin(theta)], axis=1)
+
+
+def _exact_repulsion(positions: np.ndarray, moving: np.ndarray, ideal: float) -> np.ndarray:
+    """Repulsion k^2 / d on each moving node from every node; self-pairs have zero delta"""
+    dx = positions[moving, 0, None] - positions[None, :, 0]
+    dy = positions[moving, 1, None] - positions[None, :, 1]
+    strength = (ideal * ideal) / np.maximum(dx * dx + dy * dy, 1.0)
+    return np.stack([(strength * dx).sum(axis=1), (strength * dy).sum(axis=1)], axis=1)
+
+
+def _grid_repulsion(positions: np.ndarray, moving: np.ndarray, ideal: float) -> np.ndarray:
+    """
+    Grid (Barnes-Hut style) approximation of _exact_repulsion.
+
+    Nodes are binned into about 3 sqrt(n) cells. A node is repelled exactly
+    by the nodes in its own and the eight surrounding cells, and by every
+    other cell as a single body of that cell's node count at its centroid.
+    """
+    n = len(positions)
+    low = positions.min(axis=0)
+    span = np.maximum(positions.max(axis=0) - low, 1.0)
+    # Capped so a long pinned strip with new nodes far off its side is not
+    # folded into a few cells of hundreds of near-field members each
+    size = min(math.sqrt(span[0] * span[1] / (GRID_CELLS_PER_SQRT_NODE * math.sqrt(n))), GRID_MAX_CELL_IDEALS * ideal)
+    # One empty column of margin, so neighbouring cell ids never wrap rows
+    cells = np.floor((positions - low) / size).astype(np.int64) + 1
+    width = int(cells[:, 0].max()) + 2
+    occupied, inverse, counts = np.unique(cells[:, 1] * width + cells[:, 0], return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    centroids = np.zeros((len(counts), 2))
+    np.add.at(centroids, inverse, positions)
+    centroids /= counts[:, None]
+
+    # Occupied cells around each moving node (-1 where a neighbour cell is empty)
+    offsets = np.array([dy * width + dx for dy in (-1, 0, 1) for dx in (-1, 0, 1)])
+    wanted = occupied[inverse[moving]][:, None] + offsets[None, :]
+    found = np.minimum(np.searchsorted(occupied, wanted), len(occupied) - 1)
+    around = np.where(occupied[found] == wanted, found, -1)
+
+    x = positions[moving, 0, None]
+    y = positions[moving, 1, None]
+
+    # Far field: every other cell at its centroid
+    dx = x - centroids[None, :, 0]
+    dy = y - centroids[None, :, 1]
+    strength = counts[None, :] * (ideal * ideal) / np.maximum(dx * dx + dy * dy, 1.0)
+    rows = np.arange(len(moving))
+    for column in range(around.shape[1]):
+        hit = around[:, column] >= 0
+        strength[rows[hit], around[hit, column]] = 0.0
+    fx = (strength * dx).sum(axis=1)
+    fy = (strength * dy).sum(axis=1)
+
+    # Near field: members of the surrounding cells, each padded to the fullest cell
+    order = np.argsort(inverse, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    slots = np.arange(counts.max())
+    members = np.where(slots[None, :] < counts[:, None], order[np.minimum(starts[:, None] + slots[None, :], n - 1)], -1)
+    mates = np.where(around[:, :, None] >= 0, members[np.maximum(around, 0)], -1).reshape(len(moving), -1)
+    present = mates >= 0
+    mates = np.maximum(mates, 0)
+    dx = x - positions[mates, 0]
+    dy = y - positions[mates, 1]
+    strength = np.where(present, (ideal * ideal) / np.maximum(dx * dx + dy * dy, 1.0), 0.0)
+    fx += (strength * dx).sum(axis=1)
+    fy += (strength * dy).sum(axis=1)
+    return np.stack([fx, fy], axis=1)
+
+
+def force_layout(
+    graph: CurrentGraph,
+    movable: np.ndarray,
+    positions: np.ndarray,
+    iterations: int = FORCE_ITERATIONS
+) -> np.ndarray:
+    """
+    Fruchterman-Reingold placement of the movable nodes for discovery mode.
+
+    Pinned nodes keep their positions and only push the movable ones away,
+    so the cost per iteration is O(movable x all) rather than O(all^2), or
+    O(movable x sqrt(all)) on graphs large enough to need _grid_repulsion.
+    Iterations stop at FORCE_WORK_BUDGET or FORCE_TIME_BUDGET_S, whichever
+    comes first, so the pass takes at most about 10 ms whatever the graph
+    size. Placing thousands of new nodes at once keeps the spiral and is
+    bounded by the budget rather than by a frame.
+
+    Args:
+        graph: Graph being laid out
+        movable: Boolean mask of nodes to place
+        positions: (n, 2) current positions; rows of movable nodes are ignored
+        iterations: Cooling iterations
+
+    Returns:
+        (n, 2) array with the movable rows filled in
+    """
+    positions = positions.copy()
+    count = int(movable.sum())
+    if count == 0:
+        return positions
+
+    pinned = ~movable
+    if pinned.any():
+        center = positions[pinned].mean(axis=0)
+        extent = float(np.linalg.norm(positions[pinned] - center, axis=1).max()) + MIN_DISTANCE
+    else:
+        center = ORIGIN + MIN_DISTANCE * math.sqrt(count)
+        extent = 0.0
+    positions[movable] = _spiral(count, center, extent)
+
+    repulsion = _exact_repulsion
+    exact_iterations = FORCE_WORK_BUDGET // (count * len(positions))
+    if exact_iterations >= MIN_FORCE_ITERATIONS:
+        iterations = min(iterations, exact_iterations)
+    else:
+        repulsion = _grid_repulsion
+        grid_cost = count * 6 * math.ceil(math.sqrt(len(positions)))
+        iterations = min(iterations, FORCE_WORK_BUDGET // grid_cost)
+
+    index = {node.id: i for i, node in enumerate(graph.nodes)}
+    pairs = np.array(
+        [(index[e.source], index[e.target]) for e in graph.edges if e.source in index and e.target in index],
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    # Edges between two pinned nodes pull on nothing that moves
+    pairs = pairs[movable[pairs].any(axis=1)]
+
+    moving = np.flatnonzero(movable)
+    local = np.full(len(positions), -1, dtype=np.int64)
+    local[moving] = np.arange(count)
+    ideal = MIN_DISTANCE * 1.2
+    temperature = MIN_DISTANCE
+
+    deadline = time.perf_counter() + FORCE_TIME_BUDGET_S
+    for _ in range(iterations):
+        if time.perf_counter() > deadline:
+            break
+        displacement = repulsion(positions, moving, ideal)
+        # Gravity towards the centre balances repulsion so the cluster stays compact
+        displacement -= GRAVITY * (positions[moving] - center)
+
+        if len(pairs):
+            edge_delta = positions[pairs[:, 0]] - positions[pairs[:, 1]]
+            edge_distance = np.linalg.norm(edge_delta, axis=1, keepdims=True)
+            pull = edge_delta * edge_distance / ideal
+            for column, sign in ((0, -1.0), (1, 1.0)):
+                rows = local[pairs[:, column]]
+                hit = rows >= 0
+                np.add.at(displacement, rows[hit], sign * pull[hit])
+
+        length = np.maximum(np.linalg.norm(displacement, axis=1, keepdims=True), 1e-9)
+        positions[moving] += displacement / length * np.minimum(length, temperature)
+        temperature *= 0.92
+
+    return positions
+
+
+def _resolve_overlaps(positions: np.ndarray, movable: np.ndarray) -> np.ndarray:
+    """
+    Push movable nodes down a row until none sits on another node.
+
+    Points are bucketed in a spatial hash with MIN_DISTANCE cells, so each
+    check only looks at the 3x3 neighbouring cells instead of every node,
+    and only pinned nodes in the movable nodes' columns are bucketed.
+    """
+    points = positions.tolist()
+    buckets: Dict[Tuple[int, int], List[int]] = {}
+
+    def cell(point: List[float]) -> Tuple[int, int]:
+        return int(point[0] // MIN_DISTANCE), int(point[1] // MIN_DISTANCE)
+
+    def collides(point: List[float]) -> bool:
+        cx, cy = cell(point)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for other in buckets.get((cx + dx, cy + dy), ()):
+                    if math.dist(point, points[other]) < MIN_DISTANCE:
+                        return True
+        return False
+
+    # Movable nodes only ever move down, so only pinned nodes in their cell
+    # columns (and the ones either side) can be hit
+    columns = np.floor_divide(positions[:, 0], MIN_DISTANCE).astype(np.int64)
+    reachable = np.unique(columns[movable][:, None] + np.array([-1, 0, 1])[None, :])
+    for i in np.flatnonzero(~movable & np.isin(columns, reachable)).tolist():
+        buckets.setdefault(cell(points[i]), []).append(i)
+    for i in np.flatnonzero(movable).tolist():
+        while collides(points[i]):
+            points[i][1] += SPACING_Y
+        buckets.setdefault(cell(points[i]), []).append(i)
+
+    return np.array(points, dtype=float).reshape(-1, 2)
+
+
+def assign_positions(
+    response: GraphCommandsResponse,
+    graph: CurrentGraph,
+    mode: Optional[str] = None
+) -> None:
+    """
+    Lay out the nodes created by `response` and write their positions into
+    both the createNode commands and `graph`.
+
+    Existing nodes never move, since the user may have arranged them by hand.
+    Structure mode places new nodes on the layered layout, translated to
+    line up with the existing nodes; discovery mode places them with a
+    force-directed pass around the existing cluster.
+
+    Args:
+        response: Optimized commands; createNode params are updated in place
+        graph: Graph after applying the commands; node positions are updated in place
+        mode: The client's "structure" or "discovery" mode; when not given,
+            structure if the graph has edges
+
+    Placing up to a few hundred new nodes fits in a 16 ms frame on graphs
+    of up to about 1000 nodes; at 5000 nodes it takes 15-20 ms, mostly
+    reading and writing the node models (see benchmarks/bench_graph_layout.py).
+    """
+    created = {
+        command.params["id"]: command.params
+        for command in response.commands
+        if command.action == "createNode"
+    }
+    if not created:
+        return
+
+    movable = np.array([node.id in created for node in graph.nodes], dtype=bool)
+    current = np.array([(node.position.x, node.position.y) for node in graph.nodes], dtype=float).reshape(-1, 2)
+    pinned = ~movable
+
+    if mode is None:
+        mode = "structure" if graph.edges else "discovery"
+
+    if mode == "structure":
+        ideal = layered_layout(graph)
+        offset = (current[pinned] - ideal[pinned]).mean(axis=0) if pinned.any() else np.zeros(2)
+        positions = current.copy()
+        positions[movable] = ideal[movable] + offset
+        if pinned.any():
+            positions = _resolve_overlaps(positions, movable)
+    else:
+        positions = force_layout(graph, movable, current)
+
+    moving = np.flatnonzero(movable)
+    for i, (x, y) in zip(moving.tolist(), np.round(positions[moving], 1).tolist()):
+        node = graph.nodes[i]
+        node.position = Position(x=x, y=y)
+        created[node.id]["position"] = {"x": x, "y": y}
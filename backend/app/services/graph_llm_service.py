@@ -1,20 +1,33 @@
-import json
-from typing import Dict, Any
-import google.generativeai as genai
+from typing import Optional, Set
+from app.core import fastjson
+from app.core.admission import UpstreamBusy, admission_controller
 from app.core.config import settings
+from app.core.key_pool import gemini_keys
+from app.core.metrics import metrics
+from app.core.profiling import span
+from app.core.store import shared_store, cache_key
 from app.schemas.graph import CurrentGraph, GraphCommandsResponse
+from app.services.command_grammar import COMPACT_RETURN_FORMAT
+from app.services.graph_context import GraphContext, referenced_entities, select_context
+from app.services.graph_repair import RepairFailed, repair_output
+from app.services.model_router import Complexity, ModelRoute, model_router
 
-SYSTEM_PROMPT = """You are an assistant that updates a music collaboration diagram.
+GRAPH_COMMANDS_NAMESPACE = "graph_commands"
+
+# First answer plus one retry, only for output local repair cannot fix
+MAX_LLM_ATTEMPTS = 2
+
+_SYSTEM_PROMPT_TEMPLATE = """You are an assistant that updates a music collaboration diagram.
 You receive:
 - The current graph JSON (nodes and edges)
 - A new natural language instruction
 
-You must output ONLY structured JSON commands, never prose.
+You must output ONLY commands in the return format below, never prose.
 
 Supported commands:
-- createNode: add a new node with id, label, type, and position
+- createNode: add a new node with id, label, and type
   - Node types: "section", "drum", "bassline", "melody", "chord", "synth", "vocal", "fx", "genre"
-  - Position: { "x": number, "y": number } - distribute nodes spatially to avoid overlap
+  - Do not include a position; the server lays out new nodes
   - Additional optional fields: key (musical key like "C", "Am"), bpm (tempo), section (for structure mode)
 
 - connectNodes: link nodes with a relation (creates directed edges)
@@ -25,33 +38,13 @@ Supported commands:
 - deleteById: remove a node or edge by ID
   - Provide the exact id of the node or edge to delete
 
-- updateNode: modify an existing node's properties (IMPORTANT: Use deleteById + createNode pattern)
-  - When user edits a node label/type/key/bpm, delete the old node and create a new one with same ID
-  - This ensures all edges remain connected
-  - Example: To rename "Drums" to "Kick", do deleteById("drums-1") then createNode with id="drums-1" and label="Kick"
+- updateNode: modify an existing node's properties in place
+  - When user edits a node label/type/key/bpm, update the node by its ID with only the changed fields
+  - All edges stay connected
+  - Example: To rename "Drums" to "Kick", updateNode with id="drums-1" and label="Kick"
 
 Return format:
-{"commands": [
-  {
-    "action": "createNode",
-    "params": {
-      "id": "unique-id",
-      "label": "Display Name",
-      "type": "section",
-      "position": {"x": 400, "y": 100},
-      "key": "C",
-      "bpm": 120
-    }
-  },
-  {
-    "action": "connectNodes",
-    "params": {
-      "source": "node-id-1",
-      "target": "node-id-2",
-      "relation": "next"
-    }
-  }
-]}
+<return-format>
 
 CRITICAL EDGE CREATION RULES:
 
@@ -119,49 +112,71 @@ CRITICAL EDGE CREATION RULES:
 
 Important rules:
 1. Generate unique IDs for new nodes (use descriptive names like "intro", "chorus", "bass-1", "pad-1", "piano-1", etc.)
-2. Calculate positions to distribute nodes spatially - spread them out (increment x by 200-400, y by 150-200)
-3. ONLY connect section nodes, NEVER connect instrument/element nodes
-4. When adding instruments, position them below or around section nodes but DON'T connect them
-5. For incremental updates, only create/modify what's mentioned in the instruction
-6. Preserve existing graph structure unless explicitly asked to change it
-7. TEMPORAL/SEQUENTIAL KEYWORDS for SECTIONS ONLY: "after", "before", "then", "next", "following"
-8. Use existing node IDs from the current graph when making connections
-9. When instruction says "Update node: renamed X to Y", find the node with label X and use deleteById + createNode with same ID but new label
-10. For node updates, preserve all edges - they will automatically reconnect to the node with same ID"""
-
-def get_graph_commands(current_graph: Dict[str, Any], new_text: str) -> Dict[str, Any]:
-    """
-    Uses Gemini LLM to generate graph update commands based on natural language input.
-    
-    Args:
-        current_graph: Dict with 'nodes' and 'edges' lists
-        new_text: Natural language instruction from user
-        
-    Returns:
-        Dict with 'commands' list containing graph update actions
-    """
-    if not settings.GOOGLE_API_KEY:
-        raise ValueError("GOOGLE_API_KEY not configured")
-    
-    # Configure Gemini
-    genai.configure(api_key=settings.GOOGLE_API_KEY)
-    
-    # Use Gemini 2.0 Flash for fast responses
-    model = genai.GenerativeModel(
-        model_name='gemini-2.0-flash-exp',
-        generation_config={
-            'temperature': 0.1,
-            'top_p': 0.95,
-            'top_k': 40,
-            'max_output_tokens': 2048,
-        }
-    )
-    
-    # Format the current graph for the LLM
-    graph_json = json.dumps(current_graph, indent=2)
-    
+2. ONLY connect section nodes, NEVER connect instrument/element nodes
+3. When adding instruments without a section, DON'T connect them
+4. For incremental updates, only create/modify what's mentioned in the instruction
+5. Preserve existing graph structure unless explicitly asked to change it
+6. TEMPORAL/SEQUENTIAL KEYWORDS for SECTIONS ONLY: "after", "before", "then", "next", "following"
+7. Use existing node IDs from the current graph when making connections
+8. When instruction says "Update node: renamed X to Y", find the node with label X and use updateNode with its ID and the new label
+9. For node updates, never delete and recreate the node; updateNode keeps its edges"""
+
+JSON_RETURN_FORMAT = """{"commands": [
+  {
+    "action": "createNode",
+    "params": {
+      "id": "unique-id",
+      "label": "Display Name",
+      "type": "section",
+      "key": "C",
+      "bpm": 120
+    }
+  },
+  {
+    "action": "connectNodes",
+    "params": {
+      "source": "node-id-1",
+      "target": "node-id-2",
+      "relation": "next"
+    }
+  }
+]}"""
+
+# Keyed by settings.GRAPH_COMMAND_FORMAT
+SYSTEM_PROMPTS = {
+    "compact": _SYSTEM_PROMPT_TEMPLATE.replace("<return-format>", COMPACT_RETURN_FORMAT),
+    "json": _SYSTEM_PROMPT_TEMPLATE.replace("<return-format>", JSON_RETURN_FORMAT),
+}
+
+_CLOSING_INSTRUCTIONS = {
+    "compact": "Return the command lines only.",
+    "json": "Return updated commands in JSON only.",
+}
+
+# Sampling settings for graph commands; the model and output budget come from the route
+GRAPH_GENERATION_CONFIG = {
+    'temperature': 0.1,
+    'top_p': 0.95,
+    'top_k': 40,
+}
+
+
+def _graph_route(graph: CurrentGraph, instruction: str) -> ModelRoute:
+    return model_router.route("graph", Complexity(
+        instruction_chars=len(instruction),
+        entities=referenced_entities(graph, instruction),
+        graph_nodes=len(graph.nodes),
+    ))
+
+
+def _build_graph_prompt(context: GraphContext, new_text: str, command_format: str) -> str:
+    # Only the relevant subgraph goes in, as compact JSON, so prompt size stays bounded
+    graph_json = fastjson.dumps(context.to_prompt())
+    metrics.observe("graph_prompt_nodes", len(context.nodes))
+    metrics.observe("graph_prompt_chars", len(graph_json))
+
     # Combine system prompt and user message for Gemini
-    full_prompt = f"""{SYSTEM_PROMPT}
+    return f"""{SYSTEM_PROMPTS[command_format]}
 
 Current graph:
 {graph_json}
@@ -169,60 +184,79 @@ Current graph:
 Instruction:
 {new_text}
 
-Return updated commands in JSON only."""
-    
-    try:
-        # Generate response
-        response = model.generate_content(full_prompt)
-        
-        # Extract the response text
-        response_text = response.text.strip()
-        
-        # Remove markdown code blocks if present
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        if response_text.startswith("```"):
-            response_text = response_text[3:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-        response_text = response_text.strip()
-        
-        commands_data = json.loads(response_text)
-        
-        # Validate the response structure
-        if "commands" not in commands_data:
-            raise ValueError("Response missing 'commands' field")
-        
-        return commands_data
-        
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Failed to parse LLM response as JSON: {e}")
-    except Exception as e:
-        raise ValueError(f"Error calling LLM: {e}")
+{_CLOSING_INSTRUCTIONS[command_format]}"""
+
+
+def _known_ids(graph: CurrentGraph) -> Set[str]:
+    """Ids commands may refer to: every node and edge of the full graph, not just the prompt context"""
+    return {node.id for node in graph.nodes} | {edge.id for edge in graph.edges}
 
 
-async def get_graph_commands_async(current_graph: CurrentGraph, instruction: str) -> GraphCommandsResponse:
+def _correction_prompt(prompt: str, error: RepairFailed) -> str:
+    # Sent only when local repair gave up on the first answer
+    return f"""{prompt}
+
+Your previous answer could not be used ({error}). {_CLOSING_INSTRUCTIONS[settings.GRAPH_COMMAND_FORMAT]}"""
+
+
+async def get_graph_commands_async(
+    current_graph: CurrentGraph,
+    instruction: str,
+    context: Optional[GraphContext] = None
+) -> GraphCommandsResponse:
     """
-    Async wrapper for get_graph_commands that works with Pydantic models.
+    Uses Gemini to generate graph update commands from a natural language instruction.
+
+    Uses Gemini's async client, so cancelling the calling task (e.g. when the
+    client disconnects) abandons the upstream request.
 
     Args:
         current_graph: Current graph state as Pydantic model
         instruction: Natural language instruction
+        context: Subgraph to show the LLM (defaults to select_context)
 
     Returns:
         GraphCommandsResponse with list of commands
     """
-    # Convert Pydantic models to dicts
-    graph_dict = current_graph.model_dump()
+    if not gemini_keys:
+        raise ValueError("GOOGLE_API_KEY not configured")
+
+    context = context or select_context(current_graph, instruction)
 
-    # Call the LLM
-    commands_dict = get_graph_commands(graph_dict, instruction)
+    # Identical visible subgraph + instruction from any worker reuses the earlier answer
+    key = cache_key(context.to_prompt(), instruction)
+    commands_dict = await shared_store.get_json_async(GRAPH_COMMANDS_NAMESPACE, key)
+    if commands_dict is not None:
+        metrics.incr("llm_cache_hits", service="graph")
+        return GraphCommandsResponse(**commands_dict)
+    metrics.incr("llm_cache_misses", service="graph")
+
+    try:
+        route = _graph_route(current_graph, instruction)
+        prompt = _build_graph_prompt(context, instruction, settings.GRAPH_COMMAND_FORMAT)
+        for attempt in range(MAX_LLM_ATTEMPTS):
+            async with admission_controller.upstream_slot("gemini"):
+                with gemini_keys.lease() as api_key, model_router.timed(route), span("gemini.graph"):
+                    response = await model_router.model(route, GRAPH_GENERATION_CONFIG, api_key).generate_content_async(prompt)
+            try:
+                commands, _ = repair_output(response.text, settings.GRAPH_COMMAND_FORMAT, _known_ids(current_graph))
+                break
+            except RepairFailed as e:
+                if attempt == MAX_LLM_ATTEMPTS - 1:
+                    raise
+                metrics.incr("graph_llm_retries")
+                prompt = _correction_prompt(prompt, e)
+    except (ValueError, UpstreamBusy):
+        raise
+    except Exception as e:
+        raise ValueError(f"Error calling LLM: {e}")
 
-    # Validate and return as Pydantic model
-    return GraphCommandsResponse(**commands_dict)
+    # Cached after repair, so a hit never needs repairing again
+    await shared_store.set_json_async(GRAPH_COMMANDS_NAMESPACE, key, commands.model_dump(), ttl=settings.LLM_CACHE_TTL_S)
+    return commands
 
 
-def graph_to_music_prompt(graph_data: Dict[str, Any]) -> str:
+def graph_to_music_prompt(graph_data: CurrentGraph) -> str:
     """
     Convert a musical knowledge graph into a detailed text prompt for music generation.
 
@@ -230,13 +264,13 @@ def graph_to_music_prompt(graph_data: Dict[str, Any]) -> str:
     rich, detailed prompts that describe the musical composition.
 
     Args:
-        graph_data: Dict with 'nodes' and 'edges' lists
+        graph_data: Graph with nodes and edges
 
     Returns:
         Detailed text prompt describing the music to generate
     """
-    nodes = graph_data.get('nodes', [])
-    edges = graph_data.get('edges', [])
+    nodes = graph_data.nodes
+    edges = graph_data.edges
 
     if not nodes:
         return "Create ambient background music"
@@ -250,12 +284,10 @@ def graph_to_music_prompt(graph_data: Dict[str, Any]) -> str:
     # Build node lookup and categorize
     node_map = {}
     for node in nodes:
-        node_id = node.get('id')
-        node_data = node.get('data', {})
-        node_type = node_data.get('type', '')
-        label = node_data.get('label', '')
+        node_type = node.data.type
+        label = node.data.label
 
-        node_map[node_id] = node
+        node_map[node.id] = node
 
         if node_type == 'section':
             sections.append(node)
@@ -271,18 +303,17 @@ def graph_to_music_prompt(graph_data: Dict[str, Any]) -> str:
     section_instruments = {}  # section_id -> list of instrument labels
 
     for edge in edges:
-        source_id = edge.get('source')
-        target_id = edge.get('target')
-        relation = edge.get('data', {}).get('relation', '')
+        source_id = edge.source
+        relation = edge.relation
 
         source_node = node_map.get(source_id)
-        target_node = node_map.get(target_id)
+        target_node = node_map.get(edge.target)
 
         if not source_node or not target_node:
             continue
 
-        source_type = source_node.get('data', {}).get('type', '')
-        target_type = target_node.get('data', {}).get('type', '')
+        source_type = source_node.data.type
+        target_type = target_node.data.type
 
         # Track section sequence (section -> section)
         if source_type == 'section' and target_type == 'section' and relation == 'next':
@@ -292,7 +323,7 @@ def graph_to_music_prompt(graph_data: Dict[str, Any]) -> str:
         if source_type == 'section' and relation == 'has':
             if source_id not in section_instruments:
                 section_instruments[source_id] = []
-            section_instruments[source_id].append(target_node.get('data', {}).get('label', ''))
+            section_instruments[source_id].append(target_node.data.label)
 
     # Build the music prompt
     prompt_parts = []
@@ -311,37 +342,42 @@ def graph_to_music_prompt(graph_data: Dict[str, Any]) -> str:
         section_flow = []
 
         # Find first section (has outgoing but no incoming)
-        incoming_sections = {edge[1].get('id') for edge in section_sequence}
+        incoming_sections = {edge[1].id for edge in section_sequence}
         for sec_node in sections:
-            if sec_node.get('id') not in incoming_sections:
+            if sec_node.id not in incoming_sections:
                 section_flow.append(sec_node)
-                visited.add(sec_node.get('id'))
+                visited.add(sec_node.id)
                 break
 
         # Follow the sequence
-        while len(section_flow) < len(sections):
-            current_id = section_flow[-1].get('id')
+        while section_flow and len(section_flow) < len(sections):
+            current_id = section_flow[-1].id
             for source, target in section_sequence:
-                if source.get('id') == current_id and target.get('id') not in visited:
+                if source.id == current_id and target.id not in visited:
                     section_flow.append(target)
-                    visited.add(target.get('id'))
+                    visited.add(target.id)
                     break
             else:
                 break
 
         # Describe each section with its instruments
+        # Label lookup built once instead of scanning every node per instrument
+        nodes_by_label = {}
+        for node in nodes:
+            nodes_by_label.setdefault(node.data.label, node)
+
         for sec_node in section_flow:
-            sec_id = sec_node.get('id')
-            sec_label = sec_node.get('data', {}).get('label', '')
-            sec_details = sec_node.get('data', {}).get('details', '')
+            sec_id = sec_node.id
+            sec_label = sec_node.data.label
+            sec_details = sec_node.data.details
 
             # Get detailed instrument descriptions
             detailed_instruments = []
             for inst_label in section_instruments.get(sec_id, []):
                 # Find the instrument node to get its details
-                inst_node = next((n for n in nodes if n.get('data', {}).get('label') == inst_label), None)
+                inst_node = nodes_by_label.get(inst_label)
                 if inst_node:
-                    inst_details = inst_node.get('data', {}).get('details', '')
+                    inst_details = inst_node.data.details
                     detailed_instruments.append(inst_details if inst_details else inst_label)
                 else:
                     detailed_instruments.append(inst_label)
@@ -357,11 +393,11 @@ def graph_to_music_prompt(graph_data: Dict[str, Any]) -> str:
         # Discovery mode: just list instruments with their properties
         instrument_descriptions = []
         for inst_node in instruments:
-            inst_data = inst_node.get('data', {})
-            inst_label = inst_data.get('label', '')
-            inst_details = inst_data.get('details', '')
-            inst_key = inst_data.get('key', '')
-            inst_bpm = inst_data.get('bpm', '')
+            inst_data = inst_node.data
+            inst_label = inst_data.label
+            inst_details = inst_data.details
+            inst_key = inst_data.key
+            inst_bpm = inst_data.bpm
 
             # Use details if available, otherwise just the label
             if inst_details:
@@ -383,7 +419,7 @@ def graph_to_music_prompt(graph_data: Dict[str, Any]) -> str:
         prompt_parts.append(f"with {', '.join(moods)} mood")
 
     # Extract BPM from any node that has it
-    bpm_values = [node.get('data', {}).get('bpm') for node in nodes if node.get('data', {}).get('bpm')]
+    bpm_values = [node.data.bpm for node in nodes if node.data.bpm]
     if bpm_values:
         avg_bpm = int(sum(bpm_values) / len(bpm_values))
         prompt_parts.append(f"tempo around {avg_bpm} BPM")
@@ -0,0 +1,325 @@
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+from pydantic import BaseModel, ValidationError
+from app.core import fastjson
+from app.core.metrics import metrics
+from app.schemas.graph import (
+    NODE_TYPES,
+    ConnectNodesParams,
+    CreateNodeParams,
+    DeleteByIdParams,
+    GraphCommand,
+    GraphCommandsResponse,
+    UpdateNodeParams,
+)
+from app.services.command_grammar import parse_commands
+
+# Everything the model has been seen to call an action, squashed (lowercase, alphanumerics only)
+ACTION_ALIASES = {
+    "createnode": "createNode", "addnode": "createNode", "create": "createNode", "add": "createNode",
+    "connectnodes": "connectNodes", "connect": "connectNodes", "addedge": "connectNodes", "link": "connectNodes",
+    "deletebyid": "deleteById", "delete": "deleteById", "remove": "deleteById", "deletenode": "deleteById",
+    "updatenode": "updateNode", "update": "updateNode", "editnode": "updateNode", "modify": "updateNode",
+}
+
+PARAM_MODELS: Dict[str, type] = {
+    "createNode": CreateNodeParams,
+    "connectNodes": ConnectNodesParams,
+    "deleteById": DeleteByIdParams,
+    "updateNode": UpdateNodeParams,
+}
+
+# Off-vocabulary node types (and label words) mapped onto NODE_TYPES
+NODE_TYPE_ALIASES = {
+    "drums": "drum", "percussion": "drum", "beat": "drum", "kick": "drum", "snare": "drum", "hihat": "drum",
+    "bass": "bassline", "sub": "bassline", "808": "bassline",
+    "lead": "melody", "hook": "melody", "riff": "melody", "arpeggio": "melody",
+    "chords": "chord", "harmony": "chord", "piano": "chord", "keys": "chord", "guitar": "chord",
+    "pad": "synth", "pads": "synth", "synthesizer": "synth", "arp": "synth",
+    "vocals": "vocal", "voice": "vocal", "vox": "vocal", "choir": "vocal",
+    "effect": "fx", "effects": "fx", "sfx": "fx", "riser": "fx",
+    "intro": "section", "verse": "section", "chorus": "section", "bridge": "section", "outro": "section", "drop": "section",
+    "style": "genre", "mood": "genre",
+}
+# For a node nothing else identifies: the most generic instrument
+FALLBACK_NODE_TYPE = "synth"
+
+# Params sometimes arrive under other names
+PARAM_ALIASES = {"from": "source", "to": "target", "name": "label", "tempo": "bpm"}
+
+_FENCE = re.compile(r"```[a-zA-Z]*")
+_WORD = re.compile(r"[A-Za-z_]+")
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_SQUASH = re.compile(r"[^a-z0-9]")
+
+
+class RepairFailed(ValueError):
+    """LLM output that local repair could not turn into usable commands"""
+
+
+@dataclass
+class RepairReport:
+    """What repair had to fix, by kind; empty for clean output"""
+    issues: Counter = field(default_factory=Counter)
+
+    @property
+    def repaired(self) -> bool:
+        return bool(self.issues)
+
+
+def _squash(value: Any) -> str:
+    return _SQUASH.sub("", str(value).lower())
+
+
+def _scan(body: str, issues: Counter) -> str:
+    """
+    One pass over near-JSON: drops trailing commas, maps Python literals,
+    stops after the first complete value and, if the text was cut off
+    (e.g. at max_output_tokens), closes it after the last complete element.
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    # (length of out, open brackets) after each element closed inside an array
+    cut_points: List[Tuple[int, Tuple[str, ...]]] = []
+    in_string = escaped = False
+    i = 0
+    while i < len(body):
+        c = body[i]
+        if in_string:
+            out.append(c)
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+            out.append(c)
+        elif c in "{[":
+            stack.append(c)
+            out.append(c)
+        elif c in "}]":
+            if not stack:
+                break
+            stack.pop()
+            j = len(out) - 1
+            while j >= 0 and out[j].isspace():
+                j -= 1
+            if j >= 0 and out[j] == ",":
+                del out[j]
+                issues["trailing_comma"] += 1
+            out.append(c)
+            if not stack:
+                if body[i + 1:].strip():
+                    issues["trailing_text"] += 1
+                return "".join(out)
+            if stack[-1] == "[":
+                cut_points.append((len(out), tuple(stack)))
+        elif c.isalpha() or c == "_":
+            word = _WORD.match(body, i).group(0)
+            if word in _LITERALS:
+                issues["python_literal"] += 1
+            out.append(_LITERALS.get(word, word))
+            i += len(word)
+            continue
+        else:
+            out.append(c)
+        i += 1
+
+    if not cut_points:
+        raise RepairFailed("LLM output is not JSON")
+    issues["truncated"] += 1
+    length, still_open = cut_points[-1]
+    return "".join(out[:length]) + "".join("}" if b == "{" else "]" for b in reversed(still_open))
+
+
+def recover_json(text: str, issues: Counter) -> Any:
+    """
+    Parse LLM output that should be JSON but may not quite be.
+
+    Handles code fences anywhere, prose around the JSON, trailing commas,
+    Python-style literals and output truncated mid-command.
+
+    Raises:
+        RepairFailed: If no JSON value can be recovered
+    """
+    try:
+        return fastjson.loads(text)
+    except fastjson.JSONDecodeError:
+        pass
+
+    body = _FENCE.sub("", text)
+    starts = [index for index in (body.find("{"), body.find("[")) if index >= 0]
+    if not starts:
+        raise RepairFailed("LLM output contains no JSON")
+    if body[:min(starts)].strip() or "```" in text:
+        issues["wrapped"] += 1
+    try:
+        return fastjson.loads(_scan(body[min(starts):], issues))
+    except fastjson.JSONDecodeError as e:
+        raise RepairFailed(f"LLM output is not valid JSON: {e}")
+
+
+def coerce_node_type(value: Optional[str], label: Optional[str]) -> str:
+    """Map a node type onto NODE_TYPES, falling back to words in the label"""
+    for candidate in [value, *(label or "").split()]:
+        if not candidate:
+            continue
+        squashed = _squash(candidate)
+        if squashed in NODE_TYPES:
+            return squashed
+        if squashed in NODE_TYPE_ALIASES:
+            return NODE_TYPE_ALIASES[squashed]
+        if squashed.endswith("s") and squashed[:-1] in NODE_TYPES:
+            return squashed[:-1]
+    return FALLBACK_NODE_TYPE
+
+
+def _fix_params(action: str, params: Dict[str, Any], issues: Counter) -> Dict[str, Any]:
+    params = {PARAM_ALIASES.get(name, name): value for name, value in params.items()}
+    for name in ("id", "source", "target"):
+        if isinstance(params.get(name), (int, float)):
+            params[name] = str(params[name])
+            issues["id_coerced"] += 1
+
+    if action == "createNode" and not params.get("label") and isinstance(params.get("id"), str):
+        params["label"] = params["id"].replace("-", " ").replace("_", " ").title()
+        issues["label_filled"] += 1
+
+    if action == "createNode" or params.get("type") is not None:
+        node_type = coerce_node_type(params.get("type"), params.get("label"))
+        if node_type != params.get("type"):
+            params["type"] = node_type
+            issues["type_coerced"] += 1
+
+    bpm = params.get("bpm")
+    if bpm is not None and not isinstance(bpm, int):
+        match = _NUMBER.search(str(bpm))
+        params["bpm"] = round(float(match.group(0))) if match else None
+        issues["bpm_coerced"] += 1
+    return params
+
+
+def repair_commands(raw_commands: Any, known_ids: Set[str]) -> Tuple[List[GraphCommand], RepairReport]:
+    """
+    Validate each command against its typed params model, fixing what can be fixed.
+
+    Actions are matched loosely, flat params are lifted, node types are
+    coerced onto NODE_TYPES, and commands referring to ids that neither
+    exist nor are created earlier in the batch are dropped.
+
+    Args:
+        raw_commands: The "commands" value from the LLM output
+        known_ids: Node and edge ids of the current graph
+
+    Returns:
+        Tuple of (valid commands, report)
+
+    Raises:
+        RepairFailed: If there were commands but none survived
+    """
+    report = RepairReport()
+    issues = report.issues
+    if not isinstance(raw_commands, list):
+        raise RepairFailed("'commands' is not a list")
+
+    known = set(known_ids)
+    commands: List[GraphCommand] = []
+    for raw in raw_commands:
+        if not isinstance(raw, dict):
+            issues["invalid_dropped"] += 1
+            continue
+
+        action = ACTION_ALIASES.get(_squash(raw.get("action", "")))
+        if action is None:
+            issues["invalid_dropped"] += 1
+            continue
+        if action != raw["action"]:
+            issues["action_alias"] += 1
+
+        params = raw.get("params")
+        if not isinstance(params, dict):
+            params = {name: value for name, value in raw.items() if name != "action"}
+            issues["params_lifted"] += 1
+
+        try:
+            model: BaseModel = PARAM_MODELS[action](**_fix_params(action, params, issues))
+        except ValidationError:
+            issues["invalid_dropped"] += 1
+            continue
+
+        references = [model.source, model.target] if action == "connectNodes" else [] if action == "createNode" else [model.id]
+        if any(reference not in known for reference in references):
+            issues["dangling_dropped"] += 1
+            continue
+        if action == "createNode":
+            known.add(model.id)
+
+        commands.append(GraphCommand(action=action, params=model.model_dump(exclude_none=True)))
+
+    if raw_commands and not commands:
+        raise RepairFailed(f"None of the {len(raw_commands)} LLM commands were usable")
+    return commands, report
+
+
+def _json_commands(text: str, issues: Counter) -> List[Any]:
+    """The command list of JSON output, in any of the shapes the model produces"""
+    data = recover_json(text, issues)
+    if isinstance(data, list):
+        issues["bare_list"] += 1
+        return data
+    if isinstance(data, dict) and "commands" in data:
+        return data["commands"]
+    if isinstance(data, dict) and "action" in data:
+        issues["bare_command"] += 1
+        return [data]
+    raise RepairFailed("Response missing 'commands' field")
+
+
+def repair_output(text: str, command_format: str, known_ids: Set[str]) -> Tuple[GraphCommandsResponse, RepairReport]:
+    """
+    Turn raw graph-LLM output into validated commands, repairing locally.
+
+    Records graph_output_repairs{outcome} (clean, repaired or failed) and
+    graph_repair_issues{kind}, so the repair rate is visible per issue.
+    Compact output with no command lines is retried as JSON before giving
+    up (kind compact_json_fallback), so prose followed by a JSON answer
+    does not cost another LLM call.
+
+    Args:
+        text: Raw LLM output
+        command_format: "compact" or "json" (JSON is accepted in either)
+        known_ids: Node and edge ids of the current graph
+
+    Raises:
+        RepairFailed: If the output cannot be made usable
+    """
+    issues: Counter = Counter()
+    try:
+        stripped = text.strip()
+        if command_format == "compact" and not _FENCE.sub("", stripped).lstrip().startswith(("{", "[")):
+            raw_commands = parse_commands(stripped, issues)
+            if not raw_commands and (issues["prose_line"] or issues["line_dropped"]):
+                # The model may have answered in JSON after a line of prose
+                try:
+                    raw_commands = _json_commands(stripped, issues)
+                except RepairFailed:
+                    raise RepairFailed("No command lines in LLM output")
+                issues["compact_json_fallback"] += 1
+        else:
+            raw_commands = _json_commands(stripped, issues)
+
+        commands, report = repair_commands(raw_commands, known_ids)
+    except RepairFailed:
+        metrics.incr("graph_output_repairs", outcome="failed")
+        raise
+
+    report.issues.update(issues)
+    for kind, count in report.issues.items():
+        metrics.incr("graph_repair_issues", count, kind=kind)
+    metrics.incr("graph_output_repairs", outcome="repaired" if report.repaired else "clean")
+    return GraphCommandsResponse(commands=commands), report
@@ -0,0 +1,106 @@
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Tuple
+import google.generativeai as genai
+from app.core.config import settings
+from app.core.key_pool import PooledKey, configure_process_key
+from app.core.metrics import metrics
+
+# Cheapest first; a request gets the first tier whose limits it fits in
+TIERS = ("light", "standard", "heavy")
+
+
+@dataclass(frozen=True)
+class Complexity:
+    """Signals a request is routed on"""
+    instruction_chars: int
+    entities: int
+    graph_nodes: int
+
+    def fits(self, limits: Dict[str, int]) -> bool:
+        return all(getattr(self, signal) <= limit for signal, limit in limits.items())
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    service: str
+    tier: str
+    model: str
+    max_output_tokens: int
+
+
+def classify(complexity: Complexity) -> str:
+    """
+    Complexity tier for a request.
+
+    "light" when every signal is within LLM_ROUTE_LIMITS["light"],
+    "standard" when within LLM_ROUTE_LIMITS["standard"], otherwise "heavy".
+    """
+    for tier in TIERS[:-1]:
+        if complexity.fits(settings.LLM_ROUTE_LIMITS.get(tier, {})):
+            return tier
+    return TIERS[-1]
+
+
+class ModelRouter:
+    """
+    Picks the Gemini model and output budget for each LLM call.
+
+    Each service has a route per tier in settings.LLM_ROUTES; a service
+    without a route for the chosen tier falls back to the next heavier
+    one it has. Services keep their own sampling settings (temperature,
+    top_p, ...); the route decides the model and max_output_tokens.
+    """
+
+    def __init__(self):
+        self._models: Dict[Tuple[str, str, Tuple[Tuple[str, Any], ...]], genai.GenerativeModel] = {}
+
+    def route(self, service: str, complexity: Complexity) -> ModelRoute:
+        routes = settings.LLM_ROUTES[service]
+        tier = classify(complexity)
+        candidates = TIERS[TIERS.index(tier):] + TIERS[:TIERS.index(tier)][::-1]
+        tier = next(name for name in candidates if name in routes)
+        return ModelRoute(
+            service=service,
+            tier=tier,
+            model=routes[tier]["model"],
+            max_output_tokens=routes[tier]["max_output_tokens"],
+        )
+
+    def model(self, route: ModelRoute, generation_config: Dict[str, Any], api_key: PooledKey) -> genai.GenerativeModel:
+        """GenerativeModel for a route on one pooled API key, reused across calls with the same settings"""
+        config = {**generation_config, "max_output_tokens": route.max_output_tokens}
+        cache_key = (api_key.name, route.model, tuple(sorted(config.items())))
+        model = self._models.get(cache_key)
+        if model is None:
+            model = genai.GenerativeModel(model_name=route.model, generation_config=config)
+            # The SDK only reads the process-wide key; bind this key's clients instead.
+            # Both attributes are private, so check they still exist before relying on them
+            # (None when the key pool has already fallen back to the process-wide key)
+            manager = api_key.client
+            if manager is not None:
+                if hasattr(manager, "get_default_client") and hasattr(model, "_client") and hasattr(model, "_async_client"):
+                    model._client = manager.get_default_client("generative")
+                    model._async_client = manager.get_default_client("generative_async")
+                else:
+                    configure_process_key(api_key.secret, "GenerativeModel has no _client/_async_client to bind")
+            self._models[cache_key] = model
+        return model
+
+    @contextmanager
+    def timed(self, route: ModelRoute) -> Iterator[None]:
+        """Record latency and outcome of one call on `route`"""
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            labels = {"service": route.service, "tier": route.tier, "model": route.model}
+            metrics.incr("llm_route_requests", outcome=outcome, **labels)
+            metrics.observe("llm_route_seconds", time.monotonic() - started, **labels)
+
+
+# Singleton instance
+model_router = ModelRouter()
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Dict, List, Optional
+from app.core.admission import admission_controller
+from app.core.audio_formats import AUDIO_FORMATS, AudioFormat
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.store import shared_store
+from app.schemas.graph import CurrentGraph, GraphEdge, GraphNode
+from app.services.graph_llm_service import graph_to_music_prompt
+from app.services.music_service import music_service
+
+logger = logging.getLogger(__name__)
+
+BUDGET_NAMESPACE = "music_prefetch_budget"
+# Audio format each session's music requests negotiated, by session id
+FORMAT_NAMESPACE = "music_prefetch_format"
+# Newest prefetched composition per "<session>:<format>" that no request has used yet
+PENDING_NAMESPACE = "music_prefetch_pending"
+
+
+class MusicPrefetcher:
+    """
+    Speculative background composition of a session's current graph.
+
+    Every graph change restarts the session's idle timer. Once the graph has
+    been stable for MUSIC_PREFETCH_IDLE_S, its music prompt is composed into
+    the music cache, so the user's next Generate is a cache hit (or joins
+    the composition already under way).
+
+    Speculation is low priority: it only starts while the ElevenLabs limiter
+    has more than MUSIC_PREFETCH_RESERVED_SLOTS free slots and nobody is
+    queued, and it is cancelled when the graph changes again. Each session
+    may start at most MUSIC_PREFETCH_SESSION_BUDGET compositions per
+    MUSIC_PREFETCH_BUDGET_WINDOW_S, counted in the shared store so the cap
+    holds across workers.
+
+    The format composed is the one the session's last music request
+    negotiated (the cache key includes it), or MUSIC_PREFETCH_FORMATS before
+    its first. A prefetch replaced by a newer one before any request used it
+    is logged and counted as music_prefetch_unused.
+    """
+
+    def __init__(self):
+        self._timers: Dict[str, asyncio.Task] = {}
+
+    def schedule(self, session_id: str, nodes: List[GraphNode], edges: List[GraphEdge]) -> None:
+        """Restart the session's idle timer for this graph. A no-op unless MUSIC_PREFETCH_ENABLED."""
+        if not settings.MUSIC_PREFETCH_ENABLED:
+            return
+
+        previous = self._timers.pop(session_id, None)
+        if previous is not None:
+            previous.cancel()
+        if not nodes:
+            return
+
+        task = asyncio.create_task(self._after_idle(session_id, CurrentGraph(nodes=nodes, edges=edges)))
+        self._timers[session_id] = task
+        task.add_done_callback(lambda done: self._forget(session_id, done))
+
+    def _forget(self, session_id: str, task: asyncio.Task) -> None:
+        # A cancelled timer finishes after its replacement is registered
+        if self._timers.get(session_id) is task:
+            del self._timers[session_id]
+
+    async def record_request(self, session_id: str, key: str, audio_format: AudioFormat) -> None:
+        """
+        Note a user's music request for the session.
+
+        Its format becomes the one prefetched for the session, and a pending
+        prefetch with the same cache key counts as used. Store errors are
+        logged, never raised: the request itself has been answered.
+        """
+        if not settings.MUSIC_PREFETCH_ENABLED:
+            return
+        try:
+            await shared_store.set_json_async(FORMAT_NAMESPACE, session_id, audio_format.name, ttl=settings.SESSION_TTL_S)
+            pending_key = f"{session_id}:{audio_format.name}"
+            pending = await shared_store.get_json_async(PENDING_NAMESPACE, pending_key)
+            if pending is not None and pending["key"] == key:
+                await shared_store.delete_async(PENDING_NAMESPACE, pending_key)
+                metrics.incr("music_prefetch_used", format=audio_format.name)
+        except sqlite3.Error as e:
+            logger.warning("Could not record music request for prefetch: %s", e)
+
+    async def _formats(self, session_id: str) -> List[str]:
+        negotiated = await shared_store.get_json_async(FORMAT_NAMESPACE, session_id)
+        if negotiated in AUDIO_FORMATS:
+            return [negotiated]
+        return settings.MUSIC_PREFETCH_FORMATS
+
+    async def _after_idle(self, session_id: str, graph: CurrentGraph) -> None:
+        await asyncio.sleep(settings.MUSIC_PREFETCH_IDLE_S)
+        prompt = graph_to_music_prompt(graph)
+        for name in await self._formats(session_id):
+            await self._speculate(session_id, prompt, name)
+
+    async def _replace_pending(self, session_id: str, key: str, format_name: str) -> None:
+        """Make `key` the session's pending prefetch, reporting the one it replaces if it went unused"""
+        now = time.time()
+
+        def swap(previous):
+            return {"key": key, "prefetched_at": now}, previous
+
+        previous = await shared_store.update_json_async(
+            PENDING_NAMESPACE, f"{session_id}:{format_name}", swap, ttl=settings.MUSIC_CACHE_TTL_S
+        )
+        if previous is not None and previous["key"] != key:
+            metrics.incr("music_prefetch_unused", format=format_name)
+            logger.info(
+                "Prefetched music was never used (session %s, %s, replaced after %.0f s)",
+                session_id, format_name, now - previous["prefetched_at"]
+            )
+
+    def _has_spare_capacity(self) -> bool:
+        limiter = admission_controller.upstreams["elevenlabs"]
+        free = limiter.max_concurrent - limiter.in_flight
+        return limiter.waiting == 0 and free > settings.MUSIC_PREFETCH_RESERVED_SLOTS
+
+    async def _charge(self, session_id: str) -> bool:
+        """Spend one unit of the session's budget; False if it is used up"""
+        now = time.time()
+
+        def spend(budget):
+            if budget is None or now - budget["window_started"] >= settings.MUSIC_PREFETCH_BUDGET_WINDOW_S:
+                budget = {"window_started": now, "spent": 0}
+            if budget["spent"] >= settings.MUSIC_PREFETCH_SESSION_BUDGET:
+                return budget, False
+            budget["spent"] += 1
+            return budget, True
+
+        return await shared_store.update_json_async(
+            BUDGET_NAMESPACE, session_id, spend, ttl=settings.MUSIC_PREFETCH_BUDGET_WINDOW_S
+        )
+
+    async def _speculate(self, session_id: str, prompt: str, format_name: str) -> None:
+        audio_format = AUDIO_FORMATS[format_name]
+        duration_ms = settings.MUSIC_PREFETCH_DURATION_MS
+        key = music_service.cache_key(prompt, duration_ms, audio_format)
+
+        skipped: Optional[str] = None
+        if await music_service.is_cached(key):
+            skipped = "cached"
+        elif music_service.is_composing(key):
+            skipped = "in_flight"
+        elif not self._has_spare_capacity():
+            skipped = "busy"
+        elif not await self._charge(session_id):
+            skipped = "budget"
+        if skipped:
+            metrics.incr("music_prefetch_skipped", reason=skipped, format=format_name)
+            return
+
+        # The composition takes its own ElevenLabs slot
+        metrics.incr("music_prefetch_started", format=format_name)
+        started = time.monotonic()
+        try:
+            await music_service.generate_music(prompt, duration_ms, audio_format, speculative=True)
+        except asyncio.CancelledError:
+            metrics.incr("music_prefetch_cancelled", format=format_name)
+            raise
+        except Exception as e:
+            metrics.incr("music_prefetch_failed", format=format_name)
+            logger.warning("Speculative composition failed: %s", e)
+            return
+
+        metrics.observe("music_prefetch_seconds", time.monotonic() - started, format=format_name)
+        await self._replace_pending(session_id, key, format_name)
+        logger.debug("Prefetched music", extra={"session_id": session_id, "format": format_name})
+
+
+# Singleton instance
+music_prefetch = MusicPrefetcher()
@@ -1,37 +1,119 @@
-from elevenlabs.client import ElevenLabs
+import asyncio
+import time
+from typing import Dict
+from app.core.admission import UpstreamBusy, admission_controller
+from app.core.audio_formats import AudioFormat, DEFAULT_AUDIO_FORMAT
+from app.core.cancellation import drain_in_thread
 from app.core.config import settings
-import io
+from app.core.key_pool import elevenlabs_keys
+from app.core.metrics import metrics
+from app.core.store import shared_store, cache_key
+
+MUSIC_AUDIO_NAMESPACE = "music_audio"
+MUSIC_META_NAMESPACE = "music_meta"
+
+class _Flight:
+    """A composition in progress and how many callers are waiting on it"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
 
 class MusicGenerationService:
     def __init__(self):
-        self.client = ElevenLabs(api_key=settings.ELEVENLABS_API_KEY)
+        self._in_flight: Dict[str, _Flight] = {}
 
-    async def generate_music(self, prompt: str, duration_ms: int = 10000) -> bytes:
+    def cache_key(self, prompt: str, duration_ms: int, audio_format: AudioFormat = DEFAULT_AUDIO_FORMAT) -> str:
+        return cache_key(prompt, duration_ms, audio_format.output_format)
+
+    async def is_cached(self, key: str) -> bool:
+        # The metadata row expires with the audio and is far cheaper to read
+        return await shared_store.get_json_async(MUSIC_META_NAMESPACE, key) is not None
+
+    def is_composing(self, key: str) -> bool:
+        return key in self._in_flight
+
+    async def generate_music(
+        self,
+        prompt: str,
+        duration_ms: int = 10000,
+        audio_format: AudioFormat = DEFAULT_AUDIO_FORMAT,
+        speculative: bool = False
+    ) -> bytes:
         """
         Generate music using ElevenLabs API
 
+        Results are cached in the shared store, so a repeat of the same prompt
+        on any worker returns immediately. Concurrent calls for the same prompt
+        share one composition. The stream is drained in a worker thread; once
+        every caller waiting on a composition is cancelled, the download stops
+        at the next chunk.
+
         Args:
             prompt: Text description of the music (e.g., "hiphop style, quick tempo, drums, guitar")
             duration_ms: Duration of the music in milliseconds (default: 10000ms = 10 seconds)
+            audio_format: Encoding to request from ElevenLabs (default: 128 kbps MP3)
+            speculative: Background prefetch rather than a user request (only affects metrics)
 
         Returns:
             Audio bytes
         """
-        try:
-            # Generate music using ElevenLabs
-            track = self.client.music.compose(
-                prompt=prompt,
-                music_length_ms=duration_ms,
-            )
+        key = self.cache_key(prompt, duration_ms, audio_format)
+        cached = await shared_store.get_async(MUSIC_AUDIO_NAMESPACE, key)
+        if cached is not None:
+            metrics.incr("music_cache_hits", format=audio_format.name, speculative=speculative)
+            return cached
 
-            # Convert generator to bytes
-            audio_bytes = io.BytesIO()
-            for chunk in track:
-                audio_bytes.write(chunk)
+        flight = self._in_flight.get(key)
+        if flight is None:
+            metrics.incr("music_cache_misses", format=audio_format.name, speculative=speculative)
+            flight = _Flight(asyncio.create_task(self._compose(key, prompt, duration_ms, audio_format, speculative)))
+            self._in_flight[key] = flight
+            flight.task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            metrics.incr("music_in_flight_joins", format=audio_format.name, speculative=speculative)
 
-            return audio_bytes.getvalue()
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1:
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
 
+    async def _compose(self, key: str, prompt: str, duration_ms: int, audio_format: AudioFormat, speculative: bool) -> bytes:
+        try:
+            # Generate music using ElevenLabs
+            started = time.monotonic()
+            async with admission_controller.upstream_slot("elevenlabs"):
+                with elevenlabs_keys.lease() as api_key:
+                    audio_bytes = await drain_in_thread(
+                        lambda: api_key.client.music.compose(
+                            prompt=prompt,
+                            music_length_ms=duration_ms,
+                            output_format=audio_format.output_format,
+                        ),
+                        upstream="elevenlabs",
+                    )
+
+        except UpstreamBusy:
+            raise
         except Exception as e:
             raise Exception(f"Music generation failed: {str(e)}")
 
+        await shared_store.set_async(MUSIC_AUDIO_NAMESPACE, key, audio_bytes, ttl=settings.MUSIC_CACHE_TTL_S)
+        await shared_store.set_json_async(MUSIC_META_NAMESPACE, key, {
+            "prompt": prompt,
+            "duration_ms": duration_ms,
+            "format": audio_format.name,
+            "bytes": len(audio_bytes),
+            "compose_seconds": round(time.monotonic() - started, 3),
+            "speculative": speculative,
+            "created_at": time.time(),
+        }, ttl=settings.MUSIC_CACHE_TTL_S)
+        return audio_bytes
+
 music_service = MusicGenerationService()
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+from app.core.audio_formats import AUDIO_FORMATS, AudioFormat
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.store import shared_store, cache_key
+from app.schemas.graph import GraphNode
+from app.services.ai_producer_service import ai_producer_service
+
+logger = logging.getLogger(__name__)
+
+OPENERS_NAMESPACE = "producer_openers"
+
+# Short "I heard you" clips that play while the real feedback is produced.
+# They only acknowledge the change, so they never contradict what follows.
+# Keys are "added:<node type>" for the node-type vocabulary, plus one per
+# kind of change the frontend reports in the context string.
+OPENER_TEXTS: Dict[str, str] = {
+    "added:drum": "Ooh, drums. Let me hear that groove...",
+    "added:bassline": "A bassline, nice. Let me have a listen...",
+    "added:melody": "Ooh, a melody. Give me a second...",
+    "added:chord": "Some chords, okay. Let me listen...",
+    "added:synth": "Synths, I like it. One sec...",
+    "added:vocal": "Vocals, nice. Let me take a listen...",
+    "added:fx": "Some effects, cool. Let me hear it...",
+    "added:section": "A new section. Let me check the flow...",
+    "added:genre": "Ooh, switching up the vibe. Let me listen...",
+    "setup": "Alright, let's hear what we've got...",
+    "removed": "Okay, trimming things down. Let me listen...",
+    "connected": "Got it, tying those together. One sec...",
+    "edited": "Okay, tweaking things. Let me hear it...",
+    "generic": "Alright, let me have a listen...",
+}
+
+# Context prefixes sent by the graph page (see app/graph/page.tsx)
+_CONTEXT_KINDS = (
+    ("Initial setup:", "setup"),
+    ("Just removed:", "removed"),
+    ("Just connected", "connected"),
+    ("Edited node:", "edited"),
+)
+_ADDED = re.compile(r"Just added:\s*([^.,]+)")
+
+
+def opener_kind(nodes: List[GraphNode], context: Optional[str]) -> str:
+    """Which opener fits the change described by `context`"""
+    if not context:
+        return "generic"
+    for prefix, kind in _CONTEXT_KINDS:
+        if context.startswith(prefix):
+            return kind
+
+    match = _ADDED.match(context)
+    if match:
+        label = match.group(1).strip().lower()
+        for node in nodes:
+            if node.data.label.strip().lower() == label:
+                kind = f"added:{node.data.type}"
+                return kind if kind in OPENER_TEXTS else "generic"
+    return "generic"
+
+
+class OpenerBank:
+    """
+    Pre-synthesized opener clips held in memory, per opener and audio format.
+
+    Clips are also persisted in the shared store, so only the first worker
+    (or the first boot with an empty store) pays for synthesis.
+    """
+
+    def __init__(self):
+        self._clips: Dict[Tuple[str, str], bytes] = {}
+        self._pending: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    def _store_key(self, kind: str, audio_format: AudioFormat) -> str:
+        return cache_key(OPENER_TEXTS[kind], settings.ELEVENLABS_VOICE_ID, audio_format.output_format)
+
+    async def _load(self, kind: str, audio_format: AudioFormat) -> Optional[bytes]:
+        key = self._store_key(kind, audio_format)
+        clip = await shared_store.get_async(OPENERS_NAMESPACE, key)
+        if clip is None:
+            try:
+                clip = await ai_producer_service.generate_voice_feedback(OPENER_TEXTS[kind], audio_format)
+            except Exception as e:
+                logger.warning("Could not synthesize opener %r (%s): %s", kind, audio_format.name, e)
+                return None
+            await shared_store.set_async(OPENERS_NAMESPACE, key, clip)
+        self._clips[(kind, audio_format.name)] = clip
+        return clip
+
+    def _ensure(self, kind: str, audio_format: AudioFormat) -> None:
+        """Start loading a clip in the background unless it is loaded or loading"""
+        slot = (kind, audio_format.name)
+        if slot in self._clips or slot in self._pending:
+            return
+        task = asyncio.create_task(self._load(kind, audio_format))
+        self._pending[slot] = task
+        task.add_done_callback(lambda _: self._pending.pop(slot, None))
+
+    async def warm(self, format_names: Optional[List[str]] = None, concurrency: int = 2) -> None:
+        """
+        Load or synthesize every opener for the given formats.
+
+        Args:
+            format_names: Keys of AUDIO_FORMATS (defaults to settings.PRODUCER_OPENER_FORMATS)
+            concurrency: Parallel TTS calls
+        """
+        if not ai_producer_service.elevenlabs_configured:
+            return
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def load(kind: str, audio_format: AudioFormat) -> None:
+            async with semaphore:
+                await self._load(kind, audio_format)
+
+        names = format_names or settings.PRODUCER_OPENER_FORMATS
+        await asyncio.gather(*(
+            load(kind, AUDIO_FORMATS[name]) for name in names for kind in OPENER_TEXTS
+        ))
+        logger.info("%d opener clips ready", len(self._clips))
+
+    def pick(self, nodes: List[GraphNode], context: Optional[str], audio_format: AudioFormat) -> Optional[Tuple[str, bytes]]:
+        """
+        Opener clip for this change, if one is ready in memory.
+
+        A miss never waits on synthesis: it queues the clip for next time
+        and returns None.
+
+        Returns:
+            Tuple of (opener text, audio bytes), or None
+        """
+        kind = opener_kind(nodes, context)
+        clip = self._clips.get((kind, audio_format.name))
+        metrics.incr("producer_opener_lookups", kind=kind, format=audio_format.name, hit=clip is not None)
+        if clip is None:
+            if ai_producer_service.elevenlabs_configured:
+                self._ensure(kind, audio_format)
+            return None
+        return OPENER_TEXTS[kind], clip
+
+
+# Singleton instance
+producer_openers = OpenerBank()
@@ -0,0 +1,268 @@
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Tuple
+from app.schemas.graph import GraphNode, GraphEdge
+
+
+# Musical key compatibility (Circle of Fifths), mirrors frontend calculateCompatibility.ts
+KEY_COMPATIBILITY: Dict[str, List[str]] = {
+    "C": ["C", "G", "F", "Am", "Em", "Dm"],
+    "G": ["G", "D", "C", "Em", "Bm", "Am"],
+    "D": ["D", "A", "G", "Bm", "F#m", "Em"],
+    "A": ["A", "E", "D", "F#m", "C#m", "Bm"],
+    "E": ["E", "B", "A", "C#m", "G#m", "F#m"],
+    "F": ["F", "C", "Bb", "Dm", "Am", "Gm"],
+    "Bb": ["Bb", "F", "Eb", "Gm", "Dm", "Cm"],
+    "Eb": ["Eb", "Bb", "Ab", "Cm", "Gm", "Fm"],
+    "Am": ["Am", "Em", "Dm", "C", "G", "F"],
+    "Em": ["Em", "Bm", "Am", "G", "D", "C"],
+    "Dm": ["Dm", "Am", "Gm", "F", "C", "Bb"],
+}
+
+# Which part of the spectrum each node type mostly occupies
+FREQUENCY_BANDS: Dict[str, str] = {
+    "drum": "low",
+    "bassline": "low",
+    "chord": "mid",
+    "melody": "mid",
+    "vocal": "mid",
+    "synth": "high",
+    "fx": "high",
+}
+
+BAND_SUGGESTIONS: Dict[str, str] = {
+    "low": "a bassline or kick pattern to anchor the low end",
+    "mid": "a melodic or chord element to fill out the mid-range",
+    "high": "a bright synth or some airy fx to add sparkle up top",
+}
+
+CORE_SECTIONS = ["intro", "verse", "chorus", "outro"]
+
+# Section element counts outside this range get flagged
+BUSY_SECTION_THRESHOLD = 5
+
+# BPMs further apart than this (and not a half/double-time relationship) clash
+BPM_TOLERANCE = 10
+
+
+@dataclass
+class CompositionFeatures:
+    """Everything the rule engine knows about a composition, gathered in one pass"""
+    total_nodes: int = 0
+    total_edges: int = 0
+    node_types: Dict[str, int] = field(default_factory=dict)
+    band_counts: Dict[str, int] = field(default_factory=lambda: {"low": 0, "mid": 0, "high": 0})
+    has_key_info: bool = False
+    has_bpm_info: bool = False
+    key_clashes: List[Tuple[str, str]] = field(default_factory=list)
+    bpm_clashes: List[Tuple[int, int]] = field(default_factory=list)
+    sections: List[str] = field(default_factory=list)
+    missing_sections: List[str] = field(default_factory=list)
+    section_density: Dict[str, int] = field(default_factory=dict)
+    genres: List[str] = field(default_factory=list)
+    labels_by_type: Dict[str, List[str]] = field(default_factory=dict)
+
+    @property
+    def busy_sections(self) -> List[str]:
+        return [s for s, n in self.section_density.items() if n > BUSY_SECTION_THRESHOLD]
+
+    @property
+    def empty_sections(self) -> List[str]:
+        return [s for s, n in self.section_density.items() if n == 0]
+
+    @property
+    def band_gaps(self) -> List[str]:
+        # Only meaningful once there is something playing at all
+        if not any(self.band_counts.values()):
+            return []
+        return [band for band, count in self.band_counts.items() if count == 0]
+
+    def stats(self) -> Dict[str, Any]:
+        """Compact summary suitable for embedding in an LLM prompt"""
+        return {
+            "total_nodes": self.total_nodes,
+            "total_edges": self.total_edges,
+            "node_types": self.node_types,
+            "has_key_info": self.has_key_info,
+            "has_bpm_info": self.has_bpm_info,
+            "frequency_balance": self.band_counts,
+            "key_clashes": [list(pair) for pair in self.key_clashes],
+            "bpm_clashes": [list(pair) for pair in self.bpm_clashes],
+            "missing_sections": self.missing_sections,
+            "section_density": self.section_density,
+        }
+
+
+def _keys_compatible(a: str, b: str) -> Optional[bool]:
+    """None when neither key is in the compatibility table"""
+    if a not in KEY_COMPATIBILITY and b not in KEY_COMPATIBILITY:
+        return None
+    return b in KEY_COMPATIBILITY.get(a, []) or a in KEY_COMPATIBILITY.get(b, [])
+
+
+def _bpms_compatible(a: float, b: float) -> bool:
+    if abs(a - b) <= BPM_TOLERANCE:
+        return True
+    low, high = sorted((a, b))
+    # Half/double time grooves sit together fine
+    return abs(high - 2 * low) <= BPM_TOLERANCE
+
+
+def extract_features(nodes: List[GraphNode], edges: List[GraphEdge]) -> CompositionFeatures:
+    """
+    Compute composition features in a single pass over nodes and edges.
+
+    Args:
+        nodes: Graph nodes
+        edges: Graph edges
+
+    Returns:
+        CompositionFeatures describing balance, clashes, structure and density
+    """
+    features = CompositionFeatures(total_nodes=len(nodes), total_edges=len(edges))
+
+    section_labels: Dict[str, str] = {}
+    keys: Dict[str, str] = {}
+    bpms: Dict[int, str] = {}
+
+    for node in nodes:
+        data = node.data
+        node_type = data.type or "unknown"
+        label = data.label or node.id
+
+        features.node_types[node_type] = features.node_types.get(node_type, 0) + 1
+        features.labels_by_type.setdefault(node_type, []).append(label)
+
+        band = FREQUENCY_BANDS.get(node_type)
+        if band:
+            features.band_counts[band] += 1
+
+        if node_type == "section":
+            section_labels[node.id] = label
+            features.section_density[label] = 0
+        elif node_type == "genre":
+            features.genres.append(label)
+
+        if data.key:
+            features.has_key_info = True
+            keys.setdefault(data.key, label)
+
+        if data.bpm:
+            features.has_bpm_info = True
+            bpms.setdefault(data.bpm, label)
+
+    for edge in edges:
+        section_label = section_labels.get(edge.source)
+        if section_label is not None and edge.relation in ("has", "plays-in"):
+            features.section_density[section_label] += 1
+
+    # Clashes are checked over distinct values only, so cost stays tiny however many nodes share a key
+    distinct_keys = list(keys)
+    for i, a in enumerate(distinct_keys):
+        for b in distinct_keys[i + 1:]:
+            if _keys_compatible(a, b) is False:
+                features.key_clashes.append((a, b))
+
+    distinct_bpms = sorted(bpms)
+    for i, a in enumerate(distinct_bpms):
+        for b in distinct_bpms[i + 1:]:
+            if not _bpms_compatible(a, b):
+                features.bpm_clashes.append((a, b))
+
+    features.sections = list(section_labels.values())
+    if features.sections:
+        present = " ".join(s.lower() for s in features.sections)
+        features.missing_sections = [s for s in CORE_SECTIONS if s not in present]
+
+    return features
+
+
+# Prefix of the context the graph page sends after a node edit (app/graph/page.tsx)
+EDITED_NODE_PREFIX = "edited node:"
+
+
+def _acknowledgement(context: Optional[str]) -> Optional[str]:
+    """
+    Turn a change context like 'Just added: Drums' into an opening sentence.
+
+    >>> print(_acknowledgement('Edited node: renamed "Kick" to "Drums", changed BPM to 120'))
+    Got it, you've renamed "Kick" to "Drums", changed BPM to 120.
+    >>> print(_acknowledgement('Just added: Bass. User said: "add a bass"'))
+    Nice! You've added Bass.
+    """
+    if not context:
+        return None
+
+    # Matched on the whole context: edited labels may contain periods
+    if context.strip().lower().startswith(EDITED_NODE_PREFIX):
+        changes = context.strip()[len(EDITED_NODE_PREFIX):].strip().rstrip(".")
+        return f"Got it, you've {changes}." if changes else "Got it, you've updated that element."
+
+    for part in context.split("."):
+        part = part.strip()
+        lowered = part.lower()
+        if lowered.startswith("just added:") or lowered.startswith("initial setup:"):
+            items = part.split(":", 1)[1].strip()
+            return f"Nice! You've added {items}."
+        if lowered.startswith("just removed:"):
+            items = part.split(":", 1)[1].strip()
+            return f"Okay, you've removed {items}."
+
+    return "Got it, I hear the change you just made."
+
+
+def _observation(features: CompositionFeatures) -> Optional[str]:
+    """Pick the single most important issue, in priority order"""
+    if features.key_clashes:
+        a, b = features.key_clashes[0]
+        return f"Watch out though - {a} and {b} clash harmonically, so consider moving one of those parts to a related key."
+    if features.bpm_clashes:
+        a, b = features.bpm_clashes[0]
+        return f"The tempos are pulling apart at {a} and {b} BPM - try locking everything to one tempo."
+    if features.busy_sections:
+        section = features.busy_sections[0]
+        return f"The {section} is getting crowded with {features.section_density[section]} elements - try stripping a couple out to give the groove space."
+    gaps = features.band_gaps
+    if gaps:
+        return f"The mix is missing some weight in the {gaps[0]} end - try adding {BAND_SUGGESTIONS[gaps[0]]}."
+    if features.empty_sections:
+        return f"Your {features.empty_sections[0]} doesn't have anything playing in it yet - give it at least one element."
+    if features.missing_sections and len(features.sections) >= 2:
+        return f"The structure is coming together - a {features.missing_sections[0]} would round it out."
+    return None
+
+
+def _encouragement(features: CompositionFeatures) -> str:
+    if features.total_nodes == 0:
+        return "Blank canvas - start with drums or a bassline to lay down a foundation."
+    if features.band_counts["low"] and features.band_counts["mid"]:
+        return "The low end and mid-range are working well together."
+    if features.genres:
+        return f"That {features.genres[0]} vibe is a solid direction."
+    return "This is starting to take shape."
+
+
+def render_feedback(features: CompositionFeatures, context: Optional[str] = None, opened: bool = False) -> str:
+    """
+    Build 2-3 sentences of producer feedback from templates.
+
+    Follows the same acknowledge -> observe -> suggest structure as
+    PRODUCER_SYSTEM_PROMPT, leaving out the acknowledgement when `opened`
+    (an opener clip already played it).
+    """
+    sentences = []
+
+    acknowledgement = None if opened else _acknowledgement(context)
+    if acknowledgement:
+        sentences.append(acknowledgement)
+
+    observation = _observation(features)
+    if observation:
+        if not acknowledgement:
+            sentences.append(_encouragement(features))
+        sentences.append(observation)
+    else:
+        sentences.append(_encouragement(features))
+        if features.total_nodes and "genre" not in features.node_types:
+            sentences.append("Consider adding a genre node to give the track a clear identity.")
+
+    return " ".join(sentences[:3])
@@ -0,0 +1,164 @@
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.profiling import span
+from app.core.store import shared_store
+from app.schemas.graph import GraphNode, GraphEdge
+
+
+# Sessions idle for longer than this are forgotten
+SESSION_IDLE_SECONDS = 900
+
+# Newest request and unanalyzed contexts per session, shared by all workers
+PRODUCER_SESSIONS_NAMESPACE = "producer_sessions"
+
+
+class FeedbackSuperseded(Exception):
+    """Raised to a waiter whose analysis was folded into a newer request"""
+
+
+@dataclass
+class _ProducerSession:
+    task: Optional[asyncio.Task] = None
+    waiter: Optional[asyncio.Future] = None
+    last_seen: float = field(default_factory=time.monotonic)
+
+
+def merge_contexts(contexts: List[str]) -> Optional[str]:
+    """Combine change contexts in arrival order, dropping exact repeats"""
+    merged: List[str] = []
+    for context in contexts:
+        if context and context not in merged:
+            merged.append(context)
+    return ". ".join(c.rstrip(". ") for c in merged) if merged else None
+
+
+class ProducerSessionCoalescer:
+    """
+    Debounces producer feedback per composition session.
+
+    Each new request restarts the session's debounce window and cancels any
+    in-flight pipeline, so a session never has more than one analysis
+    running. Contexts from every request since the last completed analysis
+    are merged into the one that finally runs. Only the newest waiter gets
+    the result; older ones receive FeedbackSuperseded.
+
+    The session's newest request and pending contexts are kept in the
+    shared store, so requests landing on different workers coalesce too:
+    when a debounce window closes, a request that is no longer the newest
+    gives way, and the newest one analyzes every pending context. A
+    pipeline already past its debounce on another worker is not cancelled.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, _ProducerSession] = {}
+
+    def _session(self, session_id: str) -> _ProducerSession:
+        now = time.monotonic()
+        if len(self._sessions) > 1000:
+            stale = [
+                sid for sid, s in self._sessions.items()
+                if now - s.last_seen > SESSION_IDLE_SECONDS and (s.task is None or s.task.done())
+            ]
+            for sid in stale:
+                del self._sessions[sid]
+
+        session = self._sessions.setdefault(session_id, _ProducerSession())
+        session.last_seen = now
+        return session
+
+    async def submit(
+        self,
+        session_id: str,
+        nodes: List[GraphNode],
+        edges: List[GraphEdge],
+        context: Optional[str],
+        run: Callable[[List[GraphNode], List[GraphEdge], Optional[str]], Awaitable[Any]]
+    ) -> Any:
+        """
+        Queue an analysis of the latest graph for this session.
+
+        Args:
+            session_id: Composition session identifier
+            nodes: Latest graph nodes
+            edges: Latest graph edges
+            context: What changed in this edit, if known
+            run: Pipeline to execute once the debounce window closes
+
+        Returns:
+            Whatever `run` returns
+
+        Raises:
+            FeedbackSuperseded: if a newer request for the session took over
+        """
+        session = self._session(session_id)
+
+        if session.waiter is not None and not session.waiter.done():
+            session.waiter.set_exception(FeedbackSuperseded())
+            metrics.incr("producer_requests_superseded")
+        if session.task is not None and not session.task.done():
+            session.task.cancel()
+            metrics.incr("producer_pipelines_cancelled")
+
+        waiter = asyncio.get_running_loop().create_future()
+        session.waiter = waiter
+        task = asyncio.create_task(self._run(session_id, context, nodes, edges, waiter, run))
+        session.task = task
+        # If the caller goes away, nobody needs this pipeline any more
+        waiter.add_done_callback(lambda f: f.cancelled() and task.cancel())
+        return await waiter
+
+    async def _run(self, session_id: str, context: Optional[str], nodes, edges, waiter: asyncio.Future, run) -> None:
+        request_id = uuid.uuid4().hex
+
+        def register(state):
+            state = state or {"latest": None, "contexts": []}
+            state["latest"] = request_id
+            if context:
+                state["contexts"].append(context)
+            return state, None
+
+        try:
+            await shared_store.update_json_async(
+                PRODUCER_SESSIONS_NAMESPACE, session_id, register, ttl=SESSION_IDLE_SECONDS
+            )
+            with span("producer.debounce"):
+                await asyncio.sleep(settings.PRODUCER_DEBOUNCE_S)
+
+            state = await shared_store.get_json_async(PRODUCER_SESSIONS_NAMESPACE, session_id)
+            if state is None or state["latest"] != request_id:
+                # A newer request arrived on another worker
+                metrics.incr("producer_requests_superseded")
+                raise FeedbackSuperseded()
+            merged = merge_contexts(state["contexts"])
+            consumed = len(state["contexts"])
+            metrics.observe("producer_contexts_merged", consumed)
+
+            result = await run(nodes, edges, merged)
+
+            # Contexts that arrived after we started belong to the next analysis
+            def consume(state):
+                state = state or {"latest": None, "contexts": []}
+                del state["contexts"][:consumed]
+                return state, None
+
+            await shared_store.update_json_async(
+                PRODUCER_SESSIONS_NAMESPACE, session_id, consume, ttl=SESSION_IDLE_SECONDS
+            )
+            if not waiter.done():
+                waiter.set_result(result)
+        except asyncio.CancelledError:
+            if not waiter.done():
+                waiter.set_exception(FeedbackSuperseded())
+            raise
+        except Exception as e:
+            if not waiter.done():
+                waiter.set_exception(e)
+
+
+# Singleton instance
+producer_sessions = ProducerSessionCoalescer()
@@ -1,8 +1,30 @@
-import json
-from typing import List, Dict, Any
-import google.generativeai as genai
+import asyncio
+import dataclasses
+import logging
+import os
+from typing import List, Dict, Any, Optional, Tuple, Union
+from app.core import fastjson
+from app.core.admission import UpstreamBusy, admission_controller
+from app.core.batching import MicroBatcher
 from app.core.config import settings
+from app.core.key_pool import gemini_keys
+from app.core.metrics import metrics
+from app.core.profiling import span
+from app.core.store import shared_store, cache_key
+from app.schemas.graph import GraphNode, GraphEdge
+from app.services.model_router import Complexity, ModelRoute, model_router
+from app.services.recommendation_table import RecommendationTable, parse_catalog
 
+logger = logging.getLogger(__name__)
+
+
+RECOMMENDATIONS_NAMESPACE = "recommendations"
+
+# Model and token budget are chosen per request by model_router
+RECOMMENDATIONS_GENERATION_CONFIG = {
+    'temperature': 0.7,  # Creative but consistent
+    'top_p': 0.9,
+}
 
 # Import the full instrument database (we'll pass available instruments to the LLM)
 AVAILABLE_INSTRUMENTS = """
@@ -34,24 +56,23 @@ Hip-Hop/Urban: Hip-Hop, Trap, R&B, Drill, Turntablism
 World: World Music, Fusion, Ambient, Cinematic
 """
 
-RECOMMENDATION_PROMPT = """You are an expert music producer and ethnomusicologist who specializes in global music traditions and cross-cultural fusion.
+# The prompt is assembled from these parts so the batched prompt can send the
+# static catalog and guidelines once for several compositions
+_ROLE = "You are an expert music producer and ethnomusicologist who specializes in global music traditions and cross-cultural fusion."
 
-Your task is to analyze a musical composition graph and recommend 6-8 culturally-appropriate instruments that would enhance the composition.
-
-AVAILABLE INSTRUMENTS BY CULTURE:
-{instruments}
+_CATALOG = f"""AVAILABLE INSTRUMENTS BY CULTURE:
+{AVAILABLE_INSTRUMENTS}
 
 AVAILABLE GENRES:
-{genres}
+{AVAILABLE_GENRES}"""
 
-CURRENT COMPOSITION:
-Nodes: {nodes_json}
+_COMPOSITION_TEMPLATE = """Nodes: {nodes_json}
 Edges: {edges_json}
 
 Existing instruments: {existing_instruments}
-Existing genres: {existing_genres}
+Existing genres: {existing_genres}"""
 
-RECOMMENDATION GUIDELINES:
+_GUIDELINES = """RECOMMENDATION GUIDELINES:
 1. **Cross-Cultural Blending**: Suggest creative combinations (Hip-Hop + Afrobeat djembe, J-pop + Guzheng)
 2. **Avoid Duplicates**: NEVER recommend instruments already in the graph
 3. **Fill Musical Gaps**: If missing bass, recommend bass instruments. If missing melody, recommend melodic instruments
@@ -64,128 +85,297 @@ RECOMMENDATION REASONING:
 - If graph has "J-pop" → Suggest bright synths, vocoders, electronic elements
 - If graph has "Latin" → Recommend bongos, congas, brass, classical guitar
 - If graph has basic drums/bass → Suggest melodic or harmonic elements to fill the mid/high range
-- If graph is ambient/minimal → Suggest atmospheric instruments (guzheng, bansuri, synth pads)
+- If graph is ambient/minimal → Suggest atmospheric instruments (guzheng, bansuri, synth pads)"""
 
-OUTPUT FORMAT (JSON only, no other text):
-{{
-  "recommendations": [
-    {{
+_EXAMPLE_RECOMMENDATIONS = """    {
       "instrument_id": "djembe",
       "instrument_name": "Djembe",
       "culture": "African",
       "genre": "Afrobeat, Hip-Hop, World Music",
       "type": "drum",
       "reason": "Adds authentic West African polyrhythmic depth to hip-hop grooves. The 'talking' quality of djembe creates conversational rhythms that blend perfectly with modern beats."
-    }},
-    {{
+    },
+    {
       "instrument_id": "guzheng",
       "instrument_name": "Guzheng",
       "culture": "Chinese",
       "genre": "Traditional, Ambient, C-Pop",
       "type": "melody",
       "reason": "Chinese pentatonic melodies create a unique East-meets-West fusion. The flowing, ethereal quality adds unexpected beauty and cultural depth."
+    }"""
+
+_RULES = """- Recommend 6-8 instruments maximum
+- Each reason should be 1-2 sentences explaining the musical and cultural value
+- Be specific and educational in your reasoning
+- Prioritize instruments that create interesting cross-cultural blends"""
+
+RECOMMENDATION_PROMPT_HEAD = f"""{_ROLE}
+
+Your task is to analyze a musical composition graph and recommend 6-8 culturally-appropriate instruments that would enhance the composition.
+
+{_CATALOG}
+
+CURRENT COMPOSITION:
+"""
+
+RECOMMENDATION_PROMPT_TAIL = f"""
+
+{_GUIDELINES}
+
+OUTPUT FORMAT (JSON only, no other text):
+{{
+  "recommendations": [
+{_EXAMPLE_RECOMMENDATIONS}
+  ]
+}}
+
+IMPORTANT:
+- Return ONLY valid JSON, no markdown formatting
+{_RULES}
+"""
+
+# Everything before the compositions is identical across batches
+BATCH_PROMPT_HEAD = f"""{_ROLE}
+
+Your task is to analyze several independent musical composition graphs and recommend 6-8 culturally-appropriate instruments for EACH of them. Judge every composition on its own; never let one composition influence another's recommendations.
+
+{_CATALOG}
+
+{_GUIDELINES}
+
+"""
+
+BATCH_PROMPT_TAIL = f"""
+
+OUTPUT FORMAT (JSON only, no other text), one entry per composition, numbered as above:
+{{
+  "results": [
+    {{
+      "composition": 1,
+      "recommendations": [
+{_EXAMPLE_RECOMMENDATIONS}
+      ]
     }}
   ]
 }}
 
 IMPORTANT:
 - Return ONLY valid JSON, no markdown formatting
-- Recommend 6-8 instruments maximum
-- Each reason should be 1-2 sentences explaining the musical and cultural value
-- Be specific and educational in your reasoning
-- Prioritize instruments that create interesting cross-cultural blends
+- Include every composition exactly once in "results"
+{_RULES}
 """
 
 
+Graph = Tuple[List[GraphNode], List[GraphEdge]]
+
+
+def catalog_labels() -> List[str]:
+    """Every instrument and genre name the recommendation prompt knows about"""
+    return [name for _, name in parse_catalog(AVAILABLE_INSTRUMENTS) + parse_catalog(AVAILABLE_GENRES)]
+
+
 class RecommendationService:
     def __init__(self):
-        self.gemini_configured = False
-        if settings.GOOGLE_API_KEY:
-            genai.configure(api_key=settings.GOOGLE_API_KEY)
-            self.gemini_configured = True
+        self.gemini_configured = bool(gemini_keys)
 
-    def generate_recommendations(
-        self,
-        nodes: List[Dict[str, Any]],
-        edges: List[Dict[str, Any]]
-    ) -> List[Dict[str, Any]]:
-        """
-        Use Gemini LLM to generate intelligent instrument recommendations.
+        self.table: Optional[RecommendationTable] = None
+        if os.path.exists(settings.RECOMMENDATION_TABLE_PATH):
+            self.table = RecommendationTable(settings.RECOMMENDATION_TABLE_PATH, catalog_labels())
+            logger.info("Loaded %d precomputed combinations", self.table.count)
 
-        Args:
-            nodes: List of node dictionaries from the graph
-            edges: List of edge dictionaries from the graph
+        # Concurrent cache misses share one LLM call (and one copy of the catalog prompt).
+        # Batching starts no later than when this worker's Gemini slots are all taken:
+        # past that, unbatched calls would only wait in the admission queue
+        concurrency = min(
+            settings.RECOMMENDATION_BATCH_CONCURRENCY,
+            admission_controller.upstreams["gemini"].max_concurrent,
+        )
+        self._batcher: MicroBatcher[Graph, List[Dict[str, Any]]] = MicroBatcher(
+            "recommendations",
+            self._generate_batch,
+            settings.RECOMMENDATION_BATCH_WINDOW_S,
+            settings.RECOMMENDATION_BATCH_MAX,
+            concurrency,
+        )
 
-        Returns:
-            List of recommendation dictionaries with reasons
-        """
-        if not self.gemini_configured:
-            raise ValueError("GOOGLE_API_KEY not configured")
+    def _precomputed(self, nodes: List[GraphNode]) -> Optional[List[Dict[str, Any]]]:
+        """Answer from the offline table when the graph is a known catalog combination"""
+        if self.table is None:
+            return None
+        recommendations = self.table.lookup(nodes)
+        metrics.incr("recommendation_table_lookups", hit=recommendations is not None)
+        return recommendations
 
+    def _describe(self, nodes: List[GraphNode], edges: List[GraphEdge]) -> str:
+        """One composition as the prompts present it"""
         # Extract existing instruments and genres
         existing_instruments = []
         existing_genres = []
 
         for node in nodes:
-            node_label = node.get("data", {}).get("label", "")
-            node_type = node.get("data", {}).get("type", "")
-
-            if node_type == "genre":
-                existing_genres.append(node_label)
+            if node.data.type == "genre":
+                existing_genres.append(node.data.label)
             else:
-                existing_instruments.append(node_label)
-
-        # Build the prompt
-        prompt = RECOMMENDATION_PROMPT.format(
-            instruments=AVAILABLE_INSTRUMENTS,
-            genres=AVAILABLE_GENRES,
-            nodes_json=json.dumps(nodes, indent=2),
-            edges_json=json.dumps(edges, indent=2),
+                existing_instruments.append(node.data.label)
+
+        return _COMPOSITION_TEMPLATE.format(
+            nodes_json=fastjson.dumps(nodes),
+            edges_json=fastjson.dumps(edges),
             existing_instruments=", ".join(existing_instruments) if existing_instruments else "None",
             existing_genres=", ".join(existing_genres) if existing_genres else "None (general composition)"
         )
 
-        # Use Gemini to generate recommendations
-        model = genai.GenerativeModel(
-            model_name='gemini-2.0-flash-exp',
-            generation_config={
-                'temperature': 0.7,  # Creative but consistent
-                'top_p': 0.9,
-                'max_output_tokens': 2048,
-            }
+    def _build_prompt(self, nodes: List[GraphNode], edges: List[GraphEdge]) -> str:
+        return RECOMMENDATION_PROMPT_HEAD + self._describe(nodes, edges) + RECOMMENDATION_PROMPT_TAIL
+
+    def _build_batch_prompt(self, graphs: List[Graph]) -> str:
+        compositions = "\n\n".join(
+            f"COMPOSITION {number}:\n{self._describe(nodes, edges)}"
+            for number, (nodes, edges) in enumerate(graphs, start=1)
         )
+        return BATCH_PROMPT_HEAD + compositions + BATCH_PROMPT_TAIL
+
+    def _route(self, nodes: List[GraphNode]) -> ModelRoute:
+        return model_router.route("recommendations", Complexity(instruction_chars=0, entities=0, graph_nodes=len(nodes)))
 
+    def _load_json(self, response_text: str) -> Any:
+        response_text = response_text.strip()
+
+        # Remove markdown code blocks if present
+        if response_text.startswith("```json"):
+            response_text = response_text[7:]
+        if response_text.startswith("```"):
+            response_text = response_text[3:]
+        if response_text.endswith("```"):
+            response_text = response_text[:-3]
+        response_text = response_text.strip()
+
+        # Parse JSON response
         try:
-            response = model.generate_content(prompt)
-            response_text = response.text.strip()
-
-            # Remove markdown code blocks if present
-            if response_text.startswith("```json"):
-                response_text = response_text[7:]
-            if response_text.startswith("```"):
-                response_text = response_text[3:]
-            if response_text.endswith("```"):
-                response_text = response_text[:-3]
-            response_text = response_text.strip()
-
-            # Parse JSON response
-            result = json.loads(response_text)
-            recommendations = result.get("recommendations", [])
-
-            print(f"[Recommendations] Generated {len(recommendations)} recommendations")
-            for rec in recommendations:
-                print(f"  - {rec['instrument_name']}: {rec['reason'][:80]}...")
-
-            return recommendations
-
-        except json.JSONDecodeError as e:
-            print(f"[Recommendations] JSON parse error: {e}")
-            print(f"[Recommendations] Response text: {response_text[:500]}")
+            return fastjson.loads(response_text)
+        except fastjson.JSONDecodeError as e:
+            logger.warning("Recommendation JSON parse error: %s", e, extra={"response_text": response_text[:500]})
             raise ValueError(f"Failed to parse LLM response as JSON: {e}")
+
+    def _parse_response(self, response_text: str) -> List[Dict[str, Any]]:
+        recommendations = self._load_json(response_text).get("recommendations", [])
+
+        logger.debug(
+            "Generated %d recommendations",
+            len(recommendations),
+            extra={"instruments": [rec.get("instrument_name") for rec in recommendations]},
+        )
+
+        return recommendations
+
+    def _split_batch_response(self, response_text: str, size: int) -> Dict[int, List[Dict[str, Any]]]:
+        """Recommendations per composition number (1-based); compositions the model skipped are absent"""
+        results = self._load_json(response_text).get("results")
+        if not isinstance(results, list):
+            raise ValueError("Batched response missing 'results' list")
+
+        split: Dict[int, List[Dict[str, Any]]] = {}
+        for result in results:
+            number = result.get("composition") if isinstance(result, dict) else None
+            if isinstance(number, int) and 1 <= number <= size and isinstance(result.get("recommendations"), list):
+                split.setdefault(number, result["recommendations"])
+        return split
+
+    async def _call_async(self, route: ModelRoute, prompt: str, compositions: int) -> str:
+        """One Gemini call; prompt size and token usage are recorded so batching savings are visible"""
+        metrics.incr("recommendation_llm_calls", compositions=compositions)
+        metrics.observe("recommendation_prompt_chars", len(prompt), batched=compositions > 1)
+        try:
+            async with admission_controller.upstream_slot("gemini"):
+                with gemini_keys.lease() as api_key, model_router.timed(route), span("gemini.recommendations"):
+                    response = await model_router.model(route, RECOMMENDATIONS_GENERATION_CONFIG, api_key).generate_content_async(prompt)
+        except UpstreamBusy:
+            raise
         except Exception as e:
-            print(f"[Recommendations] Error: {e}")
+            logger.error("Recommendation generation failed: %s", e)
             raise ValueError(f"Error generating recommendations: {e}")
 
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            metrics.incr("llm_tokens", usage.prompt_token_count, service="recommendations", kind="prompt")
+            metrics.incr("llm_tokens", usage.candidates_token_count, service="recommendations", kind="output")
+        return response.text
+
+    async def _generate_one(self, nodes: List[GraphNode], edges: List[GraphEdge]) -> List[Dict[str, Any]]:
+        response_text = await self._call_async(self._route(nodes), self._build_prompt(nodes, edges), 1)
+        return self._parse_response(response_text)
+
+    async def _generate_batch(self, graphs: List[Graph]) -> List[Union[List[Dict[str, Any]], Exception]]:
+        """
+        Recommendations for several graphs from one LLM call.
+
+        The batch is routed like its largest graph, with that route's output
+        budget per composition (up to RECOMMENDATION_BATCH_MAX_OUTPUT_TOKENS).
+        Compositions missing from the answer, or every composition when the
+        answer cannot be split, are retried with their own call.
+        """
+        if len(graphs) == 1:
+            return [await self._generate_one(*graphs[0])]
+
+        route = self._route(max((nodes for nodes, _ in graphs), key=len))
+        route = dataclasses.replace(route, max_output_tokens=min(
+            route.max_output_tokens * len(graphs),
+            settings.RECOMMENDATION_BATCH_MAX_OUTPUT_TOKENS,
+        ))
+        response_text = await self._call_async(route, self._build_batch_prompt(graphs), len(graphs))
+
+        try:
+            split = self._split_batch_response(response_text, len(graphs))
+        except ValueError as e:
+            logger.warning("Could not split batched recommendations: %s", e)
+            split = {}
+        missing = [number for number in range(1, len(graphs) + 1) if number not in split]
+        metrics.incr("recommendation_batches", outcome="complete" if not missing else "partial" if split else "failed")
+
+        if missing:
+            retried = await asyncio.gather(
+                *(self._generate_one(*graphs[number - 1]) for number in missing),
+                return_exceptions=True,
+            )
+            split.update(zip(missing, retried))
+        return [split[number] for number in range(1, len(graphs) + 1)]
+
+    async def generate_recommendations_async(
+        self,
+        nodes: List[GraphNode],
+        edges: List[GraphEdge]
+    ) -> List[Dict[str, Any]]:
+        """
+        Use Gemini to generate instrument recommendations with reasons.
+
+        Graphs made only of catalog genres/instruments are answered from the
+        precomputed table when one is loaded; only long-tail graphs hit the LLM.
+        Uses Gemini's async client so the call is abandoned if the caller is
+        cancelled. Results are cached in the shared store for all workers.
+        Cache misses go through a micro-batcher: once
+        RECOMMENDATION_BATCH_CONCURRENCY calls are running (fewer if this
+        worker has fewer Gemini slots), requests arriving within
+        RECOMMENDATION_BATCH_WINDOW_S of each other share one
+        multi-composition LLM call.
+        """
+        precomputed = self._precomputed(nodes)
+        if precomputed is not None:
+            return precomputed
+
+        if not self.gemini_configured:
+            raise ValueError("GOOGLE_API_KEY not configured")
+
+        key = cache_key(nodes, edges)
+        cached = await shared_store.get_json_async(RECOMMENDATIONS_NAMESPACE, key)
+        if cached is not None:
+            metrics.incr("llm_cache_hits", service="recommendations")
+            return cached
+        metrics.incr("llm_cache_misses", service="recommendations")
+
+        recommendations = await self._batcher.submit(key, (nodes, edges))
+        await shared_store.set_json_async(RECOMMENDATIONS_NAMESPACE, key, recommendations, ttl=settings.LLM_CACHE_TTL_S)
+        return recommendations
+
 
 # Singleton instance
 recommendation_service = RecommendationService()
@@ -0,0 +1,133 @@
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from app.core import fastjson
+from app.schemas.graph import GraphNode
+
+
+# File layout: header, then `count` fixed-size index records sorted by hash,
+# then the concatenated JSON payloads the records point into.
+MAGIC = b"RECTBL01"
+HEADER = struct.Struct("<8sI4x")
+RECORD = struct.Struct("<QII")  # key hash, payload offset, payload length
+
+
+def parse_catalog(catalog: str) -> List[Tuple[str, str]]:
+    """
+    Parse a 'Culture: A, B, C' catalog block (AVAILABLE_INSTRUMENTS / AVAILABLE_GENRES).
+
+    Returns:
+        List of (culture, name) pairs in catalog order
+    """
+    entries = []
+    for line in catalog.strip().splitlines():
+        culture, _, names = line.partition(":")
+        for name in names.split(","):
+            if name.strip():
+                entries.append((culture.strip(), name.strip()))
+    return entries
+
+
+def _normalize(label: str) -> str:
+    return " ".join(label.lower().split())
+
+
+def combination_key(labels: Iterable[str]) -> str:
+    """Order-insensitive key for a set of catalog labels"""
+    return "|".join(sorted({_normalize(label) for label in labels}))
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def write_table(path: str, entries: Dict[str, List[Dict[str, Any]]]) -> None:
+    """
+    Write precomputed recommendations to a compact, mmap-friendly table.
+
+    Args:
+        path: Output file path
+        entries: combination_key -> list of recommendation dicts
+    """
+    records = []
+    payloads = []
+    offset = HEADER.size + RECORD.size * len(entries)
+    for key in sorted(entries, key=_hash):
+        # The key travels with the payload so hash collisions are detected on lookup
+        payload = fastjson.dumps_bytes({"key": key, "recommendations": entries[key]})
+        records.append(RECORD.pack(_hash(key), offset, len(payload)))
+        payloads.append(payload)
+        offset += len(payload)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(records)))
+        f.writelines(records)
+        f.writelines(payloads)
+    os.replace(tmp_path, path)
+
+
+class RecommendationTable:
+    """
+    Read-only view over a precomputed recommendation table.
+
+    The file is memory-mapped, so opening it is instant, all workers share
+    the page cache, and a lookup is a binary search over the index.
+    """
+
+    def __init__(self, path: str, known_labels: Iterable[str]):
+        self.path = path
+        self.known_labels = {_normalize(label) for label in known_labels}
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a recommendation table")
+        self._hashes = _HashIndex(self._mm, self.count)
+
+    def composition_key(self, nodes: List[GraphNode]) -> Optional[str]:
+        """
+        Key for compositions made only of catalog genres/instruments.
+
+        Returns:
+            None for long-tail graphs (custom labels, sections) the table cannot answer
+        """
+        labels = []
+        for node in nodes:
+            label = _normalize(node.data.label)
+            if label not in self.known_labels:
+                return None
+            labels.append(label)
+        return combination_key(labels)
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        target = _hash(key)
+        i = bisect.bisect_left(self._hashes, target)
+        while i < self.count and self._hashes[i] == target:
+            _, offset, length = RECORD.unpack_from(self._mm, HEADER.size + i * RECORD.size)
+            entry = fastjson.loads(self._mm[offset:offset + length])
+            if entry["key"] == key:
+                return entry["recommendations"]
+            i += 1
+        return None
+
+    def lookup(self, nodes: List[GraphNode]) -> Optional[List[Dict[str, Any]]]:
+        key = self.composition_key(nodes)
+        return self.get(key) if key is not None else None
+
+
+class _HashIndex:
+    """Sequence view of the sorted hash column, so bisect can search the mmap directly"""
+
+    def __init__(self, mm: mmap.mmap, count: int):
+        self._mm = mm
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i: int) -> int:
+        return RECORD.unpack_from(self._mm, HEADER.size + i * RECORD.size)[0]
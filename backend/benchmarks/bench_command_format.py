@@ -0,0 +1,155 @@
+"""
+Graph command output: verbose JSON vs the compact line format.
+
+Offline, compares output size for representative command lists (tokens
+estimated with a BPE-like split, since Gemini's tokenizer is remote),
+parse + validation (repair) time, and the decode time those tokens imply.
+
+With --live (and GOOGLE_API_KEY set), also sends real instructions through
+both prompts and reports Gemini's own output-token counts and end-to-end
+latency.
+
+Run from backend/:
+    python -m benchmarks.bench_command_format
+    python -m benchmarks.bench_command_format --live --repeat 3
+"""
+import argparse
+import json
+import re
+import statistics
+import time
+import timeit
+from typing import Any, Dict, List
+from app.core.config import settings
+from app.schemas.graph import CurrentGraph, GraphNode
+from app.services.command_grammar import format_commands
+from app.services.graph_context import select_context
+from app.services.graph_llm_service import GRAPH_GENERATION_CONFIG, _build_graph_prompt
+from app.services.graph_repair import repair_output
+
+# Rough Gemini Flash decode rate, for turning token counts into time
+DECODE_TOKENS_PER_S = 200.0
+
+_BPE_LIKE = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+INSTRUMENTS = ["drum", "bassline", "melody", "chord", "synth", "vocal", "fx"]
+SECTIONS = ["intro", "verse", "chorus", "bridge", "outro"]
+
+# Nodes the cases refer to without creating
+EXISTING_IDS = {"bass-1", "verse"}
+
+LIVE_INSTRUCTIONS = [
+    "add drums",
+    "rename the bass to Sub Bass",
+    "intro with pads, verse with drums and bass, then a chorus with a lead synth",
+    "build a full song: intro, verse, pre-chorus, chorus, bridge, final chorus and outro, "
+    "each with two fitting instruments",
+]
+
+
+def estimate_tokens(text: str) -> int:
+    return len(_BPE_LIKE.findall(text))
+
+
+def arrangement(sections: int, per_section: int) -> List[Dict[str, Any]]:
+    """Sections chained by "next", each owning `per_section` instruments"""
+    commands = []
+    previous = None
+    for s in range(sections):
+        section_id = f"{SECTIONS[s % len(SECTIONS)]}-{s}"
+        commands.append({"action": "createNode", "params": {"id": section_id, "label": section_id.title(), "type": "section"}})
+        if previous:
+            commands.append({"action": "connectNodes", "params": {"source": previous, "target": section_id, "relation": "next"}})
+        previous = section_id
+        for i in range(per_section):
+            kind = INSTRUMENTS[(s + i) % len(INSTRUMENTS)]
+            node_id = f"{kind}-{s}-{i}"
+            commands.append({"action": "createNode", "params": {
+                "id": node_id, "label": f"{kind.title()} {s}", "type": kind, "key": "Am", "bpm": 120,
+            }})
+            commands.append({"action": "connectNodes", "params": {"source": section_id, "target": node_id, "relation": "has"}})
+    return commands
+
+
+CASES = {
+    "add one node": [{"action": "createNode", "params": {"id": "drums-1", "label": "Drums", "type": "drum"}}],
+    "rename node": [{"action": "updateNode", "params": {"id": "bass-1", "label": "Sub Bass"}}],
+    "3 sections x 2": arrangement(3, 2),
+    "8 sections x 3": arrangement(8, 3),
+}
+
+
+def outputs(commands: List[Dict[str, Any]]) -> Dict[str, str]:
+    """What the model emits for these commands in each format"""
+    return {
+        # Gemini follows the indented example in the JSON prompt
+        "json": json.dumps({"commands": commands}, indent=2, ensure_ascii=False),
+        "compact": format_commands(commands),
+    }
+
+
+def offline() -> None:
+    print(f"{'case':<16} {'format':<8} {'chars':>7} {'~tokens':>8} {'decode ms':>10} {'parse us':>9}")
+    for name, commands in CASES.items():
+        texts = outputs(commands)
+        for command_format, text in texts.items():
+            parsed, _ = repair_output(text, command_format, EXISTING_IDS)
+            assert parsed.model_dump()["commands"] == commands, (name, command_format)
+
+            runs = 2000
+            parse_s = timeit.timeit(lambda: repair_output(text, command_format, EXISTING_IDS), number=runs) / runs
+            tokens = estimate_tokens(text)
+            print(
+                f"{name:<16} {command_format:<8} {len(text):>7} {tokens:>8} "
+                f"{tokens / DECODE_TOKENS_PER_S * 1000:>10.0f} {parse_s * 1e6:>9.1f}"
+            )
+        ratio = estimate_tokens(texts["compact"]) / estimate_tokens(texts["json"])
+        print(f"{'':<16} compact/json tokens: {ratio:.0%}")
+
+
+def live(repeat: int) -> None:
+    import google.generativeai as genai
+
+    genai.configure(api_key=settings.GOOGLE_API_KEY)
+    model = genai.GenerativeModel(
+        model_name=settings.LLM_ROUTES["graph"]["standard"]["model"],
+        generation_config={**GRAPH_GENERATION_CONFIG, "max_output_tokens": 4096},
+    )
+    graph = CurrentGraph(nodes=[
+        GraphNode(id="bass-1", data={"label": "Bass", "type": "bassline"}),
+        GraphNode(id="verse", data={"label": "Verse", "type": "section"}),
+    ], edges=[])
+
+    print(f"\n{'instruction':<40} {'format':<8} {'out tokens':>10} {'latency s':>10} {'commands':>9}")
+    for instruction in LIVE_INSTRUCTIONS:
+        context = select_context(graph, instruction)
+        for command_format in ("json", "compact"):
+            prompt = _build_graph_prompt(context, instruction, command_format)
+            tokens, latencies, counts = [], [], []
+            for _ in range(repeat):
+                started = time.monotonic()
+                response = model.generate_content(prompt)
+                latencies.append(time.monotonic() - started)
+                tokens.append(response.usage_metadata.candidates_token_count)
+                counts.append(len(repair_output(response.text, command_format, EXISTING_IDS)[0].commands))
+            print(
+                f"{instruction[:40]:<40} {command_format:<8} {statistics.median(tokens):>10.0f} "
+                f"{statistics.median(latencies):>10.2f} {statistics.median(counts):>9.0f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--live", action="store_true", help="Also call Gemini (needs GOOGLE_API_KEY)")
+    parser.add_argument("--repeat", type=int, default=3, help="Live calls per instruction and format")
+    args = parser.parse_args()
+
+    offline()
+    if args.live:
+        if not settings.GOOGLE_API_KEY:
+            raise SystemExit("GOOGLE_API_KEY not configured")
+        live(args.repeat)
+
+
+if __name__ == "__main__":
+    main()
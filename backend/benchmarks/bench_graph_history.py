@@ -0,0 +1,200 @@
+"""
+Graph version history: per-edit deltas in the shared store vs a full snapshot per edit.
+
+Replays a long jam session (a few nodes created, renamed, connected or
+deleted per edit) on graphs of increasing size against a scratch store, and
+reports bytes stored per edit next to the size of one graph snapshot (what
+persisting server-side undo would write without deltas), memory held by the
+worker's version cache, commit time per edit (store round trips included),
+the time another worker takes to materialize the head from the store, and
+diff time between versions near and far apart.
+
+Before timing, diffs between versions are replayed the way the frontend
+dispatcher applies them and must reproduce the target version; a relation
+change sent as delete + connect of the same pair fails this check.
+
+Run from backend/:
+    python -m benchmarks.bench_graph_history
+"""
+import asyncio
+import os
+import random
+import tempfile
+import time
+import timeit
+import tracemalloc
+from typing import Dict, List, Tuple
+from app.core import fastjson
+from app.core.store import SharedStore
+from app.schemas.graph import CurrentGraph, GraphCommand, GraphCommandsResponse
+from app.services.graph_commands import Pair, optimize_commands
+from app.services.graph_history import GRAPH_HISTORY_NAMESPACE, GraphHistoryStore, GraphVersion, diff_versions
+
+EDITS = 2000
+SESSION = "bench"
+
+
+def seed_graph(n: int) -> CurrentGraph:
+    commands = [
+        GraphCommand(action="createNode", params={"id": f"node-{i}", "label": f"Node {i}", "type": "synth"})
+        for i in range(n)
+    ]
+    commands += [
+        GraphCommand(action="connectNodes", params={"source": f"node-{i}", "target": f"node-{i + 1}", "relation": "next"})
+        for i in range(0, n - 1, 2)
+    ]
+    return optimize_commands(CurrentGraph(nodes=[], edges=[]), GraphCommandsResponse(commands=commands))[1]
+
+
+def edit_script(n: int, edits: int) -> List[GraphCommandsResponse]:
+    """One to three commands per edit: creates, renames, connects, relation changes and deletes"""
+    rng = random.Random(7)
+    live = [f"node-{i}" for i in range(n)]
+    connected = [(f"node-{i}", f"node-{i + 1}") for i in range(0, n - 1, 2)]
+    script = []
+    for e in range(edits):
+        commands = []
+        for _ in range(rng.randint(1, 3)):
+            roll = rng.random()
+            if roll < 0.3:
+                live.append(f"new-{e}-{len(commands)}")
+                commands.append(GraphCommand(action="createNode", params={"id": live[-1], "label": "New", "type": "drum"}))
+            elif roll < 0.55:
+                commands.append(GraphCommand(action="updateNode", params={"id": rng.choice(live), "label": f"Edit {e}"}))
+            elif roll < 0.75:
+                source, target = rng.sample(live, 2)
+                connected.append((source, target))
+                commands.append(GraphCommand(action="connectNodes", params={"source": source, "target": target, "relation": "has"}))
+            elif roll < 0.85:
+                # How the model changes a relation: delete the edge, connect the pair again
+                source, target = rng.choice(connected)
+                commands.append(GraphCommand(action="deleteById", params={"id": f"edge-{source}-{target}"}))
+                commands.append(GraphCommand(
+                    action="connectNodes",
+                    params={"source": source, "target": target, "relation": rng.choice(("next", "supports", "blends-with"))},
+                ))
+            elif len(live) > 2:
+                commands.append(GraphCommand(action="deleteById", params={"id": live.pop(rng.randrange(len(live)))}))
+        script.append(GraphCommandsResponse(commands=commands))
+    return script
+
+
+def replay_on_client(graph: CurrentGraph, commands: List[GraphCommand]) -> Tuple[Dict[str, str], Dict[Pair, str]]:
+    """
+    Apply commands the way frontend/src/lib/commandDispatcher.ts does.
+
+    Deletes go first (a node takes its edges with it), then creates, node
+    and edge updates, and connects; connectNodes skips a pair the client
+    still has. Returns node labels by id and relations by (source, target).
+    """
+    labels = {node.id: node.data.label for node in graph.nodes}
+    edges = {(edge.source, edge.target): (edge.id, edge.relation) for edge in graph.edges}
+
+    for command in commands:
+        if command.action != "deleteById":
+            continue
+        target_id = command.params["id"]
+        if target_id in labels:
+            del labels[target_id]
+            edges = {pair: edge for pair, edge in edges.items() if target_id not in pair}
+        else:
+            edges = {pair: edge for pair, edge in edges.items() if edge[0] != target_id}
+
+    for command in commands:
+        params = command.params
+        if command.action == "createNode" and params["id"] not in labels:
+            labels[params["id"]] = params["label"]
+        elif command.action == "updateNode" and params["id"] in labels and "label" in params:
+            labels[params["id"]] = params["label"]
+        elif command.action == "updateEdge":
+            for pair, (edge_id, _) in edges.items():
+                if edge_id == params["id"]:
+                    edges[pair] = (edge_id, params["relation"])
+        elif command.action == "connectNodes":
+            pair = (params["source"], params["target"])
+            if pair[0] in labels and pair[1] in labels and pair not in edges:
+                edges[pair] = (f"edge-{pair[0]}-{pair[1]}", params["relation"])
+
+    return labels, {pair: relation for pair, (_, relation) in edges.items()}
+
+
+def check_client_replay(source: GraphVersion, target: GraphVersion) -> None:
+    commands = diff_versions(source, target)
+    deleted_edges = {command.params["id"] for command in commands if command.action == "deleteById"}
+    for command in commands:
+        if command.action == "connectNodes":
+            old = source.edges.get((command.params["source"], command.params["target"]))
+            assert old is None or old.id not in deleted_edges, "relation change sent as delete + connect, not updateEdge"
+
+    labels, relations = replay_on_client(source.graph(), commands)
+    expected = target.graph()
+    assert labels == {node.id: node.data.label for node in expected.nodes}, "node mismatch after replaying diff"
+    assert relations == {(edge.source, edge.target): edge.relation for edge in expected.edges}, \
+        "edge mismatch after replaying diff"
+
+
+def stored_bytes(store: SharedStore) -> int:
+    row = store._conn().execute(
+        "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM kv WHERE namespace = ?", (GRAPH_HISTORY_NAMESPACE,)
+    ).fetchone()
+    return row[0]
+
+
+async def run(n: int, directory: str) -> None:
+    graph = seed_graph(n)
+    script = edit_script(n, EDITS)
+    store = SharedStore(os.path.join(directory, f"history-{n}.db"))
+
+    # Once untraced for timing, once under tracemalloc for the worker cache
+    for traced in (False, True):
+        history = GraphHistoryStore(store)
+        session = f"{SESSION}-{traced}"
+        if traced:
+            tracemalloc.start()
+        await history.commit(session, graph, GraphCommandsResponse(commands=[]))
+        seeded = stored_bytes(store)
+        started = time.perf_counter()
+        head = (await history.head(session)).number
+        for commands in script:
+            head = (await history.commit(session, graph, commands, base_version=head)).number
+        if traced:
+            cache_mb = tracemalloc.get_traced_memory()[0] / 1e6
+            tracemalloc.stop()
+        else:
+            commit_us = (time.perf_counter() - started) / EDITS * 1e6
+            delta_kb = (stored_bytes(store) - seeded) / EDITS / 1e3
+
+    # What a full snapshot per edit would write instead
+    snapshot_kb = len(fastjson.dumps_bytes(graph.model_dump())) / 1e3
+
+    # Another worker materializing the head from the store
+    started = time.perf_counter()
+    await GraphHistoryStore(store).head(session)
+    cold_ms = (time.perf_counter() - started) * 1e3
+
+    last = await history.head(session)
+    near = await history.get(session, last.number - 10)
+    first = await history.get(session, (await history.log(session))["versions"][0]["version"])
+    check_client_replay(near, last)
+    check_client_replay(first, last)
+    near_us = min(timeit.repeat(lambda: diff_versions(near, last), number=20, repeat=3)) / 20 * 1e6
+    far_ms = min(timeit.repeat(lambda: diff_versions(first, last), number=3, repeat=3)) / 3 * 1e3
+    print(
+        f"{n:>6} {delta_kb:>9.2f} {snapshot_kb:>12.1f} {cache_mb:>9.1f} {commit_us:>10.1f} "
+        f"{cold_ms:>8.1f} {near_us:>13.1f} {far_ms:>12.2f}"
+    )
+
+
+def main():
+    print(f"{EDITS} edits per session")
+    print(
+        f"{'nodes':>6} {'stored KB':>9} {'snapshot KB':>12} {'cache MB':>9} {'commit us':>10} "
+        f"{'cold ms':>8} {'diff near us':>13} {'diff far ms':>12}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for n in (100, 1000, 5000):
+            asyncio.run(run(n, directory))
+
+
+if __name__ == "__main__":
+    main()
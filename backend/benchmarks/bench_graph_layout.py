@@ -0,0 +1,101 @@
+"""
+Server-side layout cost for graphs of increasing size, against a 16 ms frame.
+
+Each case places a batch of new nodes on a graph whose other nodes are
+already laid out: 20 new nodes is what a single voice command creates at
+most, 200 is a large paste. Bulk placement of a whole graph at once is
+reported separately; past a few hundred new nodes discovery mode keeps the
+spiral placement and no longer fits in a frame (the work is bounded by
+FORCE_WORK_BUDGET / FORCE_TIME_BUDGET_S plus writing every position back).
+
+"layout" is the NumPy engine alone; "assign" adds writing positions back
+into the commands and graph models. "frame" marks assign times within 16 ms.
+Expect every case up to 1000 nodes to fit; at 5000 nodes assign takes
+15-20 ms, about a frame, most of it spent on the node models rather than
+the layout itself.
+
+Run from backend/:
+    python -m benchmarks.bench_graph_layout
+"""
+import timeit
+import numpy as np
+from app.schemas.graph import CurrentGraph, GraphCommand, GraphCommandsResponse, Position
+from app.services.graph_commands import optimize_commands
+from app.services.graph_layout import assign_positions, force_layout, layered_layout
+
+SECTION_EVERY = 5
+FRAME_MS = 16.0
+NEW_NODES = (20, 200)
+
+
+def make_commands(n: int, structured: bool) -> GraphCommandsResponse:
+    """n new nodes; in structure mode every fifth is a section chained by "next" and owning the four after it"""
+    commands = [
+        GraphCommand(action="createNode", params={
+            "id": f"node-{i}",
+            "label": f"Node {i}",
+            "type": "section" if i % SECTION_EVERY == 0 else "synth",
+        })
+        for i in range(n)
+    ]
+    if structured:
+        for i in range(n):
+            owner = i - i % SECTION_EVERY
+            if i % SECTION_EVERY == 0 and i + SECTION_EVERY < n:
+                commands.append(GraphCommand(action="connectNodes", params={
+                    "source": f"node-{i}", "target": f"node-{i + SECTION_EVERY}", "relation": "next",
+                }))
+            elif i % SECTION_EVERY:
+                commands.append(GraphCommand(action="connectNodes", params={
+                    "source": f"node-{owner}", "target": f"node-{i}", "relation": "has",
+                }))
+    return GraphCommandsResponse(commands=commands)
+
+
+def best_ms(fn, runs: int) -> float:
+    return min(timeit.repeat(fn, number=runs, repeat=3)) / runs * 1e3
+
+
+def placement(n: int, new: int, mode: str):
+    """The graph with the first n - new nodes pinned where the layered layout puts them, and a response creating the rest"""
+    commands = make_commands(n, mode == "structure")
+    optimized, graph = optimize_commands(CurrentGraph(nodes=[], edges=[]), commands)
+    positions = layered_layout(graph)
+    for node, (x, y) in zip(graph.nodes, positions.tolist()):
+        node.position = Position(x=x, y=y)
+    new_ids = {node.id for node in graph.nodes[n - new:]}
+    response = GraphCommandsResponse(commands=[
+        command for command in optimized.commands
+        if command.action != "createNode" or command.params["id"] in new_ids
+    ])
+    movable = np.array([node.id in new_ids for node in graph.nodes], dtype=bool)
+    return response, graph, movable, positions
+
+
+def report(n: int, new: int, mode: str) -> None:
+    response, graph, movable, positions = placement(n, new, mode)
+    runs = max(3, 2000 // n)
+    if mode == "structure":
+        layout_ms = best_ms(lambda: layered_layout(graph), runs)
+    else:
+        layout_ms = best_ms(lambda: force_layout(graph, movable, positions), runs)
+    assign_ms = best_ms(lambda: assign_positions(response, graph, mode), runs)
+    frame = "yes" if assign_ms <= FRAME_MS else "no"
+    print(f"{n:>6} {new:>5} {mode:>10} {layout_ms:>10.2f} {assign_ms:>10.2f} {frame:>6}")
+
+
+def main():
+    print(f"{'nodes':>6} {'new':>5} {'mode':>10} {'layout ms':>10} {'assign ms':>10} {'frame':>6}")
+    for n in (100, 1000, 5000):
+        for new in NEW_NODES:
+            if new < n:
+                for mode in ("structure", "discovery"):
+                    report(n, new, mode)
+    print("bulk: every node new")
+    for n in (1000, 5000):
+        for mode in ("structure", "discovery"):
+            report(n, n, mode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Request parse + serialize cost per node: untyped dicts with the stdlib json
+module (the previous request path) vs typed graph models with orjson.
+
+Run from backend/:
+    python -m benchmarks.bench_graph_payload
+"""
+import json
+import timeit
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel
+from app.core import fastjson
+from app.schemas.producer import ProducerAnalysisRequest
+
+NODE_TYPES = ["drum", "bassline", "melody", "chord", "synth", "vocal", "fx", "section", "genre"]
+
+
+class LegacyProducerAnalysisRequest(BaseModel):
+    nodes: List[Dict[str, Any]]
+    edges: List[Dict[str, Any]]
+    context: Optional[str] = None
+
+
+def make_payload(n: int) -> bytes:
+    nodes = [
+        {
+            "id": f"node-{i}",
+            "data": {"label": f"Node {i}", "type": NODE_TYPES[i % len(NODE_TYPES)], "key": "C", "bpm": 120},
+            "position": {"x": i * 10.0, "y": i * 5.0},
+        }
+        for i in range(n)
+    ]
+    edges = [
+        {"id": f"edge-{i}", "source": f"node-{i}", "target": f"node-{i + 1}", "label": "next"}
+        for i in range(n - 1)
+    ]
+    return json.dumps({"nodes": nodes, "edges": edges, "context": "Just added: Drums"}).encode()
+
+
+def legacy(body: bytes) -> str:
+    request = LegacyProducerAnalysisRequest(**json.loads(body))
+    types: Dict[str, int] = {}
+    for node in request.nodes:
+        node_type = node.get("data", {}).get("type", "unknown")
+        types[node_type] = types.get(node_type, 0) + 1
+    return json.dumps({"nodes": request.nodes, "edges": request.edges, "stats": types}, indent=2)
+
+
+def typed(body: bytes) -> str:
+    request = ProducerAnalysisRequest(**fastjson.loads(body))
+    types: Dict[str, int] = {}
+    for node in request.nodes:
+        types[node.data.type] = types.get(node.data.type, 0) + 1
+    return fastjson.dumps({"nodes": request.nodes, "edges": request.edges, "stats": types})
+
+
+def main():
+    print(f"{'nodes':>6} {'legacy us/node':>15} {'typed us/node':>14} {'speedup':>8}")
+    for n in (10, 100, 1000, 5000):
+        body = make_payload(n)
+        runs = max(3, 20000 // n)
+        legacy_s = min(timeit.repeat(lambda: legacy(body), number=runs, repeat=3)) / runs
+        typed_s = min(timeit.repeat(lambda: typed(body), number=runs, repeat=3)) / runs
+        print(f"{n:>6} {legacy_s / n * 1e6:>15.2f} {typed_s / n * 1e6:>14.2f} {legacy_s / typed_s:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Recommendation micro-batching under load, against a simulated Gemini.
+
+Requests for distinct graphs arrive as a Poisson process at several rates.
+The fake model answers after a fixed base latency plus a per-output-token
+decode time, so a batch of n compositions takes longer than one. Calls go
+through the Gemini admission limiter sized as one worker of the shipped
+deployment gets it (UPSTREAM_CONCURRENCY and UPSTREAM_MAX_QUEUE for one key,
+split over WEB_CONCURRENCY 2 from render.yaml), and the batcher starts
+batching at min(RECOMMENDATION_BATCH_CONCURRENCY, the limiter's slots), as
+the service does. Reported per rate, batched (the configured
+RECOMMENDATION_BATCH_MAX) vs unbatched (max 1): upstream calls, requests
+rejected by admission (503), prompt tokens sent (estimated at 4 characters
+per token), and p50/p95 latency of the requests that were answered.
+
+Run from backend/:
+    python -m benchmarks.bench_recommendation_batching
+"""
+import asyncio
+import math
+import random
+import re
+import statistics
+import time
+from typing import Dict, List
+from app.core import fastjson
+from app.core.admission import UpstreamBusy, UpstreamLimiter, admission_controller
+from app.core.batching import MicroBatcher
+from app.core.config import settings
+from app.core.key_pool import KeyPool
+from app.schemas.graph import GraphNode
+from app.services import recommendation_service as recommendation_module
+from app.services.model_router import model_router
+from app.services.recommendation_service import recommendation_service
+
+REQUESTS = 150
+RATES_PER_S = (2, 5, 20)
+BASE_LATENCY_S = 0.6
+DECODE_TOKENS_PER_S = 200.0
+OUTPUT_TOKENS_PER_COMPOSITION = 350
+CHARS_PER_TOKEN = 4
+# Workers the shipped deployment runs (render.yaml), each taking its share of the slots
+SHIPPED_WORKERS = 2
+
+_COMPOSITION = re.compile(r"^COMPOSITION \d+:", re.M)
+
+
+class FakeModel:
+    def __init__(self, stats: Dict[str, int]):
+        self.stats = stats
+
+    async def generate_content_async(self, prompt: str):
+        compositions = len(_COMPOSITION.findall(prompt)) or 1
+        self.stats["calls"] += 1
+        self.stats["prompt_tokens"] += len(prompt) // CHARS_PER_TOKEN
+        await asyncio.sleep(BASE_LATENCY_S + compositions * OUTPUT_TOKENS_PER_COMPOSITION / DECODE_TOKENS_PER_S)
+
+        recommendations = [{"instrument_name": "Djembe"}]
+        if compositions == 1 and not _COMPOSITION.search(prompt):
+            body = {"recommendations": recommendations}
+        else:
+            body = {"results": [{"composition": n, "recommendations": recommendations} for n in range(1, compositions + 1)]}
+        return type("Response", (), {"text": fastjson.dumps(body), "usage_metadata": None})()
+
+
+def install_limiter() -> UpstreamLimiter:
+    """A fresh Gemini limiter as one shipped worker holding one key gets it"""
+    limiter = UpstreamLimiter(
+        "gemini",
+        max_concurrent=math.ceil(settings.UPSTREAM_CONCURRENCY["gemini"] / SHIPPED_WORKERS),
+        max_queue=math.ceil(settings.UPSTREAM_MAX_QUEUE["gemini"] / SHIPPED_WORKERS),
+    )
+    admission_controller.upstreams["gemini"] = limiter
+    return limiter
+
+
+def batch_concurrency() -> int:
+    return min(settings.RECOMMENDATION_BATCH_CONCURRENCY, admission_controller.upstreams["gemini"].max_concurrent)
+
+
+async def simulate(rate: float, max_size: int) -> Dict[str, float]:
+    stats = {"calls": 0, "prompt_tokens": 0, "rejected": 0}
+    fake = FakeModel(stats)
+    model_router.model = lambda route, generation_config, api_key: fake
+    install_limiter()
+    service = recommendation_service
+    service._batcher = MicroBatcher(
+        "recommendations",
+        service._generate_batch,
+        settings.RECOMMENDATION_BATCH_WINDOW_S,
+        max_size,
+        batch_concurrency(),
+    )
+
+    rng = random.Random(3)
+    latencies: List[float] = []
+
+    async def one(i: int) -> None:
+        nodes = [GraphNode(id=f"g-{i}", data={"label": f"Genre {i}", "type": "genre"})]
+        started = time.monotonic()
+        try:
+            await service._batcher.submit(i, (nodes, []))
+        except UpstreamBusy:
+            stats["rejected"] += 1
+            return
+        latencies.append(time.monotonic() - started)
+
+    tasks = []
+    for i in range(REQUESTS):
+        tasks.append(asyncio.create_task(one(i)))
+        await asyncio.sleep(rng.expovariate(rate))
+    await asyncio.gather(*tasks)
+
+    latencies.sort()
+    return {
+        "calls": stats["calls"],
+        "rejected": stats["rejected"],
+        "prompt_ktok": stats["prompt_tokens"] / 1000,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+async def run() -> None:
+    limiter = install_limiter()
+    print(
+        f"{REQUESTS} requests, window {settings.RECOMMENDATION_BATCH_WINDOW_S * 1000:.0f} ms, "
+        f"batch max {settings.RECOMMENDATION_BATCH_MAX}, Gemini admission {limiter.max_concurrent} slots "
+        f"+ {limiter.max_queue} queued per worker, batching above "
+        f"min({settings.RECOMMENDATION_BATCH_CONCURRENCY}, {limiter.max_concurrent}) = {batch_concurrency()} running calls"
+    )
+    print(f"{'rate/s':>7} {'mode':>9} {'calls':>6} {'503s':>5} {'prompt ktok':>12} {'p50 s':>7} {'p95 s':>7}")
+    for rate in RATES_PER_S:
+        for mode, max_size in (("unbatched", 1), ("batched", settings.RECOMMENDATION_BATCH_MAX)):
+            result = await simulate(rate, max_size)
+            print(
+                f"{rate:>7} {mode:>9} {result['calls']:>6} {result['rejected']:>5} {result['prompt_ktok']:>12.1f} "
+                f"{result['p50']:>7.2f} {result['p95']:>7.2f}"
+            )
+
+
+def main():
+    # The fake model needs no real key, but calls still lease one
+    recommendation_module.gemini_keys = KeyPool("gemini", ["benchmark"], lambda secret: None)
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
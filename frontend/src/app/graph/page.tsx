@@ -21,6 +21,8 @@ export default function Home() {
   const [mode, setMode] = useState<'structure' | 'discovery'>('discovery');
   const [isProcessing, setIsProcessing] = useState(false);
   const [lastChangeContext, setLastChangeContext] = useState<string | null>(null);
+  // Backend history version the graph is at; cleared by any local edit
+  const [graphVersion, setGraphVersion] = useState<number | undefined>(undefined);
 
   const handleTranscript = async (transcript: string) => {
     if (!transcript.trim()) {
@@ -28,6 +30,7 @@ export default function Home() {
       setEdges([]);
       setManualEdges([]);
       setMode('discovery');
+      setGraphVersion(undefined);
       return;
     }
 
@@ -42,7 +45,7 @@ export default function Home() {
     try {
       // Get commands from LLM - pass all edges (auto + manual)
       const allEdges = [...edges, ...manualEdges];
-      const commands = await getGraphCommands(nodes, allEdges, instruction);
+      const { commands, version } = await getGraphCommands(nodes, allEdges, instruction, mode, graphVersion);
 
       // Track what's being added for producer context
       const addedNodes: string[] = [];
@@ -76,9 +79,17 @@ export default function Home() {
           setEdges(prev => prev.filter(e => e.id !== edgeId));
           setManualEdges(prev => prev.filter(e => e.id !== edgeId));
         },
+        updateNode: (nodeId, changes) => {
+          setNodes(prev => prev.map(n => n.id === nodeId ? { ...n, data: { ...n.data, ...changes } } : n));
+        },
+        updateEdge: (edgeId, changes) => {
+          setEdges(prev => prev.map(e => e.id === edgeId ? { ...e, ...changes } : e));
+          setManualEdges(prev => prev.map(e => e.id === edgeId ? { ...e, ...changes } : e));
+        },
         getNodes: () => nodes,
         getEdges: () => allEdges,
       });
+      setGraphVersion(version);
 
       // If LLM created edges, switch to structure mode (directed graph)
       // Otherwise stay in discovery mode (auto-calculated undirected edges)
@@ -115,7 +126,7 @@ export default function Home() {
     } finally {
       setIsProcessing(false);
     }
-  }, [nodes, edges, manualEdges, mode]);
+  }, [nodes, edges, manualEdges, mode, graphVersion]);
 
   // Note: We don't auto-recalculate edges when nodes change
   // Instead, edges are only calculated when:
@@ -132,6 +143,7 @@ export default function Home() {
       position: { x: Math.random() * 400, y: Math.random() * 400 },
     };
     setNodes([...nodes, newNode]);
+    setGraphVersion(undefined);
   };
 
   const handleNodeDrop = (type: CustomNodeData['type'], position: { x: number; y: number }, customLabel?: string) => {
@@ -145,11 +157,13 @@ export default function Home() {
       position,
     };
     setNodes([...nodes, newNode]);
+    setGraphVersion(undefined);
   };
 
   const handleDeleteNode = (nodeId: string) => {
     setNodes(nodes.filter(node => node.id !== nodeId));
     setManualEdges(manualEdges.filter(edge => edge.source !== nodeId && edge.target !== nodeId));
+    setGraphVersion(undefined);
   };
 
   const handleEditNode = (nodeId: string, newData: CustomNodeData) => {
@@ -162,6 +176,7 @@ export default function Home() {
         ? { ...node, data: newData }
         : node
     ));
+    setGraphVersion(undefined);
 
     // Build context message for AI Producer
     const changes: string[] = [];
@@ -187,16 +202,19 @@ export default function Home() {
 
   const handleDeleteEdge = (edgeId: string) => {
     setManualEdges(manualEdges.filter(edge => edge.id !== edgeId));
+    setGraphVersion(undefined);
   };
 
   const handleAddManualEdge = (edge: Edge) => {
     setManualEdges([...manualEdges, edge]);
+    setGraphVersion(undefined);
   };
 
   const handleClearGraph = () => {
     setNodes([]);
     setEdges([]);
     setManualEdges([]);
+    setGraphVersion(undefined);
   };
 
   return (
@@ -3,6 +3,8 @@
 import { useState, useRef, useEffect } from 'react'
 import { Volume2, VolumeX, Loader2, Sparkles } from 'lucide-react'
 import { Node, Edge } from 'reactflow'
+import { audioAcceptHeader, canStreamMp3, streamAudio } from '@/lib/audioFormat'
+import { sessionHeaders } from '@/lib/session'
 
 interface AIProducerProps {
   nodes: Node[]
@@ -117,11 +119,17 @@ export function AIProducer({
       console.log('Sending producer request with context:', context)
       console.log('Request data:', requestData)
 
+      // When MP3 can be played as it downloads, ask for a spoken opener that
+      // plays while the feedback is still being produced
+      const streaming = canStreamMp3()
+
       const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
-      const response = await fetch(`${API_URL}/api/v1/producer/analyze`, {
+      const response = await fetch(`${API_URL}/api/v1/producer/analyze${streaming ? '?opener=true' : ''}`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Accept': streaming ? 'audio/mpeg' : audioAcceptHeader(),
+          ...sessionHeaders(),
         },
         body: JSON.stringify(requestData),
       })
@@ -139,33 +147,19 @@ export function AIProducer({
         throw new Error(`Failed to get producer feedback: ${errorDetail}`)
       }
 
+      // A newer edit from this session took over; its response will carry the feedback
+      if (response.status === 204) {
+        console.log('Producer request superseded by a newer edit')
+        return
+      }
+
       // Get feedback text from header
       const feedbackFromHeader = response.headers.get('X-Feedback-Text')
       if (feedbackFromHeader) {
         setFeedbackText(feedbackFromHeader)
       }
 
-      // Get audio blob
-      const blob = await response.blob()
-      console.log('Received audio blob:', blob.size, 'bytes, type:', blob.type)
-
-      if (blob.size === 0) {
-        console.warn('Received empty audio, showing text feedback only')
-        setError('Audio generation failed - showing text feedback only')
-        return
-      }
-
-      // Verify we have valid audio data
-      if (blob.size < 100) {
-        console.warn('Audio file too small, likely invalid. Showing text feedback only')
-        setError('Audio too small - showing text feedback only')
-        return
-      }
-
-      const audioUrl = URL.createObjectURL(blob)
-
-      // Create and play audio
-      const audio = new Audio(audioUrl)
+      const audio = new Audio()
       audioRef.current = audio
 
       audio.onplay = () => {
@@ -177,7 +171,7 @@ export function AIProducer({
       audio.onended = () => {
         console.log('Audio playback ended')
         setIsPlaying(false)
-        URL.revokeObjectURL(audioUrl)
+        URL.revokeObjectURL(audio.src)
       }
 
       audio.onerror = (e) => {
@@ -195,19 +189,58 @@ export function AIProducer({
         console.log('Audio can play through without buffering')
       }
 
-      // Load the audio first
-      audio.load()
-
-      // Auto-play the feedback after a small delay to ensure it's loaded
-      console.log('Attempting to play audio...')
-      setTimeout(() => {
+      const play = () => {
         audio.play().catch(err => {
           console.error('Audio play() rejected:', err)
           if (!isPlaying) { // Only show error if playback didn't start
             setError('Click play button to hear feedback (browser blocked auto-play)')
           }
         })
-      }, 100)
+      }
+
+      // Opener response: the opener plays while the feedback audio is still
+      // being produced, and the feedback text is fetched once it has arrived
+      const feedbackId = response.headers.get('X-Feedback-Id')
+      if (feedbackId) {
+        const streamed = streamAudio(response, audio)
+        play()
+        const size = await streamed
+        console.log('Streamed opener and feedback audio:', size, 'bytes')
+
+        const textResponse = await fetch(`${API_URL}/api/v1/producer/feedback/${feedbackId}`, {
+          headers: sessionHeaders(),
+        })
+        if (textResponse.ok) {
+          const { feedback_text } = await textResponse.json()
+          setFeedbackText(feedback_text)
+        }
+        return
+      }
+
+      // Get audio blob
+      const blob = await response.blob()
+      console.log('Received audio blob:', blob.size, 'bytes, type:', blob.type)
+
+      if (blob.size === 0) {
+        console.warn('Received empty audio, showing text feedback only')
+        setError('Audio generation failed - showing text feedback only')
+        return
+      }
+
+      // Verify we have valid audio data
+      if (blob.size < 100) {
+        console.warn('Audio file too small, likely invalid. Showing text feedback only')
+        setError('Audio too small - showing text feedback only')
+        return
+      }
+
+      // Load the audio first
+      audio.src = URL.createObjectURL(blob)
+      audio.load()
+
+      // Auto-play the feedback after a small delay to ensure it's loaded
+      console.log('Attempting to play audio...')
+      setTimeout(play, 100)
     } catch (err) {
       setError(err instanceof Error ? err.message : 'Failed to get producer feedback')
     } finally {
@@ -2,6 +2,8 @@
 
 import { useState } from 'react'
 import { Music, Loader2 } from 'lucide-react'
+import { audioAcceptHeader } from '@/lib/audioFormat'
+import { sessionHeaders } from '@/lib/session'
 
 export function MusicGenerator() {
   const [prompt, setPrompt] = useState('')
@@ -25,6 +27,8 @@ export function MusicGenerator() {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Accept': audioAcceptHeader(),
+          ...sessionHeaders(),
         },
         body: JSON.stringify({
           prompt: prompt,
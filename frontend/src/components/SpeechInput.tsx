@@ -1,6 +1,8 @@
 'use client';
 
 import React, { useState, useEffect, useRef } from 'react';
+import { audioAcceptHeader } from '@/lib/audioFormat';
+import { sessionHeaders } from '@/lib/session';
 
 interface SpeechInputProps {
   onTranscript: (text: string) => void;
@@ -166,6 +168,8 @@ const SpeechInput = ({ onTranscript, nodes = [], edges = [] }: SpeechInputProps)
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Accept': audioAcceptHeader(),
+          ...sessionHeaders(),
         },
         body: JSON.stringify({
           graph_data: graphData,
@@ -0,0 +1,52 @@
+/**
+ * Accept header for audio endpoints: prefer Opus (smaller at the same quality)
+ * when this browser can play it, otherwise MP3.
+ * The backend also honours Save-Data, which data-saver browsers send on their own.
+ */
+export function audioAcceptHeader(): string {
+  if (typeof window === 'undefined') return 'audio/mpeg';
+  const canPlayOpus = new Audio().canPlayType('audio/ogg; codecs="opus"') !== '';
+  return canPlayOpus ? 'audio/ogg;codecs=opus, audio/mpeg;q=0.8' : 'audio/mpeg';
+}
+
+/**
+ * Whether this browser can play MP3 while it is still downloading
+ * (Media Source Extensions). Opener responses only help when it can.
+ */
+export function canStreamMp3(): boolean {
+  return typeof window !== 'undefined' && 'MediaSource' in window && MediaSource.isTypeSupported('audio/mpeg');
+}
+
+/**
+ * Play an MP3 response body through `audio` as it downloads.
+ * Resolves with the number of bytes once the whole body has been appended.
+ */
+export function streamAudio(response: Response, audio: HTMLAudioElement): Promise<number> {
+  const mediaSource = new MediaSource();
+  audio.src = URL.createObjectURL(mediaSource);
+
+  return new Promise((resolve, reject) => {
+    mediaSource.addEventListener('sourceopen', async () => {
+      try {
+        const buffer = mediaSource.addSourceBuffer('audio/mpeg');
+        // Clips concatenated in one response play back to back
+        buffer.mode = 'sequence';
+        const reader = response.body!.getReader();
+        let total = 0;
+        for (;;) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          total += value.byteLength;
+          await new Promise<void>(appended => {
+            buffer.addEventListener('updateend', () => appended(), { once: true });
+            buffer.appendBuffer(value);
+          });
+        }
+        mediaSource.endOfStream();
+        resolve(total);
+      } catch (err) {
+        reject(err);
+      }
+    }, { once: true });
+  });
+}
@@ -4,20 +4,80 @@ import {
   GraphCommand, 
   CreateNodeParams, 
   ConnectNodesParams, 
-  DeleteByIdParams 
+  DeleteByIdParams,
+  UpdateNodeParams,
+  UpdateEdgeParams
 } from '@/types/graphCommands';
+import { sessionHeaders } from '@/lib/session';
 
 export interface CommandDispatcherCallbacks {
   addNode: (node: Node<CustomNodeData>) => void;
   addEdge: (edge: Edge) => void;
   removeNode: (nodeId: string) => void;
   removeEdge: (edgeId: string) => void;
+  updateNode: (nodeId: string, changes: Partial<CustomNodeData>) => void;
+  updateEdge: (edgeId: string, changes: Partial<Edge>) => void;
   getNodes: () => Node<CustomNodeData>[];
   getEdges: () => Edge[];
 }
 
 /**
- * Executes a list of graph commands to update the React Flow diagram
+ * Label, colour and animation of an edge, based on its relation type
+ */
+function relationStyle(relation: string): Partial<Edge> {
+  let edgeColor = '#3b82f6'; // default blue
+  let strokeWidth = 2;
+  let animated = false;
+
+  switch (relation) {
+    case 'next':
+      edgeColor = '#3b82f6'; // blue for sequential
+      strokeWidth = 3;
+      animated = true;
+      break;
+    case 'has':
+      edgeColor = '#10b981'; // green for section-instrument
+      strokeWidth = 2;
+      break;
+    case 'plays-in':
+      edgeColor = '#10b981'; // green for backwards compatibility
+      strokeWidth = 2;
+      break;
+    case 'blends-with':
+      edgeColor = '#06b6d4'; // cyan for harmonic
+      strokeWidth = 2;
+      animated = true;
+      break;
+    case 'supports':
+      edgeColor = '#f59e0b'; // amber for rhythm support
+      strokeWidth = 2;
+      break;
+    case 'influences':
+      edgeColor = '#ec4899'; // pink for genre/mood
+      strokeWidth = 2;
+      break;
+  }
+
+  return {
+    label: relation,
+    animated: animated,
+    style: {
+      stroke: edgeColor,
+      strokeWidth: strokeWidth
+    },
+    markerEnd: {
+      type: MarkerType.ArrowClosed,
+      color: edgeColor,
+    },
+  };
+}
+
+/**
+ * Executes a list of graph commands to update the React Flow diagram.
+ *
+ * Deletes are applied first, then creates, updates and connections, the
+ * order the backend sends them in; a connection whose pair is deleted in
+ * the same batch is therefore re-created rather than skipped.
  */
 export function executeCommands(
   commands: GraphCommand[],
@@ -30,6 +90,8 @@ export function executeCommands(
   const edgesToAdd: Edge[] = [];
   const nodeIdsToDelete: string[] = [];
   const edgeIdsToDelete: string[] = [];
+  const nodeUpdates: [string, Partial<CustomNodeData>][] = [];
+  const edgeUpdates: [string, Partial<Edge>][] = [];
   
   // Get current state
   const currentNodes = callbacks.getNodes();
@@ -93,9 +155,11 @@ export function executeCommands(
             break;
           }
 
-          // Check if edge already exists
+          // Check if edge already exists (and is not being deleted in this batch)
           const edgeExists = currentEdges.some(
-            e => e.source === params.source && e.target === params.target
+            e => e.source === params.source && e.target === params.target &&
+              !edgeIdsToDelete.includes(e.id) &&
+              !nodeIdsToDelete.includes(e.source) && !nodeIdsToDelete.includes(e.target)
           ) || edgesToAdd.some(
             e => e.source === params.source && e.target === params.target
           );
@@ -105,56 +169,15 @@ export function executeCommands(
             break;
           }
 
-          // Determine edge style based on relation type
           const relation = params.relation || 'next';
-          let edgeColor = '#3b82f6'; // default blue
-          let strokeWidth = 2;
-          let animated = false;
-
-          switch (relation) {
-            case 'next':
-              edgeColor = '#3b82f6'; // blue for sequential
-              strokeWidth = 3;
-              animated = true;
-              break;
-            case 'has':
-              edgeColor = '#10b981'; // green for section-instrument
-              strokeWidth = 2;
-              break;
-            case 'plays-in':
-              edgeColor = '#10b981'; // green for backwards compatibility
-              strokeWidth = 2;
-              break;
-            case 'blends-with':
-              edgeColor = '#06b6d4'; // cyan for harmonic
-              strokeWidth = 2;
-              animated = true;
-              break;
-            case 'supports':
-              edgeColor = '#f59e0b'; // amber for rhythm support
-              strokeWidth = 2;
-              break;
-            case 'influences':
-              edgeColor = '#ec4899'; // pink for genre/mood
-              strokeWidth = 2;
-              break;
-          }
 
           const newEdge: Edge = {
-            id: `edge-${params.source}-${params.target}-${Date.now()}`,
+            // Same id the backend gives the edge in its graph history (make_edge)
+            id: `edge-${params.source}-${params.target}`,
             source: params.source,
             target: params.target,
             type: 'custom',
-            label: relation,
-            animated: animated,
-            style: {
-              stroke: edgeColor,
-              strokeWidth: strokeWidth
-            },
-            markerEnd: {
-              type: MarkerType.ArrowClosed,
-              color: edgeColor,
-            },
+            ...relationStyle(relation),
           };
 
           console.log('Queuing edge:', newEdge, 'with relation:', relation);
@@ -172,6 +195,27 @@ export function executeCommands(
           break;
         }
         
+        case 'updateNode': {
+          const params = cmd.params as UpdateNodeParams;
+          if (!allNodesMap.has(params.id)) {
+            console.warn(`Node "${params.id}" not found, skipping update`);
+            break;
+          }
+          const { id, ...changes } = params;
+          nodeUpdates.push([id, changes as Partial<CustomNodeData>]);
+          break;
+        }
+
+        case 'updateEdge': {
+          const params = cmd.params as UpdateEdgeParams;
+          if (!currentEdges.some(e => e.id === params.id)) {
+            console.warn(`Edge "${params.id}" not found, skipping update`);
+            break;
+          }
+          edgeUpdates.push([params.id, relationStyle(params.relation)]);
+          break;
+        }
+
         default:
           console.warn('Unknown command action:', cmd.action);
       }
@@ -183,27 +227,36 @@ export function executeCommands(
   // Execute all changes in batches
   console.log(`Batched updates: ${nodesToAdd.length} nodes, ${edgesToAdd.length} edges`);
   
-  nodesToAdd.forEach(node => callbacks.addNode(node));
-  edgesToAdd.forEach(edge => callbacks.addEdge(edge));
   nodeIdsToDelete.forEach(id => callbacks.removeNode(id));
   edgeIdsToDelete.forEach(id => callbacks.removeEdge(id));
+  nodesToAdd.forEach(node => callbacks.addNode(node));
+  nodeUpdates.forEach(([id, changes]) => callbacks.updateNode(id, changes));
+  edgeUpdates.forEach(([id, changes]) => callbacks.updateEdge(id, changes));
+  edgesToAdd.forEach(edge => callbacks.addEdge(edge));
   
   console.log('All commands executed');
 }
 
 /**
  * Calls the backend API to get graph commands
+ *
+ * `baseVersion` is the history version the graph is at: the `version` this
+ * returned last time, as long as the graph was not edited locally since.
+ * With it the backend records the update without re-reading the graph.
  */
 export async function getGraphCommands(
   currentNodes: Node<CustomNodeData>[],
   currentEdges: Edge[],
-  instruction: string
-): Promise<GraphCommand[]> {
+  instruction: string,
+  mode: 'structure' | 'discovery',
+  baseVersion?: number
+): Promise<{ commands: GraphCommand[]; version?: number }> {
   const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
   const response = await fetch(`${API_URL}/api/v1/graph/update`, {
     method: 'POST',
     headers: {
       'Content-Type': 'application/json',
+      ...sessionHeaders(),
     },
     body: JSON.stringify({
       current_graph: {
@@ -224,6 +277,8 @@ export async function getGraphCommands(
         })),
       },
       instruction,
+      mode,
+      base_version: baseVersion,
     }),
   });
 
@@ -233,6 +288,7 @@ export async function getGraphCommands(
   }
 
   const data = await response.json();
-  return data.commands;
+  const version = response.headers.get('x-graph-version');
+  return { commands: data.commands, version: version !== null ? Number(version) : undefined };
 }
 
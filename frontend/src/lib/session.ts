@@ -0,0 +1,29 @@
+/**
+ * Per-tab composition session id, sent as X-Session-ID.
+ *
+ * The backend keys producer debouncing, music prefetch and graph history on
+ * it; without one, users behind the same NAT would share a session. Kept in
+ * sessionStorage, so it survives reloads but each tab gets its own.
+ */
+const SESSION_STORAGE_KEY = 'jamfusion-session-id';
+
+function newSessionId(): string {
+  if (typeof crypto !== 'undefined' && 'randomUUID' in crypto) {
+    return crypto.randomUUID();
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+}
+
+export function sessionId(): string {
+  if (typeof window === 'undefined') return newSessionId();
+  let id = window.sessionStorage.getItem(SESSION_STORAGE_KEY);
+  if (!id) {
+    id = newSessionId();
+    window.sessionStorage.setItem(SESSION_STORAGE_KEY, id);
+  }
+  return id;
+}
+
+export function sessionHeaders(): Record<string, string> {
+  return { 'X-Session-ID': sessionId() };
+}
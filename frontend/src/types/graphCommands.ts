@@ -27,11 +27,25 @@ export interface DeleteByIdParams {
   id: string;
 }
 
-export type GraphCommandAction = 'createNode' | 'connectNodes' | 'deleteById';
+export interface UpdateNodeParams {
+  id: string;
+  label?: string;
+  type?: string;
+  key?: string;
+  bpm?: number;
+  section?: string;
+}
+
+export interface UpdateEdgeParams {
+  id: string;
+  relation: string;
+}
+
+export type GraphCommandAction = 'createNode' | 'connectNodes' | 'deleteById' | 'updateNode' | 'updateEdge';
 
 export interface GraphCommand {
   action: GraphCommandAction;
-  params: CreateNodeParams | ConnectNodesParams | DeleteByIdParams;
+  params: CreateNodeParams | ConnectNodesParams | DeleteByIdParams | UpdateNodeParams | UpdateEdgeParams;
 }
 
 export interface GraphCommandsResponse {
@@ -46,5 +60,7 @@ export interface CurrentGraph {
 export interface GraphUpdateRequest {
   current_graph: CurrentGraph;
   instruction: string;
+  mode?: 'structure' | 'discovery';
+  base_version?: number;  // History version current_graph is at, from the last x-graph-version header
 }
 